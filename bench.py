@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Benchmarks of Database and Engine
+
+  python bench.py [--data=minidata,gen/x10] [--repeat=3] [--workers=1]
+                  [--users=N] [--out=bench.json]
+                  [--baseline=bench.json] [--tolerance=0.2]
+
+Per data directory, each measurement runs in a forked child so its peak
+memory is its own and the page cache is the only thing shared:
+
+  build    snapshot removed, then every Database phase (parse_test,
+           parse_watching, parse_repos, parse_lang, parse_stats,
+           make_names, make_clusters, make_neighbors, make_cooccur,
+           make_contrib, fill_snapshot = snapshot save)
+  load     Database opening the snapshot, then preload
+  latency  Engine.user_process of each test user (or the first N)
+  process  Engine.process over all test users with --workers
+  matrix   the same with MatrixEngine
+
+Each is repeated and the fastest run kept.  Results are printed and
+written as JSON; with --baseline, any metric worse than the baseline by
+more than the tolerance is reported and the exit status is 1.
+"""
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+import traceback
+
+from matchmaker import msg
+from matchmaker.database import Database
+from matchmaker.engine import Engine
+from matchmaker.matrix import MatrixEngine
+from matchmaker.utils import option, percentile
+
+def main(argv):
+    datadirs = option(argv, 'data', 'minidata').split(",")
+    repeat = int(option(argv, 'repeat', 3))
+    workers = int(option(argv, 'workers', 1))
+    users = int(option(argv, 'users', 0))
+
+    results = {'python': platform.python_version(),
+               'repeat': repeat,
+               'workers': workers,
+               'datasets': {}}
+    for datadir in datadirs:
+        results['datasets'][datadir] = bench(datadir, repeat, workers, users)
+
+    out = option(argv, 'out', 'bench.json')
+    fh = open(out, 'w')
+    json.dump(results, fh, indent=1, sort_keys=True)
+    fh.close()
+
+    metrics = flatten(results['datasets'])
+    for name in sorted(metrics):
+        print("%-50s %14.4f" % (name, metrics[name]))
+
+    baseline = option(argv, 'baseline')
+    if baseline:
+        fh = open(baseline)
+        base = flatten(json.load(fh)['datasets'])
+        fh.close()
+        tolerance = float(option(argv, 'tolerance', 0.2))
+        regressions = compare(metrics, base, tolerance)
+        for name, old, new in regressions:
+            print("REGRESSION %-39s %14.4f -> %.4f" % (name, old, new))
+        if regressions:
+            return 1
+    return 0
+
+def bench(datadir, repeat, workers, users):
+    """Returns dict of measurement = dict of metric = value
+    """
+    msg("benchmarking '%s'" % datadir)
+    results = {}
+    for name, func in (('build', build),
+                       ('load', load),
+                       ('latency', latency),
+                       ('process', process),
+                       ('matrix', matrix)):
+        runs = [isolated(func, datadir, workers, users)
+                for i in xrange(repeat)]
+        results[name] = best(runs)
+    return results
+
+def build(datadir, workers, users):
+    shutil.rmtree('/'.join((datadir, "snapshot")), ignore_errors=True)
+    db = Database(datadir, workers=workers)
+    result = {}
+    # timings start with the failed look for a snapshot
+    for phase, seconds in db.timings[1:]:
+        result[phase] = result.get(phase, 0.0) + seconds
+    result['total'] = sum([seconds for phase, seconds in db.timings])
+    return result
+
+def load(datadir, workers, users):
+    start = time.time()
+    db = Database(datadir, workers=workers)
+    opened = time.time()
+    db.preload()
+    return {'open_snapshot': opened - start,
+            'preload': time.time() - opened,
+            'total': time.time() - start}
+
+def latency(datadir, workers, users):
+    db = Database(datadir, workers=workers)
+    db.preload()
+    engine = Engine(db, batch=False)
+    test_u = sorted(db.test_u)
+    if users:
+        test_u = test_u[:users]
+
+    latencies = []
+    for user in test_u:
+        start = time.time()
+        engine.user_process(user)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    result = dict(('p%d_ms' % p, 1000.0 * percentile(latencies, p))
+                  for p in (50, 95, 99, 100))
+    result['mean_ms'] = 1000.0 * sum(latencies) / max(len(latencies), 1)
+    return result
+
+def process(datadir, workers, users, cls=Engine):
+    db = Database(datadir, workers=workers)
+    start = time.time()
+    engine = cls(db, workers=workers)
+    seconds = time.time() - start
+    return {'seconds': seconds,
+            'users_per_s': len(engine.recommended) / max(seconds, 1e-9)}
+
+def matrix(datadir, workers, users):
+    return process(datadir, workers, users, MatrixEngine)
+
+def isolated(func, *args):
+    """Returns func(*args) computed in a forked child, adding its peak
+    resident memory (and that of its own children) as peak_rss_kb
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 0
+        try:
+            result = func(*args)
+            result['peak_rss_kb'] = max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        except:
+            result = traceback.format_exc()
+            status = 1
+        fh = os.fdopen(wfd, 'wb')
+        pickle.dump(result, fh, pickle.HIGHEST_PROTOCOL)
+        fh.close()
+        os._exit(status)
+
+    os.close(wfd)
+    fh = os.fdopen(rfd, 'rb')
+    result = pickle.load(fh)
+    fh.close()
+    os.waitpid(pid, 0)
+    if not isinstance(result, dict):
+        raise RuntimeError("%s failed:\n%s" % (func.__name__, result))
+    return result
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+def best(runs):
+    """Returns the best value of each metric over runs
+    """
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        result[metric] = max(values) if higher_is_better(metric) \
+                         else min(values)
+    return result
+
+def flatten(datasets):
+    """Returns dict of 'datadir.measurement.metric' = value
+    """
+    metrics = {}
+    for datadir, results in datasets.items():
+        for name, result in results.items():
+            for metric, value in result.items():
+                metrics['.'.join((datadir, name, metric))] = value
+    return metrics
+
+def compare(metrics, base, tolerance):
+    """Returns [(metric, baseline, value)] of metrics worse than their
+    baseline by more than the tolerance (a fraction)
+    """
+    regressions = []
+    for name in sorted(metrics):
+        if name not in base or not base[name]:
+            continue
+        old, new = base[name], metrics[name]
+        if higher_is_better(name):
+            worse = new < old * (1.0 - tolerance)
+        else:
+            worse = new > old * (1.0 + tolerance)
+        if worse:
+            regressions.append((name, old, new))
+    return regressions
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
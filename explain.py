@@ -1,44 +1,74 @@
 #!/usr/bin/env python
 
-from pprint import pprint
+from datetime import date
+from matchmaker import snapshot
 from matchmaker.database import *
+from matchmaker.utils import option
 import sys
 
 def main(argv):
     if len(argv) == 1:
         return
 
-    line = argv[1]
+    print("Loading index...")
+    u_watching, r_meta = open_index(option(argv, 'data', 'data'))
+
+    batch = option(argv, 'batch')
+    if batch:
+        # explain every user:repos line of a results file
+        for line in open(batch):
+            line = line.strip()
+            if line:
+                print("=" * 78)
+                explain(line, u_watching, r_meta)
+        return
+
+    # the user:repos line, wherever it sits among the --options
+    lines = [arg for arg in argv[1:] if not arg.startswith('--')]
+    if lines:
+        explain(lines[0], u_watching, r_meta)
+
+def open_index(datadir):
+    """Returns (u_watching, r_meta) memory-mapped from the snapshot,
+    building the snapshot first if there is no valid one
+    """
+    path = '/'.join((datadir, "snapshot"))
+    manifest = snapshot.read_manifest(path)
+    if manifest is None:
+        print("Building database...")
+        Database(datadir)
+        manifest = snapshot.read_manifest(path)
+
+    fields = snapshot.open_compact(path, manifest, ('u_watching', 'r_meta'))
+    return fields['u_watching'], fields['r_meta']
+
+def explain(line, u_watching, r_meta):
     if line[0] in '+-':
         line = line[1:]
 
     user, repos = line.split(":")
     user = int(user)
-    repos = [int(r) for r in repos.split(",")]
-
-    print("Loading database...")
-    db = Database("data")
+    repos = [int(r) for r in repos.split(",") if r]
 
+    print("user %d" % user)
     print("original watchlist")
-    watching = sorted(db.u_watching[user])
-    for r in watching:
-        print "%6d" % r,
-        if r in db.r_info:
-            print("%18s - %20s - %10s"
-                  % tuple([x[:20] for x in db.r_info[r]]))
-        else:
-            print("")
+    for r in sorted(u_watching[user]):
+        show(r, r_meta)
 
     print("")
     print("new additions")
-    watching = sorted(repos)
-    for r in watching:
-        print "%6d" % r,
-        if r in db.r_info:
-            print("%18s - %20s - %10s"
-                  % tuple([x[:20] for x in db.r_info[r]]))
-        else:
-            print("")
+    for r in sorted(repos):
+        show(r, r_meta)
+
+def show(r, r_meta):
+    print "%6d" % r,
+    if r in r_meta:
+        author, name, creation = r_meta[r].split("\t")
+        creation = date.fromordinal(int(creation)).isoformat()
+        print("%18s - %20s - %10s"
+              % tuple([x[:20] for x in (author, name, creation)]))
+    else:
+        print("")
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
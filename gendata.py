@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""Synthetic contest data
+
+  python gendata.py --out=gen/x10 [--scale=10] [--seed=0]
+
+Writes data.txt, repos.txt, lang.txt and test.txt in the contest formats,
+sized at scale times the contest data (56,521 users, 120,867 repos,
+440,237 watches, 4,788 test users, 73,496 lang rows).  The skew is
+modelled rather than uniform:
+
+  - repos popularity and watches per user follow power laws, and users
+    tend to watch repos related to ones they already watch
+  - forks pick their parent by preferential attachment over originals
+    and earlier forks, giving fork trees several generations deep
+  - a few prolific authors own many repos
+  - names come from families sharing a first word (rails-auth,
+    rails-cache-store, ...) plus a handful of names everybody uses
+  - languages follow each author's preference, with log-normal line
+    counts, and forks inherit their parent's
+
+Everything is drawn from one seeded random.Random, so the same scale and
+seed always write the same files.
+"""
+
+from array import array
+from bisect import bisect_right
+from datetime import date
+import os
+import random
+import sys
+
+from matchmaker import msg
+from matchmaker.utils import option
+
+USERS = 56521
+REPOS = 120867
+WATCHES = 440237
+TEST = 4788
+LANG_FRACTION = 73496.0 / REPOS
+
+FORK_FRACTION = 0.3
+RELATED_FRACTION = 0.3
+COMMON_FRACTION = 0.05
+FIRST_DAY = date(2007, 10, 1).toordinal()
+LAST_DAY = date(2009, 8, 20).toordinal()
+
+SYLLABLES = ("ba be bi bo bu ca ce co da de di do fa fe fi fo ga go ha he "
+             "hi ja jo ka ke ki ko la le li lo lu ma me mi mo mu na ne ni "
+             "no pa pe pi po ra re ri ro ru sa se si so ta te ti to tu va "
+             "ve vi wa we xa ya yo za zo").split()
+COMMON = ("dotfiles blog test homepage config website emacs vimfiles "
+          "scripts sandbox").split()
+LANGS = ("Ruby", "JavaScript", "Python", "Shell", "C", "Perl", "PHP", "Java",
+         "C++", "Objective-C", "Emacs Lisp", "ActionScript", "Erlang", "Lua",
+         "Haskell", "Scheme", "Common Lisp", "Clojure", "Scala", "Tcl",
+         "VimL", "Smalltalk", "Assembly", "OCaml", "D")
+
+class Weighted:
+    """Draws indexes 0..n-1 in proportion to fixed weights
+    """
+    def __init__(self, weights, rng):
+        """Constructor
+        """
+        self.rng = rng
+        self.cumulative = array('d')
+        total = 0.0
+        for w in weights:
+            total += w
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self):
+        i = bisect_right(self.cumulative, self.rng.random() * self.total)
+        return min(i, len(self.cumulative) - 1)
+
+def zipf(n, exponent, rng):
+    """Returns a Weighted over n items whose weights fall off as a power
+    of their rank, ranks shuffled
+    """
+    weights = [1.0 / (k + 1) ** exponent for k in xrange(n)]
+    rng.shuffle(weights)
+    return Weighted(weights, rng)
+
+def word(rng, syllables):
+    return "".join([rng.choice(SYLLABLES) for i in xrange(syllables)])
+
+def unique_words(n, rng, syllables):
+    """Returns n distinct made-up words
+    """
+    words = []
+    seen = set()
+    while len(words) < n:
+        w = word(rng, rng.randint(*syllables))
+        if w in seen:
+            w = "%s%d" % (w, len(words))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    return words
+
+class Generator:
+    def __init__(self, scale=1.0, seed=0):
+        """Constructor
+        """
+        self.rng = random.Random(seed)
+        self.users = max(int(USERS * scale), 10)
+        self.repos = max(int(REPOS * scale), 10)
+        self.watches = max(int(WATCHES * scale), 10)
+        self.test = max(int(TEST * scale), 1)
+
+        rng = self.rng
+        self.authors = unique_words(max(self.repos / 3, 1), rng, (2, 4))
+        self.stems = unique_words(max(int(2000 * scale ** 0.5), 10), rng,
+                                  (2, 3))
+        self.suffixes = unique_words(500, rng, (2, 3))
+
+        # repos id = parent, author, name, creation, langs
+        self.parent = array('i', [0]) * (self.repos + 1)
+        self.author = array('i', [0]) * (self.repos + 1)
+        self.creation = array('i', [0]) * (self.repos + 1)
+        self.name = [None] * (self.repos + 1)
+        self.langs = {}
+        self.authoring = {}
+        self.forks = {}
+
+    def generate(self, outdir):
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        self.make_repos()
+        self.write_repos('/'.join((outdir, "repos.txt")))
+        self.write_lang('/'.join((outdir, "lang.txt")))
+        watched = self.make_watches('/'.join((outdir, "data.txt")))
+        self.write_test('/'.join((outdir, "test.txt")), watched)
+
+    def make_repos(self):
+        msg("making %d repos" % self.repos)
+        rng = self.rng
+        author_by = zipf(len(self.authors), 1.1, rng)
+        stem_by = zipf(len(self.stems), 1.0, rng)
+        lang_by = zipf(len(LANGS), 1.2, rng)
+        preferred = {}
+
+        # each original once, each fork's parent again and the fork itself
+        targets = array('i')
+        span = LAST_DAY - FIRST_DAY
+        for r in xrange(1, self.repos + 1):
+            day = FIRST_DAY + span * r / self.repos + int(rng.gauss(0, 20))
+            day = min(max(day, FIRST_DAY), LAST_DAY)
+            author = author_by.draw()
+
+            if targets and rng.random() < FORK_FRACTION:
+                parent = targets[rng.randrange(len(targets))]
+                if self.author[parent] == author:
+                    author = (author + 1) % len(self.authors)
+                self.parent[r] = parent
+                self.name[r] = self.name[parent]
+                day = max(day, self.creation[parent])
+                self.forks.setdefault(parent, []).append(r)
+                targets.append(parent)
+                if parent in self.langs and rng.random() < 0.9:
+                    self.langs[r] = self.langs[parent]
+            else:
+                self.name[r] = self.make_name(stem_by)
+            targets.append(r)
+
+            self.author[r] = author
+            self.creation[r] = day
+            self.authoring.setdefault(author, []).append(r)
+
+            if not self.parent[r] and rng.random() < LANG_FRACTION:
+                if author not in preferred:
+                    preferred[author] = lang_by.draw()
+                self.langs[r] = self.make_langs(preferred[author], lang_by)
+
+    def make_name(self, stem_by):
+        rng = self.rng
+        if rng.random() < COMMON_FRACTION:
+            return rng.choice(COMMON)
+        words = [self.stems[stem_by.draw()]]
+        for i in xrange(rng.choice((0, 0, 1, 1, 2, 3))):
+            words.append(rng.choice(self.suffixes))
+        return rng.choice("-_").join(words)
+
+    def make_langs(self, preferred, lang_by):
+        """Returns ((lang, lines), ...) led by the preferred language
+        """
+        rng = self.rng
+        count = min(int(rng.paretovariate(2.5)), 6)
+        langs = [preferred] if rng.random() < 0.7 else []
+        while len(langs) < count:
+            lang = lang_by.draw()
+            if lang not in langs:
+                langs.append(lang)
+        return tuple([(LANGS[lang], int(rng.lognormvariate(7.5, 2.2)) + 1)
+                      for lang in langs or [preferred]])
+
+    def related(self, r):
+        """Returns a repos near r: its parent, a fork or a sibling by the
+        same author
+        """
+        rng = self.rng
+        choices = []
+        if self.parent[r]:
+            choices.append(self.parent[r])
+        if r in self.forks:
+            choices.append(rng.choice(self.forks[r]))
+        choices.append(rng.choice(self.authoring[self.author[r]]))
+        return rng.choice(choices)
+
+    def make_watches(self, path):
+        """Writes data.txt, returns the users with watches
+        """
+        rng = self.rng
+        weights = [rng.paretovariate(1.1) * (0.1 if self.parent[r] else 1.0)
+                   for r in xrange(1, self.repos + 1)]
+        repos_by = Weighted(weights, rng)
+
+        # watches per user: power law, scaled to the wanted total
+        counts = [min(rng.paretovariate(1.3), 1000.0)
+                  for u in xrange(self.users)]
+        factor = float(self.watches) / sum(counts)
+        cap = max(self.repos / 20, 1)
+        counts = [min(max(int(c * factor), 1), cap) for c in counts]
+        msg("making %d watches of %d users" % (sum(counts), self.users))
+
+        users = range(1, self.users + 1)
+        rng.shuffle(users)
+        fh = open(path, 'w')
+        for user, count in zip(users, counts):
+            watching = []
+            seen = set()
+            while len(watching) < count:
+                if watching and rng.random() < RELATED_FRACTION:
+                    r = self.related(rng.choice(watching))
+                else:
+                    r = repos_by.draw() + 1
+                if r not in seen:
+                    seen.add(r)
+                    watching.append(r)
+            fh.write("".join(["%d:%d\n" % (user, r) for r in watching]))
+        fh.close()
+        return sorted(users)
+
+    def write_repos(self, path):
+        fh = open(path, 'w')
+        for r in xrange(1, self.repos + 1):
+            line = "%d:%s/%s,%s" % (r, self.authors[self.author[r]],
+                                    self.name[r],
+                                    date.fromordinal(self.creation[r]))
+            if self.parent[r]:
+                line += ",%d" % self.parent[r]
+            fh.write(line + "\n")
+        fh.close()
+
+    def write_lang(self, path):
+        fh = open(path, 'w')
+        for r in sorted(self.langs):
+            fh.write("%d:%s\n" % (r, ",".join(["%s;%d" % lang
+                                               for lang in self.langs[r]])))
+        fh.close()
+
+    def write_test(self, path, users):
+        test_u = sorted(self.rng.sample(users, min(self.test, len(users))))
+        fh = open(path, 'w')
+        fh.write("".join(["%d\n" % u for u in test_u]))
+        fh.close()
+
+def main(argv):
+    outdir = option(argv, 'out')
+    if not outdir:
+        print("usage: gendata.py --out=dir [--scale=1] [--seed=0]")
+        return 1
+    Generator(float(option(argv, 'scale', 1)),
+              int(option(argv, 'seed', 0))).generate(outdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -2,7 +2,10 @@
 
 import sys
 
-__all__ = ['database', 'engine', 'kmeans']
+__all__ = ['checkpoint', 'clusters', 'contrib', 'cooccur', 'database',
+           'engine', 'ingest', 'kmeans', 'matrix', 'names', 'neighbors',
+           'profiler', 'rank', 'relation', 'server', 'shards', 'snapshot',
+           'stats', 'trace', 'utils']
 
 def msg(info):
     """Debug output"""
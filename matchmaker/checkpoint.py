@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Checkpoint log of a production run
+
+Scored users are appended to the log as results.txt lines, "user:r1,r2,
+...", every `every` users or `seconds` seconds, each batch flushed and
+synced to disk.  Only a write cut short can damage the log, and only at
+its end: on opening, lines are read up to the first one that is not a
+complete, well-formed line, and the rest is truncated.  A restarted run
+skips the users found in the log, which is deleted once the results are
+written.
+
+The final results are streamed from the log: only the offset of each
+user's line is kept in memory, and lines are read back in user order.
+"""
+
+import os
+import re
+import time
+
+from matchmaker import msg
+from matchmaker.utils import option
+
+LINE = re.compile(r'^(\d+):(\d+(,\d+)*)?\n$')
+
+def line(user, r_list):
+    """Returns the results line of user
+    """
+    return ':'.join((str(user), ','.join([str(r) for r in r_list])))
+
+class Checkpoint:
+    def __init__(self, path, every=1000, seconds=60.0):
+        """Constructor
+
+        path: the log, appended to
+        every: users buffered before they are written out
+        seconds: most time a scored user waits to be written out
+        """
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.offsets = {}
+        self.buffer = []
+        self.fh = None
+        self.written = time.time()
+
+    def load(self):
+        """Reads the log, dropping a torn tail, and returns the users
+        already in it
+        """
+        self.offsets = {}
+        if not os.path.exists(self.path):
+            return set()
+        fh = open(self.path, 'rb')
+        pos = 0
+        for text in fh:
+            match = LINE.match(text)
+            if not match:
+                break
+            self.offsets[int(match.group(1))] = pos
+            pos += len(text)
+        fh.close()
+        size = os.path.getsize(self.path)
+        if pos < size:
+            msg("checkpoint: dropping %d torn bytes of %s"
+                % (size - pos, self.path))
+            fh = open(self.path, 'r+b')
+            fh.truncate(pos)
+            fh.close()
+        return set(self.offsets)
+
+    def add(self, user, r_list):
+        """Buffers the recommendations of user, writing the buffer out
+        when it is full or old enough
+        """
+        self.buffer.append((user, line(user, r_list) + "\n"))
+        if len(self.buffer) >= self.every \
+               or time.time() - self.written >= self.seconds:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered users to the log and syncs it
+        """
+        if self.buffer:
+            if self.fh is None:
+                self.fh = open(self.path, 'ab')
+            self.fh.seek(0, os.SEEK_END)
+            pos = self.fh.tell()
+            for user, text in self.buffer:
+                self.offsets[user] = pos
+                pos += len(text)
+            self.fh.write(''.join([text for user, text in self.buffer]))
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.buffer = []
+        self.written = time.time()
+
+    def close(self):
+        self.flush()
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def lines(self):
+        """Yields the results lines of the log, by user
+        """
+        self.close()
+        fh = open(self.path, 'rb')
+        try:
+            for user in sorted(self.offsets):
+                fh.seek(self.offsets[user])
+                yield fh.readline().rstrip("\n")
+        finally:
+            fh.close()
+
+    def remove(self):
+        """Deletes the log, once the results are safely written
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.offsets = {}
+
+def from_argv(argv, default=None):
+    """Returns the Checkpoint of --checkpoint=path (default path if not
+    given), flushed every --checkpoint-every=1000 users or
+    --checkpoint-seconds=60; None without a path
+    """
+    path = option(argv, 'checkpoint', default)
+    if not path:
+        return None
+    return Checkpoint(path,
+                      every=int(option(argv, 'checkpoint-every', 1000)),
+                      seconds=float(option(argv, 'checkpoint-seconds', 60)))
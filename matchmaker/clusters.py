@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""Clusters of similar users, for fallback recommendations
+
+Users are clustered with matchmaker.kmeans on a compact profile of what
+they watch:
+
+  - the share of each common language in the watched repos, weighted by
+    1 + log10 of their lines (r_langs), the rest as "other"
+  - log10(1 + watched repos) / 3
+  - mean log10(1 + watchers) of the watched repos / 3
+  - the share of forks among the watched repos
+
+Each cluster keeps its most watched repos, ties broken by lowest repos
+id.  A user with too few scores gets those of its cluster, skipping the
+repos it already watches: one label lookup and a walk down a short list.
+Users outside the snapshot get the label of the nearest centroid to
+their profile, and users watching nothing get the label of the empty
+profile.
+
+New watches do not rerun k-means: the users they touch are labelled
+against the existing centroids, and only the popular repos of the
+clusters they leave or join are recounted.
+"""
+
+from array import array
+from math import log
+
+from matchmaker import msg
+from matchmaker.kmeans import KMeans, numpy
+from matchmaker.relation import Column, IntMap, Relation, prefixed, \
+     unprefixed
+
+class UserClusters:
+    """Centroids, user labels and popular repos per cluster
+
+    languages: the languages profiled, by share of repos
+    centroids: k rows of the profile size, flattened
+    labels: user = 1 + cluster, 0 for users not clustered
+    popular: cluster = repos, most watched first
+    depth: popular repos kept per cluster
+    """
+    kind = 'clusters'
+
+    def __init__(self, languages=(), centroids=None, labels=None,
+                 popular=None, empty=0, depth=100):
+        """Constructor
+
+        empty: cluster of users watching nothing
+        """
+        self.languages = list(languages)
+        self.centroids = centroids if centroids is not None else Column('d')
+        self.labels = labels if labels is not None else IntMap()
+        self.popular = popular if popular is not None else Relation()
+        self.empty = empty
+        self.depth = depth
+        self.index = dict((lang, i) for i, lang in enumerate(languages))
+
+    def columns(self):
+        columns = {'centroids': self.centroids}
+        columns.update(prefixed('labels', self.labels.columns()))
+        columns.update(prefixed('popular', self.popular.columns()))
+        return columns
+
+    def meta(self):
+        return {'languages': self.languages,
+                'empty': self.empty,
+                'depth': self.depth,
+                'labels': self.labels.meta(),
+                'popular': self.popular.meta()}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(meta['languages'], columns['centroids'],
+                   IntMap.from_columns(unprefixed('labels', columns),
+                                       meta['labels']),
+                   Relation.from_columns(unprefixed('popular', columns),
+                                         meta['popular']),
+                   meta['empty'], meta.get('depth', 100))
+
+    def __len__(self):
+        return len(self.popular)
+
+    def nbytes(self):
+        return (self.centroids.nbytes() + self.labels.nbytes()
+                + self.popular.nbytes())
+
+    def dims(self):
+        return len(self.languages) + 4
+
+    def profile(self, watching, db):
+        """Returns the profile of a user watching the repos watching
+        """
+        r_langs = db.r_langs
+        r_watchers = db.r_watchers
+        parent_of_r = db.parent_of_r
+        langs = [0.0] * (len(self.languages) + 1)
+        other = len(self.languages)
+        popularity = 0.0
+        forks = 0
+        for r in watching:
+            for lang, lnloc in r_langs.get(r, ()):
+                langs[self.index.get(lang, other)] += 1.0 + lnloc
+            if r < len(r_watchers):
+                popularity += log(1 + r_watchers[r], 10)
+            if parent_of_r[r] > 0:
+                forks += 1
+        total = sum(langs)
+        if total:
+            langs = [x / total for x in langs]
+        n = len(watching)
+        if not n:
+            return langs + [0.0, 0.0, 0.0]
+        return langs + [log(1 + n, 10) / 3, popularity / n / 3,
+                        float(forks) / n]
+
+    def nearest(self, profile):
+        """Returns the cluster whose centroid is nearest to profile
+        """
+        dims = len(profile)
+        centroids = self.centroids.slice(0, len(self.centroids))
+        best, best_d = 0, None
+        for c in xrange(len(centroids) / dims):
+            d = 0.0
+            for i in xrange(dims):
+                x = profile[i] - centroids[c * dims + i]
+                d += x * x
+            if best_d is None or d < best_d:
+                best, best_d = c, d
+        return best
+
+    def label(self, user, db):
+        """Returns the cluster of user
+        """
+        label = self.labels[user]
+        if label:
+            return label - 1
+        watching = db.u_watching.get(user, ())
+        if not watching:
+            return self.empty
+        return self.nearest(self.profile(watching, db))
+
+    def top_repos(self, user, db, n=10):
+        """Returns the n most watched repos of the cluster of user that it
+        does not watch
+        """
+        watching = set(db.u_watching.get(user, ()))
+        top = []
+        for r in self.popular[self.label(user, db)]:
+            if r not in watching:
+                top.append(r)
+                if len(top) >= n:
+                    break
+        return top
+
+    def build(self, db, k=64, depth=100, languages=20, seed=0):
+        """Clusters the users of db.u_watching
+
+        k: number of clusters
+        depth: popular repos kept per cluster
+        languages: most common languages profiled separately
+        """
+        if numpy is None:
+            msg("numpy is not available, users are not clustered")
+            return self
+        counts = {}
+        for langs in db.r_langs.itervalues():
+            for lang, lnloc in langs:
+                counts[lang] = counts.get(lang, 0) + 1
+        self.languages = sorted(counts, key=lambda x:(-counts[x], x))
+        self.languages = self.languages[:languages]
+        self.index = dict((lang, i) for i, lang in enumerate(self.languages))
+
+        users = sorted(db.u_watching.keys())
+        msg("clustering %d users in %d clusters" % (len(users), k))
+        data = numpy.array([self.profile(db.u_watching[u], db)
+                            for u in users])
+        km = KMeans(k, seed=seed).fit(data)
+        self.centroids = Column('d', array('d', km.centroids.ravel()))
+        self.empty = int(km.predict([[0.0] * self.dims()])[0])
+        self.labels = IntMap.from_dict(dict(
+            (u, label + 1) for u, label in zip(users, km.labels.tolist())))
+
+        self.depth = depth
+        self.popular = Relation.from_dict(
+            self.count_popular(db, users, km.labels.tolist()))
+        return self
+
+    def count_popular(self, db, users, labels):
+        """Returns dict of cluster = its depth most watched repos, ties
+        broken by lowest repos id, counted over users labelled labels
+        """
+        size = len(db.r_watchers)
+        clusters = []
+        repos = []
+        for u, label in zip(users, labels):
+            watching = db.u_watching[u]
+            clusters.extend([label] * len(watching))
+            repos.extend(watching)
+        keys, watches = numpy.unique(
+            numpy.array(clusters, numpy.int64) * size
+            + numpy.array(repos, numpy.int64), return_counts=True)
+        order = numpy.argsort(-watches, kind='mergesort')
+        order = order[numpy.argsort(keys[order] // size, kind='mergesort')]
+        keys = keys[order]
+        clusters = keys // size
+        ranks = numpy.arange(len(keys)) - numpy.searchsorted(clusters,
+                                                             clusters)
+        keys = keys[ranks < self.depth]
+        popular = {}
+        for cluster, r in zip((keys // size).tolist(), (keys % size).tolist()):
+            popular.setdefault(cluster, []).append(r)
+        return popular
+
+    def updated(self, db, users):
+        """Labels users (those whose watches changed) by the nearest
+        centroid to their profile, recounts the clusters they leave or
+        join and returns self
+        """
+        if numpy is None or not len(self) or not users:
+            return self
+        users = sorted(users)
+        dims = self.dims()
+        centroids = numpy.frombuffer(self.centroids.tostring(),
+                                     numpy.float64).reshape(-1, dims)
+        km = KMeans(len(centroids))
+        km.centroids = centroids
+        labels = km.predict([self.profile(db.u_watching.get(u, ()), db)
+                             for u in users]).tolist()
+
+        current = self.labels.dense()
+        current = numpy.frombuffer(current.tostring(),
+                                   numpy.dtype(current.typecode))
+        current = current.astype(numpy.int64)
+        size = max(len(current), users[-1] + 1)
+        values = numpy.zeros(size, numpy.int64)
+        values[:len(current)] = current
+        touched = set([label - 1 for label in values[users].tolist()
+                       if label])
+        touched.update(labels)
+        values[users] = numpy.array(labels) + 1
+        msg("relabelled %d users, recounting %d clusters"
+            % (len(users), len(touched)))
+
+        members = numpy.flatnonzero(
+            numpy.in1d(values, numpy.array(sorted(touched)) + 1))
+        popular = dict(self.popular.iteritems())
+        for cluster in touched:
+            popular.pop(cluster, None)
+        popular.update(self.count_popular(
+            db, members.tolist(), (values[members] - 1).tolist()))
+        self.labels = IntMap.from_dict(dict(
+            (u, label) for u, label in enumerate(values.tolist()) if label))
+        self.popular = Relation.from_dict(popular)
+        return self
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""Per-repository contribution vectors
+
+Most of what a watched repository adds to a user's scores does not
+depend on the user: its forks, its parent's and grandparent's families
+and their authors' repos, and repos sharing its author, name or name
+prefixes.  Each of these parts is compiled into a sparse vector of
+(candidate, weight) entries, so scoring a watched repos is a sum of
+vectors instead of a walk over the relations and popularity arrays.
+
+A part is keyed by what it depends on, so repos sharing a parent, author
+or name share one vector:
+
+  fork     the repos itself       forks, r_pop2
+  parent   its parent             parent 2, siblings r_pop2, their
+                                  authors' repos 0.5 * r_pop2
+  gparent  its parent again       3, 1 and 1 of the above, keyed like
+                                  Engine's gparent_of_r (= parent_of_r)
+  author   its author id          author's repos 1.5 * r_pop2, id desc
+  name     its name id            same-name repos r_pop1
+  prefix   its name id            prefix families 0.25 * i * r_pop1 of
+                                  the last same-name repos
+
+The entries of a candidate are merged into one, in order of first
+appearance, and a part shared by several watched repos is added once,
+scaled by how many share it.  Candidates are first touched in the same
+order as before, so rankings are unchanged; a score may differ from the
+old sums in its last bits.  Only the parts of repos watched by test
+users are stored; any other is compiled on the fly from the Database.
+
+After new rows, stale_keys() finds the keys whose vectors read a repos
+that is new or whose popularity moved, and updated() recompiles those
+and copies the others.
+"""
+
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from matchmaker import msg
+from matchmaker.names import name_prefixes
+from matchmaker.relation import Column
+
+PARTS = ('fork', 'parent', 'gparent', 'author', 'name', 'prefix')
+
+def part_key(part, r, db):
+    """Returns the key of the part of repos r
+    """
+    if part == 'fork':
+        return r
+    elif part in ('parent', 'gparent'):
+        return db.parent_of_r[r]
+    elif part == 'author':
+        return db.r_author_id[r]
+    return db.r_name_id[r]
+
+def compile_part(part, r, db):
+    """Returns the part of repos r as a list of (candidate, weight)
+    """
+    r_info = db.r_info
+    r_pop1 = db.r_pop1
+    r_pop2 = db.r_pop2
+    vector = []
+
+    if part == 'fork':
+        vector.extend([(r1, r_pop2[r1]) for r1 in db.forks_of_r[r]])
+
+    elif part in ('parent', 'gparent'):
+        parent = db.parent_of_r[r]
+        base, share = (2, 0.5) if part == 'parent' else (3, None)
+        vector.append((parent, base))
+        for r1 in db.forks_of_r[parent]:
+            vector.append((r1, r_pop2[r1]))
+            if r1 in r_info:
+                authored = db.u_authoring[r_info[r1][0]]
+                if share is None:
+                    vector.extend([(r2, r_pop2[r2]) for r2 in authored])
+                else:
+                    vector.extend([(r2, share * r_pop2[r2])
+                                   for r2 in authored])
+
+    elif part == 'author':
+        authored = sorted(db.u_authoring[r_info[r][0]], reverse=True)
+        vector.extend([(r1, 1.5 * r_pop2[r1]) for r1 in authored])
+
+    elif part == 'name':
+        name_r = db.names.repos[db.r_name_id[r]]
+        vector.extend([(r1, r_pop1[r1]) for r1 in name_r])
+
+    elif part == 'prefix':
+        name_id = db.r_name_id[r]
+        # weighted by the last same-name repos, as the engine's loop
+        # variable used to leak into this signal
+        last = db.names.repos[name_id][-1]
+        for i, prefix_id in enumerate(db.names.prefixes[name_id]):
+            weight = 0.25 * (i + 1) * r_pop1[last]
+            vector.extend([(r2, weight)
+                           for r2 in db.names.prefix_repos[prefix_id]])
+
+    return merged(vector)
+
+def compile_arrays(part, r, db, pops):
+    """Returns compile_part(part, r, db) as (candidates, weights) numpy
+    arrays, summed by numpy in the same order so weights are identical
+
+    pops: (r_pop1, r_pop2) as numpy arrays
+    """
+    r_pop1, r_pop2 = pops
+    segments = []
+
+    def add(repos, weights):
+        segments.append((repos, weights))
+
+    if part == 'fork':
+        forks = numpy.array(db.forks_of_r[r], numpy.int64)
+        add(forks, r_pop2[forks])
+
+    elif part in ('parent', 'gparent'):
+        parent = db.parent_of_r[r]
+        base, share = (2, 0.5) if part == 'parent' else (3, None)
+        add(numpy.array([parent]), numpy.array([float(base)]))
+        r_info = db.r_info
+        for r1 in db.forks_of_r[parent]:
+            add(numpy.array([r1]), r_pop2[[r1]])
+            if r1 in r_info:
+                authored = numpy.array(db.u_authoring[r_info[r1][0]],
+                                       numpy.int64)
+                if share is None:
+                    add(authored, r_pop2[authored])
+                else:
+                    add(authored, share * r_pop2[authored])
+
+    elif part == 'author':
+        authored = sorted(db.u_authoring[db.r_info[r][0]], reverse=True)
+        authored = numpy.array(authored, numpy.int64)
+        add(authored, 1.5 * r_pop2[authored])
+
+    elif part == 'name':
+        name_r = numpy.array(db.names.repos[db.r_name_id[r]], numpy.int64)
+        add(name_r, r_pop1[name_r])
+
+    elif part == 'prefix':
+        name_id = db.r_name_id[r]
+        last = db.names.repos[name_id][-1]
+        for i, prefix_id in enumerate(db.names.prefixes[name_id]):
+            weight = 0.25 * (i + 1) * db.r_pop1[last]
+            family = numpy.array(db.names.prefix_repos[prefix_id],
+                                 numpy.int64)
+            add(family, numpy.repeat(weight, len(family)))
+
+    if not segments:
+        return numpy.zeros(0, numpy.int64), numpy.zeros(0)
+    repos = numpy.concatenate([seg[0] for seg in segments])
+    weights = numpy.concatenate([seg[1] for seg in segments])
+    if not len(repos):
+        return repos, weights
+    # merged(): summed per candidate in order, by first appearance
+    unique, first, inverse = numpy.unique(repos, return_index=True,
+                                          return_inverse=True)
+    sums = numpy.bincount(inverse, weights, len(unique))
+    order = numpy.argsort(first, kind='mergesort')
+    return unique[order], sums[order]
+
+def stale_keys(db, touched, new=()):
+    """Returns dict of part = keys whose vectors depend on the repos in
+    touched (repos whose watchers changed) or in new (new repos)
+
+    Such a repos feeds the vectors of its own parent, author and name,
+    and the family vectors of the parents of its author's forks.  A new
+    repos also joins the prefix families of its name, read by the prefix
+    vectors of every name filed under them.
+    """
+    stale = dict((part, set()) for part in PARTS)
+    authors = set()
+    new = set(new)
+    for r in set(touched) | new:
+        parent = db.parent_of_r[r]
+        if parent > 0:
+            stale['fork'].add(parent)
+            stale['parent'].add(parent)
+            stale['gparent'].add(parent)
+        if r in db.r_info:
+            authors.add(db.r_info[r][0])
+            stale['author'].add(db.r_author_id[r])
+            stale['name'].add(db.r_name_id[r])
+            stale['prefix'].add(db.r_name_id[r])
+            if r not in new:
+                continue
+            for prefix in name_prefixes(db.r_info[r][1]):
+                stale['prefix'].update([db.r_name_id[r1]
+                                        for r1 in db.r_prefixes[prefix]])
+    for author in authors:
+        for r in db.u_authoring[author]:
+            parent = db.parent_of_r[r]
+            if parent > 0:
+                stale['parent'].add(parent)
+                stale['gparent'].add(parent)
+    return stale
+
+def merged(vector):
+    """Returns vector with the weights of each candidate summed, in order
+    of first appearance
+    """
+    weights = {}
+    order = []
+    for r1, weight in vector:
+        if r1 in weights:
+            weights[r1] += weight
+        else:
+            weights[r1] = weight
+            order.append(r1)
+    return [(r1, weights[r1]) for r1 in order]
+
+class Contributions:
+    """Stored parts, each as flat columns
+
+    offsets[part]: offsets[k]:offsets[k + 1] slices the vector of key k
+    repos[part]: candidates
+    weights[part]: what each adds to the candidate's score
+    """
+    kind = 'contrib'
+
+    def __init__(self, offsets=None, repos=None, weights=None):
+        self.offsets = offsets or dict((p, Column('l')) for p in PARTS)
+        self.repos = repos or dict((p, Column('i')) for p in PARTS)
+        self.weights = weights or dict((p, Column('d')) for p in PARTS)
+
+    def columns(self):
+        columns = {}
+        for part in PARTS:
+            columns[part + ".off"] = self.offsets[part]
+            columns[part + ".repos"] = self.repos[part]
+            columns[part + ".w"] = self.weights[part]
+        return columns
+
+    def meta(self):
+        return {}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(dict((p, columns[p + ".off"]) for p in PARTS),
+                   dict((p, columns[p + ".repos"]) for p in PARTS),
+                   dict((p, columns[p + ".w"]) for p in PARTS))
+
+    def vector(self, part, r, db):
+        """Returns the part of repos r as (candidates, weights) arrays,
+        compiled on the fly if it is not stored
+        """
+        k = part_key(part, r, db)
+        offsets = self.offsets[part]
+        if 0 <= k < len(offsets) - 1 and offsets[k + 1] > offsets[k]:
+            start, end = offsets[k], offsets[k + 1]
+            return (self.repos[part].subarray(start, end),
+                    self.weights[part].subarray(start, end))
+        compiled = compile_part(part, r, db)
+        return (array('i', [r1 for r1, weight in compiled]),
+                array('d', [weight for r1, weight in compiled]))
+
+    def nbytes(self):
+        return sum([self.offsets[p].nbytes() + self.repos[p].nbytes()
+                    + self.weights[p].nbytes() for p in PARTS])
+
+    def build(self, db, watched):
+        """Compiles and stores the parts of the watched repos
+        """
+        msg("compiling contribution vectors of %d repos" % len(watched))
+        for part in PARTS:
+            self.store(part, db, representatives(part, db, watched))
+        return self
+
+    def updated(self, db, watched, previous, stale, renumbered=None):
+        """Returns new Contributions for the watched repos, recompiling
+        the keys in stale (dict of part = keys) and new keys, and copying
+        the others
+
+        previous: the watched repos the stored vectors were compiled for
+        renumbered: dict of part = array of the new key of each old key,
+                    for parts whose keys were renumbered
+        """
+        renumbered = renumbered or {}
+        result = Contributions()
+        for part in PARTS:
+            first = representatives(part, db, watched)
+            known = representatives(part, db, previous)
+            offsets = array('l', self.offsets[part].tostring())
+            repos = array('i', self.repos[part].tostring())
+            weights = array('d', self.weights[part].tostring())
+
+            # old key of each new key
+            old_keys = {}
+            new_keys = renumbered.get(part)
+            for k in xrange(len(offsets) - 1):
+                if offsets[k + 1] > offsets[k]:
+                    old_keys[k if new_keys is None else new_keys[k]] = k
+            copied = {}
+            for k in first:
+                if k in stale[part]:
+                    continue
+                if k in old_keys:
+                    copied[k] = old_keys[k]
+                elif k in known:
+                    # stored empty
+                    copied[k] = None
+            msg("contribution part %s: %d of %d vectors recompiled"
+                % (part, len(first) - len(copied), len(first)))
+            result.store(part, db, first, copied, offsets, repos, weights)
+
+            # unchanged columns stay those of the snapshot
+            for field, old in (('offsets', offsets), ('repos', repos),
+                               ('weights', weights)):
+                columns = getattr(result, field)
+                if columns[part].buf == old:
+                    columns[part] = getattr(self, field)[part]
+        return result
+
+    def store(self, part, db, first, copied=None, offsets=None, repos=None,
+              weights=None):
+        """Stores the vectors of part keyed by first (dict of key =
+        representative repos), copying those of the keys in copied (dict
+        of key = old key into offsets, repos and weights, or None for an
+        empty vector)
+        """
+        copied = copied or {}
+        if numpy is not None:
+            pops = (numpy.frombuffer(db.r_pop1, numpy.float64),
+                    numpy.frombuffer(db.r_pop2, numpy.float64))
+        new_offsets = array('l', [0])
+        new_repos = array('i')
+        new_weights = array('d')
+        for k in xrange(max(first.keys() or [-1]) + 1):
+            if k in copied:
+                if copied[k] is None:
+                    new_offsets.append(len(new_repos))
+                    continue
+                start, end = offsets[copied[k]], offsets[copied[k] + 1]
+                new_repos.extend(repos[start:end])
+                new_weights.extend(weights[start:end])
+            elif k in first and numpy is not None:
+                candidates, values = compile_arrays(part, first[k], db, pops)
+                new_repos.fromstring(candidates.astype(numpy.intc).tostring())
+                new_weights.fromstring(values.tostring())
+            elif k in first:
+                for r1, weight in compile_part(part, first[k], db):
+                    new_repos.append(r1)
+                    new_weights.append(weight)
+            new_offsets.append(len(new_repos))
+
+        self.offsets[part] = Column('l', new_offsets)
+        self.repos[part] = Column('i', new_repos)
+        self.weights[part] = Column('d', new_weights)
+
+def representatives(part, db, watched):
+    """Returns dict of key = lowest watched repos of that key, for the
+    watched repos having part
+    """
+    first = {}
+    for r in sorted(watched):
+        if part in ('parent', 'gparent') and db.parent_of_r[r] <= 0:
+            continue
+        if part in ('author', 'name', 'prefix') and r not in db.r_info:
+            continue
+        first.setdefault(part_key(part, r, db), r)
+    return first
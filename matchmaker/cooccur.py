@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Repository co-occurrence index
+
+For every repository, keeps the top-N other repositories watched by the
+same users along with the number of users watching both.  Replaces the
+r_matrix_fwd/r_matrix_bkwd MySQL tables.
+"""
+
+from array import array
+from collections import defaultdict
+from heapq import nlargest
+from itertools import izip
+from matchmaker import msg
+from matchmaker.relation import Column
+
+class Cooccurrence:
+    """Sparse top-N co-occurrence index stored as flat columns
+
+    offsets: offsets[r]:offsets[r + 1] slices repos/counts for repos r
+    repos: co-watched repository ids, best first
+    counts: number of users watching both repositories
+    """
+    kind = 'cooccur'
+
+    def __init__(self, top_n=20, offsets=None, repos=None, counts=None):
+        """Constructor
+        """
+        self.top_n = top_n
+        self.offsets = offsets if offsets is not None else Column('l')
+        self.repos = repos if repos is not None else Column('i')
+        self.counts = counts if counts is not None else Column('i')
+
+    def columns(self):
+        return {'off': self.offsets, 'repos': self.repos, 'counts': self.counts}
+
+    def meta(self):
+        return {'top_n': self.top_n}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(meta['top_n'],
+                   columns['off'], columns['repos'], columns['counts'])
+
+    def __getitem__(self, r):
+        """Returns list of (repos, count), highest count first
+        """
+        if not 0 <= r < len(self.offsets) - 1:
+            return []
+        start, end = self.offsets[r], self.offsets[r + 1]
+        return zip(self.repos.slice(start, end), self.counts.slice(start, end))
+
+    def __contains__(self, r):
+        return (0 <= r < len(self.offsets) - 1
+                and self.offsets[r + 1] > self.offsets[r])
+
+    def __len__(self):
+        return len(self.repos)
+
+    def row(self, r, u_watching, watching_r):
+        """Returns the top-N (repos, count) co-watched with r
+        """
+        cooccur = defaultdict(int)
+        for user in watching_r.get(r, ()):
+            for r1 in u_watching[user]:
+                cooccur[r1] += 1
+        cooccur.pop(r, None)
+
+        # ties broken by lowest repos id
+        return nlargest(self.top_n, cooccur.iteritems(),
+                        key=lambda x:(x[1], -x[0]))
+
+    def build(self, u_watching, watching_r):
+        """Count co-watched repos one repository at a time, keeping only
+        the top-N per repository so memory stays O(N * repos)
+        """
+        msg("building co-occurrence index (top %d)" % self.top_n)
+        offsets = array('l', [0])
+        repos = array('i')
+        counts = array('i')
+
+        max_r = max(watching_r.keys()) if watching_r else -1
+        for r in xrange(max_r + 1):
+            for r1, count in self.row(r, u_watching, watching_r):
+                repos.append(r1)
+                counts.append(count)
+            offsets.append(len(repos))
+
+            if r % 10000 == 0:
+                msg("co-occurrence iter %d" % r)
+
+        self.offsets = Column('l', offsets)
+        self.repos = Column('i', repos)
+        self.counts = Column('i', counts)
+        return self
+
+    def updated(self, added, u_watching, watching_r):
+        """Returns a new index after the watches in added (dict of user =
+        repos newly watched), already in u_watching and watching_r
+
+        Rows of newly watched repos are recounted.  In any other row a
+        new watch can only raise the counts of the newly watched repos,
+        so those entries are bumped in place: an entry missing from a
+        full row is counted exactly by intersecting both watcher lists,
+        while one missing from a row that is not full had a count of 0.
+        """
+        new_r = set()
+        for repos in added.itervalues():
+            new_r.update(repos)
+        bumps = defaultdict(lambda: defaultdict(int))
+        for user, repos in added.iteritems():
+            for r in u_watching[user]:
+                if r not in new_r:
+                    for r1 in repos:
+                        bumps[r][r1] += 1
+        msg("recounting %d co-occurrence rows, bumping %d"
+            % (len(new_r), len(bumps)))
+
+        watchers = {}
+        def common(r, r1):
+            if r1 not in watchers:
+                watchers[r1] = set(watching_r[r1])
+            w = watchers[r1]
+            return len([u for u in watching_r[r] if u in w])
+
+        old_offsets = array('l', self.offsets.tostring())
+        old_repos = array('i', self.repos.tostring())
+        old_counts = array('i', self.counts.tostring())
+        offsets = array('l', [0])
+        repos = array('i')
+        counts = array('i')
+        size = max([len(old_offsets) - 1] + [r + 1 for r in new_r])
+        for r in xrange(size):
+            if r in new_r:
+                row = self.row(r, u_watching, watching_r)
+            elif r in bumps:
+                start, end = old_offsets[r], old_offsets[r + 1]
+                row = dict(izip(old_repos[start:end], old_counts[start:end]))
+                full = end - start >= self.top_n
+                for r1, n in bumps[r].iteritems():
+                    if r1 in row:
+                        row[r1] += n
+                    elif full:
+                        row[r1] = common(r, r1)
+                    else:
+                        row[r1] = n
+                row = nlargest(self.top_n, row.iteritems(),
+                               key=lambda x:(x[1], -x[0]))
+            else:
+                if r < len(old_offsets) - 1:
+                    start, end = old_offsets[r], old_offsets[r + 1]
+                    repos.extend(old_repos[start:end])
+                    counts.extend(old_counts[start:end])
+                offsets.append(len(repos))
+                continue
+            for r1, count in row:
+                repos.append(r1)
+                counts.append(count)
+            offsets.append(len(repos))
+
+        return Cooccurrence(self.top_n, Column('l', offsets),
+                            Column('i', repos), Column('i', counts))
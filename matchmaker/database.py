@@ -1,37 +1,65 @@
 #!/usr/bin/env python
 
-try:
-    import cPickle as pickle
-except:
-    import pickle
-try:
-    from itertools import permutations
-except:
-    from matchmaker.utils import permutations
-from datetime import date
-import MySQLdb as mysqldb
+from bisect import bisect_left, bisect_right
+import multiprocessing
 import os
+import time
 
 from math import log
 from collections import defaultdict
+from heapq import nlargest
 from pprint import pprint
-from matchmaker import msg
-from matchmaker.kmeans import *
+from matchmaker import ingest, msg, stats
+from matchmaker.clusters import UserClusters
+from matchmaker.contrib import Contributions, stale_keys
+from matchmaker.cooccur import Cooccurrence
+from matchmaker.names import NameIndex, name_prefixes
+from matchmaker.neighbors import build_neighbors, updated_neighbors
+from matchmaker.relation import IntMap, KeyedRelation, RecordTable, \
+     Relation, boxed_size
+from matchmaker import snapshot
+
+# repos kept per (language, lnloc) bucket of lang_index
+LANG_DEPTH = 10
 
 class Database:
-    def __init__(self, datadir):
+    def __init__(self, datadir, workers=None, lang_depth=LANG_DEPTH):
         """Constructor
+
+        workers: processes used to parse large files (default: all cores)
+        lang_depth: repos kept per lang_index bucket, applied when the
+                    snapshot is built
         """
         self.datadir = datadir
+        self.workers = workers or multiprocessing.cpu_count()
+        self.lang_depth = lang_depth
         self.test_u = []
         self.top_repos = []
-        self.r_matrix = {} # special pickling
-        self.u_matrix = {} # special pickling
-        self.r_idf_avg = {}
-        self.fields = ['test_u', 'top_repos', 'r_idf_avg']
-        self.save_db = False
-
-        if self.pickle_jar():
+        self.r_cooccur = Cooccurrence()
+        self.r_contrib = Contributions()
+        self.names = NameIndex()
+        self.clusters = UserClusters()
+        self.u_neighbors = {}
+        self.arrays = ('r_watchers', 'r_pop1', 'r_pop2', 'r_idf', 'r_idf_avg',
+                       'r_author_id', 'r_name_id', 'r_created', 'created_days',
+                       'created_r')
+        self.fields = ['test_u', 'top_repos', 'u_neighbors', 'r_cooccur',
+                       'r_contrib', 'names', 'clusters']
+        self.fields.extend(self.arrays)
+        self.compact = {'watching_r': Relation,
+                        'u_watching': Relation,
+                        'forks_of_r': Relation,
+                        'parent_of_r': IntMap,
+                        'gparent_of_r': IntMap,
+                        'u_authoring': KeyedRelation,
+                        'r_name': KeyedRelation,
+                        'r_prefixes': KeyedRelation,
+                        'lang_index': KeyedRelation}
+        self.u_sorted = None # built on first local_top_repos
+        self.local_top = {}
+        self.timings = [] # (phase, seconds) of this load or build
+
+        if self.timed(self.open_snapshot):
             return
 
         fields = (
@@ -43,11 +71,11 @@ class Database:
             ("r_langs       repos      = lang, kloc",             list),
             ("r_lang_tuple  repos      = tuple_of_langs",         list),
             ("r_prefixes    prefix     = repos",                  list),
-            ("r_idf         repos      = user, tf_idf",           list),
             ("forks_of_r    parent     = child",                  list),
             ("parent_of_r   child      = parent",                 int),
             ("gparent_of_r  child      = grandparent",            int),
             ("lang_by_r     lang       = kloc, repos",            list),
+            ("lang_index    lang:lnloc = repos",                  list),
             ("u_authoring   author     = repos",                  list),
         )
         for defn, datatype in fields:
@@ -57,44 +85,101 @@ class Database:
         self.fields.sort()
 
         # collect data
-        self.parse_test()
-        self.parse_watching()
-        self.parse_repos()
-        self.parse_lang()
-
-        self.fill_pickle_jar()
-
-    def pickle_jar(self):
-
-        jar = '/'.join((self.datadir, "pickle.jar"))
-        if os.path.exists(jar):
-            try:
-                jarf = open(jar, 'r')
-                d = pickle.load(jarf)
-                jarf.close()
-            except:
-                return False
-
-            self.fields = d['fields']
-            for field in self.fields:
-                setattr(self, field, d[field])
-            return True
-        else:
-            return False
-
-    def fill_pickle_jar(self):
-        jar = '/'.join((self.datadir, "pickle.jar"))
-        d = {}
+        for phase in (self.parse_test,
+                      self.parse_watching,
+                      self.parse_repos,
+                      self.parse_lang,
+                      self.parse_stats,
+                      self.make_names,
+                      self.make_clusters,
+                      self.make_neighbors,
+                      self.make_cooccur,
+                      self.make_contrib,
+                      self.fill_snapshot,
+                      self.open_snapshot):
+            self.timed(phase)
+
+    def timed(self, phase):
+        """Runs phase (a method), noting its wall time in timings
+        """
+        start = time.time()
+        result = phase()
+        self.timings.append((phase.__name__, time.time() - start))
+        return result
 
-        msg("Filling pickle jar '%s'" % jar)
+    def __getattr__(self, name):
+        """Unpickles snapshot fields on first access
+        """
+        lazy = self.__dict__.get('lazy', ())
+        if name not in lazy:
+            raise AttributeError(name)
+        value = snapshot.load_field(self.snapshot_path(), name)
+        lazy.remove(name)
+        setattr(self, name, value)
+        return value
+
+    def snapshot_path(self):
+        return '/'.join((self.datadir, "snapshot"))
+
+    def open_snapshot(self):
+        """Opens the snapshot: compact relations are memory-mapped and
+        the other fields are unpickled on first access
+        """
+        path = self.snapshot_path()
+        manifest = snapshot.read_manifest(path)
+        if manifest is None:
+            return False
 
+        for field, rel in snapshot.open_compact(path, manifest).items():
+            setattr(self, field, rel)
+        for field, values in snapshot.read_arrays(path, manifest).items():
+            setattr(self, field, values)
+        self.lazy = set(manifest['pickled'])
+        for field in self.lazy:
+            self.__dict__.pop(field, None)
+        self.fields = sorted(manifest['compact'].keys()
+                             + manifest['arrays'].keys()
+                             + manifest['pickled'])
+        return True
+
+    def fill_snapshot(self, unchanged=()):
+        """Writes the snapshot
+
+        unchanged: pickled and array fields left as the snapshot has them
+        """
+        compact = {'r_cooccur': self.r_cooccur, 'r_contrib': self.r_contrib,
+                   'names': self.names, 'clusters': self.clusters}
+        # r_info as records, for explain.py to read without the Database
+        if 'r_info' in unchanged:
+            compact['r_meta'] = self.r_meta
+        else:
+            compact['r_meta'] = RecordTable.from_dict(dict(
+                (r, "\t".join((author, name, str(creation))))
+                for r, (author, name, creation) in self.r_info.iteritems()))
+        pickled = {}
+        arrays = {}
         for field in self.fields:
-            d[field] = getattr(self, field)
-        d['fields'] = self.fields
+            if field in self.compact:
+                rel = getattr(self, field)
+                if not isinstance(rel, self.compact[field]):
+                    rel = self.compact[field].from_dict(rel)
+                compact[field] = rel
+            elif field in self.arrays:
+                arrays[field] = getattr(self, field)
+            elif field in compact:
+                continue
+            elif field in unchanged:
+                pickled[field] = None
+            else:
+                pickled[field] = getattr(self, field)
+        snapshot.write(self.snapshot_path(), compact, pickled, arrays,
+                       unchanged)
 
-        jarf = open(jar, 'w')
-        pickle.dump(d, jarf)
-        jarf.close()
+    def preload(self):
+        """Unpickles all remaining snapshot fields, e.g. before forking
+        """
+        for field in list(self.__dict__.get('lazy', ())):
+            getattr(self, field)
 
     def summary(self, unabridged=False):
         props = ("watching_r "
@@ -120,231 +205,294 @@ class Database:
             pprint(self.test_u)
         else:
             pprint(self.test_u[:5])
+        print("")
+
+        msg("memory: compact vs dict of lists")
+        total_compact = total_boxed = 0
+        for field in sorted(self.compact):
+            rel = getattr(self, field)
+            compact, boxed = rel.nbytes(), boxed_size(rel)
+            total_compact += compact
+            total_boxed += boxed
+            print("%-14s %12d %12d %6.1fx"
+                  % (field, compact, boxed, float(boxed) / max(compact, 1)))
+        print("%-14s %12d %12d %6.1fx"
+              % ("total", total_compact, total_boxed,
+                 float(total_boxed) / max(total_compact, 1)))
+
+    def created_between(self, first, last):
+        """Returns the repos created from ordinal first to last inclusive,
+        oldest first
+        """
+        lo = bisect_left(self.created_days, first)
+        hi = bisect_right(self.created_days, last)
+        return self.created_r[lo:hi].tolist()
+
+    def fallback_repos(self, user, n=10):
+        """Returns n popular repos for user: the most watched in its
+        cluster, or without clusters among users with nearby ids
+        """
+        if not len(self.clusters):
+            return self.local_top_repos(user, n)
+        top = self.clusters.top_repos(user, self, n)
+        for r in self.top_repos:
+            if len(top) >= n:
+                break
+            if r not in top:
+                top.append(r)
+        return top
+
+    def local_top_repos(self, user, n=10, radius=250):
+        """Returns the n most watched repos among users whose id is within
+        radius of user (exclusive), ties broken by lowest repos id
+        """
+        if (user, n, radius) in self.local_top:
+            return self.local_top[(user, n, radius)]
+
+        if self.u_sorted is None:
+            self.u_sorted = sorted(self.u_watching.keys())
+        lo = bisect_right(self.u_sorted, user - radius)
+        hi = bisect_left(self.u_sorted, user + radius)
+
+        counts = defaultdict(int)
+        for u in self.u_sorted[lo:hi]:
+            for r in self.u_watching[u]:
+                counts[r] += 1
+        top = nlargest(n, counts.iteritems(), key=lambda x:(x[1], -x[0]))
+        top = [x[0] for x in top]
+
+        # pad with unwatched repos, as a sort over all of watching_r would
+        if len(top) < n:
+            for r in sorted(self.watching_r.keys()):
+                if r not in counts:
+                    top.append(r)
+                    if len(top) >= n:
+                        break
+
+        self.local_top[(user, n, radius)] = top
+        return top
+
+    def apply_delta(self, deltadir):
+        """Applies new rows in deltadir/{data,repos,lang}.txt in place,
+        appends them to the source files and rewrites the snapshot
+        columns that changed
+
+        Relations are extended and the per-repos arrays, names and
+        lang_index rebuilt, all array passes.  Co-occurrence rows,
+        neighbours and contribution vectors are only recomputed where the
+        rows touch them, so the result matches a full rebuild.  Users
+        whose watches changed are labelled against the existing cluster
+        centroids instead of rerunning k-means.
+        """
+        appended = {}
+        changed = set()
+
+        # repos.txt
+        path = '/'.join((deltadir, "repos.txt"))
+        new_r = []
+        if os.path.exists(path):
+            msg("applying %s" % path)
+            forks, parents, authoring, names, prefixes = (
+                defaultdict(list), {}, defaultdict(list),
+                defaultdict(list), defaultdict(list))
+            for line in ingest.lines(path):
+                repos, parent, author, name, creation = \
+                    ingest.repos_record(line)
+                if repos in self.r_info:
+                    continue
+                new_r.append(repos)
+                appended.setdefault("repos.txt", []).append(line)
+                if parent > 0:
+                    forks[parent].append(repos)
+                    parents[repos] = parent
+                self.r_info[repos] = (author, name, creation)
+                authoring[author].append(repos)
+                names[name].append(repos)
+                for prefix in name_prefixes(name):
+                    prefixes[prefix].append(repos)
+
+        if new_r:
+            self.forks_of_r = self.forks_of_r.extended(forks)
+            self.parent_of_r = self.parent_of_r.updated(parents)
+            self.u_authoring = self.u_authoring.extended(authoring)
+            self.r_name = self.r_name.extended(names)
+            self.r_prefixes = self.r_prefixes.extended(prefixes)
+
+            # new repos may be the parent or the grandparent of others
+            gparents = {}
+            children = set(parents)
+            for repos in new_r:
+                children.update(self.forks_of_r[repos])
+                for r1 in self.forks_of_r[repos]:
+                    children.update(self.forks_of_r[r1])
+            for repos in children:
+                parent = self.parent_of_r[repos]
+                if parent in self.parent_of_r:
+                    gparents[repos] = self.parent_of_r[parent]
+            self.gparent_of_r = self.gparent_of_r.updated(gparents)
+            changed.update(['r_info', 'forks_of_r', 'parent_of_r',
+                            'gparent_of_r', 'u_authoring', 'r_name',
+                            'r_prefixes'])
+
+        # lang.txt
+        path = '/'.join((deltadir, "lang.txt"))
+        lang_r = set()
+        if os.path.exists(path):
+            msg("applying %s" % path)
+            langs_changed = set()
+            for line in ingest.lines(path):
+                repos, langs = ingest.lang_record(line)
+                if repos in self.r_langs:
+                    continue
+                appended.setdefault("lang.txt", []).append(line)
+                lang_r.add(repos)
+                for kloc, lang in langs:
+                    lnloc = int(log(kloc + 1, 10))
+                    self.lang_by_r[lang].append((lnloc, repos))
+                    self.r_langs[repos].append((lang, lnloc))
+                    langs_changed.add(lang)
+            for lang in langs_changed:
+                self.lang_by_r[lang].sort(key=lambda x:x[1])
+        if lang_r:
+            changed.update(['r_langs', 'lang_by_r'])
+
+        # data.txt
+        path = '/'.join((deltadir, "data.txt"))
+        u_added, r_added = defaultdict(list), defaultdict(list)
+        if os.path.exists(path):
+            msg("applying %s" % path)
+            for line in ingest.lines(path):
+                user, repos = ingest.watch_record(line)
+                if repos in u_added[user] or repos in self.u_watching[user]:
+                    continue
+                appended.setdefault("data.txt", []).append(line)
+                u_added[user].append(repos)
+                r_added[repos].append(user)
+        u_added = dict((u, repos) for u, repos in u_added.items() if repos)
+        previous = set()
+        for user in self.test_u:
+            previous.update(self.u_watching[user])
+        if u_added:
+            self.u_watching = self.u_watching.extended(u_added)
+            self.watching_r = self.watching_r.extended(r_added)
+            changed.update(['u_watching', 'watching_r'])
+
+        if not appended:
+            msg("nothing to apply")
+            return
+
+        old = dict((field, getattr(self, field))
+                   for field in self.arrays + ('top_repos',))
+        self.parse_stats()
+        changed.update([field for field in old
+                        if getattr(self, field) != old[field]])
+        self.make_lang_index()
+        if new_r:
+            self.make_names()
+
+        # contribution vectors reading new repos or moved popularities
+        renumbered = {}
+        if new_r:
+            for parts, field in ((('author',), 'r_author_id'),
+                                 (('name', 'prefix'), 'r_name_id')):
+                ids = stats.renumbering(old[field], getattr(self, field))
+                for part in parts:
+                    renumbered[part] = ids
+        watched = set()
+        for user in self.test_u:
+            watched.update(self.u_watching[user])
+        self.r_contrib = self.r_contrib.updated(
+            self, watched, previous, stale_keys(self, r_added, new_r),
+            renumbered)
+
+        if u_added:
+            self.r_cooccur = self.r_cooccur.updated(u_added, self.u_watching,
+                                                    self.watching_r)
+            touched = updated_neighbors(self.u_neighbors, self.test_u,
+                                        u_added, self.u_watching,
+                                        self.watching_r)
+            msg("updated neighbours of %d users" % len(touched))
+            if touched:
+                changed.add('u_neighbors')
+
+        # cluster profiles follow watches and languages
+        relabelled = set(u_added)
+        for repos in lang_r:
+            relabelled.update(self.watching_r.get(repos, ()))
+        self.clusters = self.clusters.updated(self, relabelled)
+
+        self.u_sorted = None
+        self.local_top = {}
+
+        for name, lines in appended.items():
+            path = '/'.join((self.datadir, name))
+            fh = open(path, 'ab+')
+            fh.seek(0, os.SEEK_END)
+            if fh.tell():
+                fh.seek(-1, os.SEEK_END)
+                if fh.read(1) != "\n":
+                    fh.write("\n")
+            fh.write("".join([line + "\n" for line in lines]))
+            fh.close()
+
+        unchanged = set(self.fields) - changed
+        unchanged.discard('r_meta')
+        self.fill_snapshot(unchanged)
+        self.open_snapshot()
 
     def parse_watching(self):
         """Parse data.txt which has main user-repository relationships
         """
 
         msg("parsing data.txt")
-        lines = file('/'.join((self.datadir, "data.txt"))).read().split("\n")
+        path = '/'.join((self.datadir, "data.txt"))
 
-        test_r = set()
-        pairs = [[int(x) for x in line.split(":")] for line in lines if line]
-        for user, repos in pairs:
+        for user, repos in ingest.records('watch', path, self.workers):
             self.watching_r[repos].append(user)
             self.u_watching[user].append(repos)
 
-            if user in self.test_u:
-                test_r.add(repos)
-
-        msg("calculating tf-idf")
-        iter = 0
-        total_users = float(len(self.u_watching))
-        for repos, users in self.watching_r.items():
-            idf_repos = log(total_users / (1.0 + len(self.watching_r[repos])))
-            tf_idf_avg = 0.0
-            for user in users:
-                tf_user = 1.0 / len(self.u_watching[user])
-                tf_idf = tf_user * idf_repos
-                tf_idf_avg += tf_idf
-                self.r_idf[repos].append((user, tf_idf))
-
-                # counter
-                iter += 1
-                if iter % 10000 == 0:
-                    msg("tf-idf iter %d" % iter)
-            self.r_idf_avg[repos] = tf_idf_avg / len(users)
-
-        msg("making top_repos")
-        top_repos = sorted(self.watching_r.items(),
-                           key=lambda x:len(x[1]),
-                           reverse=True)
-        self.top_repos = [repos[0] for repos in top_repos[:50]]
-
-        if not self.save_db:
-            return
-
-        conn = mysqldb.connect(host='127.0.0.1',
-                               user='root',
-                               passwd='',
-                               db='matrix')
-        c = conn.cursor()
-
-        iter = 0
-        values = []
-        msg("making u_matrix_fwd")
-        users = sorted(self.u_watching.keys())
-        for i in xrange(len(users)):
-            for j in xrange(i + 1, len(users)):
-                s_i = set(self.u_watching[users[i]])
-                s_j = set(self.u_watching[users[j]])
-
-                diff = len(set.symmetric_difference(s_i, s_j))
-                values.append("(%d,%d,SQRT(%d))" % (users[i], users[j], diff))
-
-                iter += 1
-                if iter % 10000 == 0:
-                    sql = "".join(("INSERT INTO u_matrix_fwd(u1,u2,val) VALUES",
-                                   ",".join(values)))
-                    c.execute(sql)
-                    conn.commit()
-                    values = []
-                    msg("umf iter %d" % iter)
-        if values:
-            sql = "".join(("INSERT INTO u_matrix_fwd(u1,u2,val) VALUES",
-                           ",".join(values)))
-            c.execute(sql)
-            conn.commit()
-            msg("umf iter %d [END]" % iter)
-
-        iter = 0
-        values = []
-        msg("making u_matrix_bkwd")
-        users = sorted(self.u_watching.keys(), reverse=True)
-        for i in xrange(len(users)):
-            for j in xrange(i + 1, len(users)):
-                s_i = set(self.u_watching[users[i]])
-                s_j = set(self.u_watching[users[j]])
-
-                diff = len(set.symmetric_difference(s_i, s_j))
-                values.append("(%d,%d,SQRT(%d))" % (users[i], users[j], diff))
-
-                iter += 1
-                if iter % 10000 == 0:
-                    sql = "".join(("INSERT INTO u_matrix_bkwd(u1,u2,val) VALUES",
-                                   ",".join(values)))
-                    c.execute(sql)
-                    conn.commit()
-                    values = []
-                    msg("umb iter %d" % iter)
-        if values:
-            sql = "".join(("INSERT INTO u_matrix_bkwd(u1,u2,val) VALUES",
-                           ",".join(values)))
-            c.execute(sql)
-            conn.commit()
-            msg("umb iter %d [END]" % iter)
-
-        return
-        # ------------------------------------------------------------
-
-        iter = 0
-        msg("making r_matrix_fwd")
-        for repos in self.u_watching.values():
-            repos.sort()
-            for i in xrange(len(repos)):
-                for j in xrange(i + 1, len(repos)):
-                    r_i, r_j = repos[i], repos[j]
-
-                    if r_i not in self.r_matrix:
-                        self.r_matrix[r_i] = {r_j: 1}
-                    elif r_j not in self.r_matrix[r_i]:
-                        self.r_matrix[r_i][r_j] = 1
-                    else:
-                        self.r_matrix[r_i][r_j] += 1
-
-                    iter += 1
-                    if iter % 100000 == 0:
-                        msg("[] iter %d" % iter)
-        iter = 0
-        msg("saving r_matrix_fwd")
-        values = []
-        for r_i in self.r_matrix:
-            for r_j in self.r_matrix[r_i]:
-                values.append("(%d,%d,%d)"
-                              % (r_i, r_j, self.r_matrix[r_i][r_j]))
-                iter += 1
-                if iter % 5000 == 0:
-                    sql = "".join(("INSERT INTO r_matrix_fwd(r1,r2,val) VALUES",
-                                   ",".join(values)))
-                    c.execute(sql)
-                    values = []
-                if iter % 10000 == 0:
-                    msg("DB iter %d" % iter)
-                    conn.commit()
-        if values:
-            sql = "".join(("INSERT INTO r_matrix_fwd(r1,r2,val) VALUES",
-                           ",".join(values)))
-            c.execute(sql)
-
-
-        iter = 0
-        msg("making r_matrix_bkwd")
-        for repos in self.u_watching.values():
-            repos.sort(reverse=True)
-            for i in xrange(len(repos)):
-                for j in xrange(i + 1, len(repos)):
-                    r_i, r_j = repos[i], repos[j]
-
-                    if r_i not in self.r_matrix:
-                        self.r_matrix[r_i] = {r_j: 1}
-                    elif r_j not in self.r_matrix[r_i]:
-                        self.r_matrix[r_i][r_j] = 1
-                    else:
-                        self.r_matrix[r_i][r_j] += 1
-
-                    iter += 1
-                    if iter % 100000 == 0:
-                        msg("[] iter %d" % iter)
-        iter = 0
-        msg("saving r_matrix_bkwd")
-        values = []
-        for r_i in self.r_matrix:
-            for r_j in self.r_matrix[r_i]:
-                values.append("(%d,%d,%d)"
-                              % (r_i, r_j, self.r_matrix[r_i][r_j]))
-                iter += 1
-                if iter % 5000 == 0:
-                    sql = "".join(("INSERT INTO r_matrix_bkwd(r1,r2,val) VALUES",
-                                   ",".join(values)))
-                    c.execute(sql)
-                    values = []
-                if iter % 10000 == 0:
-                    msg("DB iter %d" % iter)
-                    conn.commit()
-        if values:
-            sql = "".join(("INSERT INTO r_matrix_bkwd(r1,r2,val) VALUES",
-                           ",".join(values)))
-            c.execute(sql)
-
-
+    def parse_stats(self):
+        """Per-repos statistics as arrays indexed by repos id
+        """
 
+        msg("calculating watcher counts and tf-idf")
+        # parents and repos of lang.txt may be missing from repos.txt
+        # but are still candidates
+        size = 1 + max(max(self.watching_r.keys() or [0]),
+                       max(self.r_info.keys() or [0]),
+                       max([p for c, p in self.parent_of_r.items()] or [0]),
+                       max(self.r_langs.keys() or [0]))
+        rs, tf = stats.edges(self.u_watching)
+        self.r_watchers = stats.watchers(rs, size)
+        self.r_pop1 = stats.popularity(self.r_watchers, 1)
+        self.r_pop2 = stats.popularity(self.r_watchers, 2)
+        self.r_idf, self.r_idf_avg = stats.tf_idf(rs, tf, self.r_watchers,
+                                                  len(self.u_watching))
+        self.r_author_id = stats.labels(self.r_info, 0, size)
+        self.r_name_id = stats.labels(self.r_info, 1, size)
+        self.r_created, self.created_days, self.created_r = \
+            stats.creation(self.r_info, size)
 
+        msg("making top_repos")
+        self.top_repos = stats.top(self.r_watchers, 50)
 
     def parse_repos(self):
         """Parse repos.txt which has repository lineage information
         """
 
         msg("parsing repos.txt")
-        lines = file('/'.join((self.datadir, "repos.txt"))).read().split("\n")
-
-        pairs = [line.replace(":", ",").split(",") for line in lines if line]
-        pairs = [tuple([int(pair[0]),
-                        int(pair[3]) if pair[3:4] else 0,
-                        pair[1],
-                        pair[2]])
-                 for pair in pairs]
+        path = '/'.join((self.datadir, "repos.txt"))
 
-        for repos, parent, name, creation in pairs:
+        for repos, parent, author, name, creation in ingest.records(
+                'repos', path, self.workers):
             if parent > 0:
                 self.forks_of_r[parent].append(repos)
                 self.parent_of_r[repos] = parent
-            author, name = name.split("/")
-            words = [int(x) for x in creation.split("-")]
-            creation = date(words[0], words[1], words[2]).toordinal()
             self.r_info[repos] = (author, name, creation)
             self.u_authoring[author].append(repos)
             self.r_name[name].append(repos)
 
-            words = name.lower().replace("-", "_").replace(".", "_")
-            words = words.split("_")
-            prefixes = [w for w in words if len(w) > 2][:-1]
-            if not prefixes:
-                continue
-
-            for i in xrange(1, len(prefixes)):
-                prefix = "-".join(prefixes[0:i])
-                if prefix in ('the', 'test', 'php', 'acts'):
-                    continue
+            for prefix in name_prefixes(name):
                 self.r_prefixes[prefix].append(repos)
 
         for repos_gen1, repos_gen2 in self.parent_of_r.items():
@@ -357,23 +505,10 @@ class Database:
         """
 
         msg("parsing lang.txt")
-        lines = file('/'.join((self.datadir, "lang.txt"))).read().split("\n")
-
-        pairs = [line.split(":") for line in lines if line]
-        pairs = [(int(pair[0]),
-                  [tuple(x.split(";")) for x in pair[1].split(",")])
-                 for pair in pairs]
-        pairs = [(x, tuple([(int(z[1]), z[0].lower()) for z in y]))
-                 for (x, y) in pairs]
-
-        all_langs = defaultdict(bool)
-        for repos, langs in pairs:
-            for kloc, lang in langs:
-                all_langs[lang] = True
-        all_langs = sorted(all_langs.keys())
+        path = '/'.join((self.datadir, "lang.txt"))
 
         msg("build lang_by_r and r_langs")
-        for repos, langs in pairs:
+        for repos, langs in ingest.records('lang', path, self.workers):
             for kloc, lang in langs:
                 lnloc = int(log(kloc + 1, 10))
                 self.lang_by_r[lang].append((lnloc, repos))
@@ -382,10 +517,48 @@ class Database:
         for lang in self.lang_by_r.keys():
             self.lang_by_r[lang].sort(key=lambda x:x[1])
 
+        self.make_lang_index()
+
+    def make_lang_index(self):
+        """Index the most watched repos of each language and lnloc
+        """
+        msg("build lang_index (depth %d)" % self.lang_depth)
+        watching_r = self.watching_r
+        self.lang_index = stats.lang_buckets(
+            self.lang_by_r, lambda r:len(watching_r.get(r, ())),
+            self.lang_depth)
+
+    def make_names(self):
+        """Numbers the names and prefixes, by the ids of r_name_id
+        """
+        self.names = NameIndex().build(self.r_name, self.r_prefixes,
+                                       self.r_name_id)
+
+    def make_clusters(self):
+        self.clusters = UserClusters().build(self)
+
+    def make_neighbors(self):
+        """Precomputes the nearest users of the test users
+        """
+        self.u_neighbors = build_neighbors(self.test_u,
+                                           self.u_watching,
+                                           self.watching_r)
+
+    def make_cooccur(self):
+        self.r_cooccur.build(self.u_watching, self.watching_r)
+
+    def make_contrib(self):
+        """Compiles the contribution vectors of repos watched by test users
+        """
+        watched = set()
+        for user in self.test_u:
+            watched.update(self.u_watching[user])
+        self.r_contrib = Contributions().build(self, watched)
+
     def parse_test(self):
         """Parse test.txt which has test subjects
         """
 
         msg("parsing test.txt")
-        lines = file('/'.join((self.datadir, "test.txt"))).read().split("\n")
-        self.test_u = sorted([int(line) for line in lines if line])
+        path = '/'.join((self.datadir, "test.txt"))
+        self.test_u = sorted([int(line) for line in ingest.lines(path)])
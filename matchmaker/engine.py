@@ -1,255 +1,354 @@
 #!/usr/bin/env python
 
-from datetime import date
-import MySQLdb as mysqldb
-import random
-import sys
-from math import log
+try:
+    import numpy
+except ImportError:
+    numpy = None
+import multiprocessing
+from array import array
+from math import log10, sqrt
 from collections import defaultdict
-from pprint import pprint
+from itertools import compress, izip
 from matchmaker import msg
-from matchmaker.kmeans import *
+from matchmaker.checkpoint import line
+from matchmaker.contrib import part_key
+from matchmaker.neighbors import nearest_users
+from matchmaker.profiler import Profiler
+from matchmaker.rank import ranked, summed
+from matchmaker.shards import shard_users
+from matchmaker.stats import lang_key
+from matchmaker.trace import Tracer
+
+# engine shared with pool workers through fork copy-on-write
+_engine = None
+
+def _user_process(user):
+    """Pool worker entry point, also handing back the user's trace and
+    profile
+    """
+    top_scores = _engine.user_process(user)
+    return (user, top_scores, _engine.tracer.take(),
+            _engine.profiler.take())
+
+def lang_keys(watching, r_langs, languages=3):
+    """Returns the lang_index keys of the language signal: for each of the
+    languages most common among the watched repos, the buckets within one
+    of their mean lnloc
+    """
+    sizes = defaultdict(list)
+    for r in watching:
+        for lang, lnloc in r_langs.get(r, ()):
+            sizes[lang].append(lnloc)
+    main = sorted(sizes, key=lambda lang:(-len(sizes[lang]), lang))
+    keys = []
+    for lang in main[:languages]:
+        lnloc = int(round(float(sum(sizes[lang])) / len(sizes[lang])))
+        keys.extend([lang_key(lang, bucket)
+                     for bucket in (lnloc - 1, lnloc, lnloc + 1)])
+    return keys
+
+def date_window(watching, r_created, sigmas):
+    """Returns (mean, half width) of the window of creation dates of the
+    date signal, None when the watched repos have no spread of dates
+
+    Summed by ascending repos id, as MatrixEngine sums them.
+    """
+    dates = [day for day in map(r_created.__getitem__, sorted(watching))
+             if day]
+    if not dates:
+        return None
+    mean = float(sum(dates)) / len(dates)
+    std_dev = sqrt(sum([(x - mean) * (x - mean) for x in dates])
+                   / len(dates))
+    if not std_dev:
+        return None
+    return mean, sigmas * std_dev
+
+def date_bonuses(candidates, r_created, mean, width):
+    """Returns (repos, bonus) of the dated candidates: up to 1 within the
+    window of half width width around mean, -10 outside it
+
+    The creation dates are gathered from r_created in one numpy take.
+    """
+    if numpy is None:
+        bonuses = []
+        for r, created in izip(candidates,
+                               map(r_created.__getitem__, candidates)):
+            if not created:
+                continue
+            x = (created - mean) / width
+            bonuses.append((r, 1.0 - x * x if -1.0 <= x <= 1.0 else -10.0))
+        return bonuses
+
+    days = numpy.frombuffer(r_created, numpy.intc).take(candidates)
+    dated = days != 0
+    x = (days[dated] - mean) / width
+    bonuses = numpy.where(numpy.abs(x) <= 1.0, 1.0 - x * x, -10.0)
+    return izip(compress(candidates, dated), bonuses.tolist())
 
 class Engine:
-    def __init__(self, database):
+    def __init__(self, database, workers=1, batch=True, tracer=None,
+                 profiler=None, lang_weight=2.5, date_window=0.0,
+                 shard=None, checkpoint=None):
         """Constructor
+
+        workers: number of processes to spread test users across
+        batch: score all test users now (otherwise call user_process)
+        tracer: Tracer of the scoring of selected users, off by default
+        profiler: Profiler of the signals, off by default
+        lang_weight: score of each repos of the language signal, 0 to
+                     switch it off
+        date_window: std devs of the date signal's window, 0 (the
+                     default) to switch it off
+        shard: (index, shards) to score only that shard of the test
+               users, see matchmaker.shards
+        checkpoint: Checkpoint logging scored users instead of keeping
+                    them in recommended, and skipping those already in it
         """
         self.database = database
+        self.workers = workers
+        self.lang_weight = lang_weight
+        self.date_window = date_window
+        self.shard = shard
+        self.checkpoint = checkpoint
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.profiler = profiler if profiler is not None else Profiler()
         self.recommended = defaultdict(list)
-        self.process()
+        if batch:
+            self.process()
 
-    def process(self):
+    def test_users(self):
+        """Returns the test users to score, those of the shard if any
+        """
         db = self.database
+        if not self.shard:
+            return db.test_u
+        index, shards = self.shard
+        users = shard_users(db.test_u, db.u_watching, index, shards)
+        msg("Shard %d/%d: %d of %d users"
+            % (index, shards, len(users), len(db.test_u)))
+        return users
+
+    def remaining_users(self):
+        """Returns the test users to score that are not checkpointed yet
+        """
+        users = self.test_users()
+        if not self.checkpoint:
+            return users
+        done = self.checkpoint.load()
+        stray = done - set(users)
+        if stray:
+            raise ValueError("%s holds %d users outside this run, first %s"
+                             % (self.checkpoint.path, len(stray),
+                                sorted(stray)[:5]))
+        if done:
+            msg("Resuming from %s: %d users already scored"
+                % (self.checkpoint.path, len(done)))
+        return [u for u in users if u not in done]
+
+    def record(self, user, top_scores):
+        """Keeps the recommendations of user, in the checkpoint if any
+        """
+        if self.checkpoint:
+            self.checkpoint.add(user, top_scores)
+        else:
+            self.recommended[user] = top_scores
 
-        partition = 1
-        if partition > 1:
-            new_len = len(db.test_u) / partition
-            msg("Partitioning 1/%d [%d]" % (partition, new_len))
-            db.test_u = sorted(db.test_u)[:new_len]
-
+    def process(self):
         msg("Beginning recommendations")
-        total = len(db.test_u)
+        test_u = self.remaining_users()
+        total = len(test_u)
+        users = sorted(test_u, reverse=True)
+        if self.workers > 1:
+            results = self.pool_process(users)
+        else:
+            results = ((u, self.user_process(u), self.tracer.take(),
+                        self.profiler.take())
+                       for u in users)
+
         i = 0
-        for u in sorted(db.test_u, reverse=True):
-            self.recommended[u] = self.user_process(u)
+        for u, top_scores, records, profiles in results:
+            self.record(u, top_scores)
+            if records:
+                self.tracer.write(records)
+            self.profiler.add(profiles)
             i += 1
             if i % 10 == 0:
                 msg("[%3.2f%%] %d/%d processed"
                     % (float(i)/float(total)*100.0, i, total))
-    
+        if self.checkpoint:
+            self.checkpoint.close()
+        self.tracer.close()
+        self.profiler.report()
+
+    def pool_process(self, users):
+        """Yields (user, recommendations, trace records, profiles) from a pool of forked workers,
+        heaviest watchers first so one of them does not become the tail
+        """
+        global _engine
+        u_watching = self.database.u_watching
+        users = sorted(users,
+                       key=lambda u:len(u_watching.get(u, ())),
+                       reverse=True)
+
+        msg("Forking %d workers" % self.workers)
+        self.database.preload()
+        _engine = self
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for result in pool.imap_unordered(_user_process, users):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+            _engine = None
+
     def user_process(self, user):
         """Returns ten recommendations
         """
+        if not self.profiler.enabled:
+            return self.score(user)
+
+        prof = self.profiler.begin(user,
+                                   len(self.database.u_watching[user]))
+        try:
+            return self.score(user, prof)
+        finally:
+            self.profiler.end(prof)
+
+    def score(self, user, prof=None):
+        """Returns ten recommendations, charging each signal to prof
+        (UserProfile) if given
+        """
         db = self.database
 
         if user not in db.u_watching:
             # blank son of a gun!
-            msg("making local top_repos")
-            top_repos = sorted(db.watching_r.items(),
-                               key=lambda x:sum([1 for y in x[1]
-                                                 if abs(user - y) < 250]),
-                               reverse=True)
-            return [x[0] for x in top_repos][:10]
+            msg("making cluster top_repos")
+            top_scores = db.fallback_repos(user)
+            if prof:
+                prof.lap('fallback')
+            return top_scores
 
         r_info = db.r_info
-        r_name = db.r_name
         r_langs = db.r_langs
-        r_lang_tuple = db.r_lang_tuple
-        r_prefixes = db.r_prefixes
         top_repos = db.top_repos
-        lang_by_r = db.lang_by_r
+        lang_index = db.lang_index
         u_watching = db.u_watching
         watching_r = db.watching_r
-        forks_of_r = db.forks_of_r
         parent_of_r = db.parent_of_r
+        # sic, the parent again; contrib keys gparent parts to match
         gparent_of_r = db.parent_of_r
-        u_authoring = db.u_authoring
-
-        scores = defaultdict(int)
-
-        # find favorite author (by simple majority)
-        fav_authors = {}
-        """ # ignore fav_authors
-        authors = defaultdict(int)
-        for r in u_watching[user]:
-            if r in r_info:
-                author = r_info[r][0]
-                authors[author] += 1
-
-        # grab top 3 authors
-        authors = sorted(authors.items(), reverse=True, key=lambda x:x[1])[:3]
-        if len(authors) > 1:
-            total = float(sum([x[1] for x in authors]))
-            
-            for a_name, a_score in authors:
-                if a_score == 1:
-                    continue
-
-                # partition 16 appropriately
-                fav_authors[a_name] = float(a_score) / float(total) * 16.0
-
-        msg(fav_authors.items())
-        msg("-" * 78)
-        """        
-        
-        """
-        # generate language profile
-        num_lang_r = 0
-        lang_r = defaultdict(int)
-        for r in u_watching[user]:
-            if r in r_langs:
-                num_lang_r += 1
-                for lang, lnloc in r_langs[r]:
-                    lang_r[lang] += lnloc
-        for lang in lang_r:
-            lnloc = lang_r[lang] = num_lang_r
-            for r1, lnloc2 in lang_by_r[lang]:
-                if abs(lnloc2 - lnloc) <= 1:
-                    scores[r1] += 2.5
-        """
+        r_cooccur = db.r_cooccur
+        r_contrib = db.r_contrib
+        r_watchers = db.r_watchers
+        r_created = db.r_created
+        tracer = self.tracer
+
+        # one entry per score term, summed per candidate at the end;
+        # seen only counts the candidates for the profile
+        term_r = array('i')
+        term_w = array('d')
+        seen = set()
+
+        # language profile: the typical lnloc of the watched repos in
+        # each of the user's main languages, scored with the most
+        # watched repos within one bucket of it
+        if self.lang_weight:
+            lang_r = []
+            for key in lang_keys(u_watching[user], r_langs):
+                lang_r.extend(lang_index.get(key, ()))
+            term_r.extend(lang_r)
+            term_w.extend([self.lang_weight] * len(lang_r))
+            if prof:
+                seen.update(lang_r)
+                prof.lap('lang', len(lang_r), len(seen))
+
+        # neighbours are precomputed for test_u only
+        neighbors = db.u_neighbors.get(user)
+        if neighbors is None:
+            neighbors = nearest_users(user, u_watching, watching_r)
 
-        conn = mysqldb.connect(host='127.0.0.1',
-                               user='root',
-                               passwd='',
-                               db='matrix')
-        c = conn.cursor()
-
-        results = []
-        c.execute(("SELECT u2, val "
-                   "FROM u_matrix_fwd "
-                   "WHERE u1=%d "
-                   "ORDER BY val DESC "
-                   "LIMIT 5")
-                  % user)
-        results += list(c.fetchall())
-        c.execute(("SELECT u2, val "
-                   "FROM u_matrix_bkwd "
-                   "WHERE u1=%d "
-                   "ORDER BY val DESC "
-                   "LIMIT 5")
-                  % user)
-        results += list(c.fetchall())
-        results = sorted(dict(results).items(),
-                         reverse=True,
-                         key=lambda x:x[1])
         user_s = set(u_watching[user])
         r_neighbors = defaultdict(int)
 
-        for u1, u_val in results[:5]:
+        for u1, u_val in neighbors[:5]:
             diff_s = set(u_watching[u1]) - user_s
             for r1 in diff_s:
                 r_neighbors[r1] += 1
 
+        # ties by lowest repos id, as MatrixEngine
         r_neighbors = sorted(r_neighbors.items(),
-                             reverse=True,
-                             key=lambda x:x[1])[:10]
+                             key=lambda x:(-x[1], x[0]))[:10]
         for r1, count in r_neighbors:
-            scores[r1] += 0.5 * log(1 + len(u_watching[r1]), 10)
-
+            term_r.append(r1)
+            term_w.append(0.5 * log10(1 + len(u_watching[r1])))
+        if prof:
+            seen.update([r1 for r1, count in r_neighbors])
+            prof.lap('neighbors', len(r_neighbors), len(seen))
+
+        # parts shared by several watched repos are added once, scaled
+        parts_of = {}
+        times = defaultdict(int)
         for r in u_watching[user]:
-            # loop through all watched repositories
-
-            # check r_matrix
-
-            results = []
-            c.execute(("SELECT r2, val "
-                       "FROM r_matrix_fwd "
-                       "WHERE r1=%d "
-                       "ORDER BY val DESC "
-                       "LIMIT 20")
-                      % r)
-            results += list(c.fetchall())
-            c.execute(("SELECT r2, val "
-                       "FROM r_matrix_bkwd "
-                       "WHERE r1=%d "
-                       "ORDER BY val DESC "
-                       "LIMIT 20")
-                      % r)
-            results += list(c.fetchall())
-            results = sorted(dict(results).items(),
-                             reverse=True,
-                             key=lambda x:x[1])
-            results = [result for result in results
-                       if result not in u_watching[user]]
-            for r1, val in results[:5]:
-                scores[r1] += log(val + len(watching_r[r1]), 10)
-
-            # find forks
-            for r1 in forks_of_r[r]:
-                scores[r1] += log(2 + len(watching_r[r1]), 10)
-
-            # find parents and siblings
+            parts = [('fork', r)]
             if parent_of_r[r] > 0:
-                parent = parent_of_r[r]
-                scores[parent] += 2
-                for r1 in forks_of_r[parent]:
-                    scores[r1] += log(2 + len(watching_r[r1]), 10)
-
-                    # find others by author of parent
-                    if r1 in r_info:
-                        author = r_info[r1][0]
-                        for r2 in u_authoring[author]:
-                            scores[r2] += 0.5 * log(2 + len(watching_r[r2]), 10)
-
-            # find grandparents and uncles/aunts
+                parts.append(('parent', part_key('parent', r, db)))
             if gparent_of_r[r] > 0:
-                gparent = gparent_of_r[r]
-                scores[gparent] += 3
-                for r1 in forks_of_r[gparent]:
-                    scores[r1] += log(2 + len(watching_r[r1]), 10)
-
-                    # find others by author of gparent
-                    if r1 in r_info:
-                        author = r_info[r1][0]
-                        for r2 in u_authoring[author]:
-                            scores[r2] += log(2 + len(watching_r[r2]), 10)
-
-            # find others by author, name and prefixes
+                parts.append(('gparent', part_key('gparent', r, db)))
             if r in r_info:
-                author, name = r_info[r][0], r_info[r][1]
-                for r1 in sorted(u_authoring[author], reverse=True):
-                    scores[r1] += 1.5 * log(2 + len(watching_r[r1]), 10)
-
-                # check names
-                if name in r_name:
-                    for r1 in r_name[name]:
-                        scores[r1] += log(1 + len(watching_r[r1]), 10)
-
-                words = name.lower().replace("-", "_").replace(".", "_")
-                words = words.split("_")
-                prefixes = [w for w in words if len(w) > 2]
-                if not prefixes:
-                    continue
+                parts.extend([(part, part_key(part, r, db))
+                              for part in ('author', 'name', 'prefix')])
+            parts_of[r] = parts
+            for part in parts:
+                times[part] += 1
 
-                for i in xrange(1, len(prefixes) - 1):
-                    prefix = "-".join(prefixes[0:i])
-                    if prefix in r_prefixes:
-                        for r2 in r_prefixes[prefix]:
-                            scores[r2] += (0.25 * i
-                                           * log(1 + len(watching_r[r1]), 10))
+        for r in u_watching[user]:
+            # loop through all watched repositories
 
-        """
-        if len(u_watching[user]) > 7:
-            dates = [r_info[r][2]
-                     for r in u_watching[user]
-                     if r in r_info]
-            # msg(dates)
-            mean = sum(dates) / len(dates)
-            # msg("mean is %s" % date(1,1,1).fromordinal(mean))
-
-            std_dev = (sum([(x - mean) ** 2 for x in dates])
-                       / len(dates)) ** 0.5
-            threshold = std_dev * 2.5
-            # msg("std_dev is %f" % std_dev)
-
-            for r1 in scores:
-                if r1 not in r_info:
+            # check co-occurrence index
+            results = [result for result in r_cooccur[r]
+                       if result[0] not in user_s]
+            for r1, val in results[:5]:
+                term_r.append(r1)
+                term_w.append(log10(val + r_watchers[r1]))
+            if prof:
+                seen.update([r1 for r1, val in results[:5]])
+                prof.lap('cooccur', len(results[:5]), len(seen))
+
+            # find forks; parents and siblings; grandparents and
+            # uncles/aunts, with others by their authors; others by
+            # author, name and prefixes
+            for part in parts_of[r]:
+                n = times.pop(part, 0)
+                if not n:
                     continue
-                
-                created = r_info[r1][2]
-                if abs(created - mean) > threshold:
-                    scores[r1] -= 10.0
-        """
+                repos, weights = r_contrib.vector(part[0], r, db)
+                term_r.extend(repos)
+                if n == 1:
+                    term_w.extend(weights)
+                else:
+                    term_w.extend([n * weight for weight in weights])
+                if prof:
+                    seen.update(repos)
+                    prof.lap(part[0], len(repos), len(seen))
+
+        scores = summed(term_r, term_w)
+
+        # creation dates: within date_window std devs of the mean date
+        # of the watched repos a candidate is boosted by up to 1, outside
+        # it is penalized by 10
+        if self.date_window and len(u_watching[user]) > 7:
+            window = date_window(u_watching[user], r_created,
+                                 self.date_window)
+            if window:
+                mean, width = window
+                for r1, bonus in date_bonuses(scores.keys(), r_created,
+                                              mean, width):
+                    scores[r1] += bonus
+            if prof:
+                prof.lap('date', len(scores))
+
         # cleanup
         for r in u_watching[user] + [0]:
             try:
@@ -257,145 +356,50 @@ class Engine:
             except:
                 pass
 
-        orig_scores = scores
-        scores = sorted(scores.items(), reverse=True, key=lambda x:x[1])
-        authors = defaultdict(int)
-        names = defaultdict(int)
-        purge = []
-        iter = 0
-        for r, score in scores:
-            if r in r_info:
-                author, name, _ = r_info[r]
-                authors[author] += 1
-                names[name] += 1
-
-                if authors[author] > 2:
-                    purge.append(iter)
-                elif names[name] > 5:
-                    purge.append(iter)
-            iter += 1
-
-        for i in sorted(purge, reverse=True):
-            del scores[i]
-
-        # boost by date
-        if False:
-            dates = []
-            for r in u_watching[user]:
-                if r not in r_info:
-                    continue
-                dates.append(r_info[r][2])
-            dates = sorted(dates)[1:-1]
-            mean = sum(dates) / len(dates)
-            std_dev = (sum([(x - mean) ** 2 for x in dates])
-                       / len(dates)) ** 0.5
-            if std_dev:
-                for iter in xrange(10, len(scores)):
-                    r, score = scores[iter]
-                    if r not in r_info:
-                        continue
-                    boost = 1.0 - ((r_info[r][2] - mean) / (2.5 * std_dev)) ** 2.0
-                    if boost > 0:
-                        score += boost
-                        scores[iter] = (r, score)
-            
-        if len(scores) > 3000:
-            mean = sum([x[1] for x in scores]) / len(scores)
-            std_dev = (sum([(x[1] - mean) ** 2
-                            for x in scores])
-                       / len(scores)) ** 0.5
-            cutoff = mean + std_dev * 2.5
-            scores_ = sorted([x for x in scores if x[1] > cutoff])
-            if scores_:
-                scores = scores_
-    
-        if True:
-            output = []
-            fh = file("debug.txt", "a")
-            output.append("user: %5d" % user)
-            output.append("watching: %5d, scores: %5d" % (len(u_watching[user]), len(scores)))
-            output.append("")
-
-            for r in u_watching[user]:
-                if r in r_info:
-                    output.append("    WATCH %8d: %-20s %-50s %s %s"
-                                  % (r,
-                                     r_info[r][0],
-                                     r_info[r][1],
-                                     r_info[r][2],
-                                     date(1, 1, 1).fromordinal(r_info[r][2])))
-                else:
-                    output.append("    WATCH %8d" % r)
-            output.append("-")
-
-            scores_ = sorted(scores,
-                             key=lambda x:(1 if x in u_watching[user] else 0, x[1]),
-                             reverse=True)
-            for r, score in scores_:
-                if r in u_watching[user]:
-                    if r in r_info:
-                        output.append("   %6.3f %8d: %-20s %-50s %s %s"
-                                      % (score, r,
-                                         r_info[r][0],
-                                         r_info[r][1],
-                                         r_info[r][2],
-                                         date(1, 1, 1).fromordinal(r_info[r][2])))
-                    else:
-                        output.append("   %4.2f %8d"
-                                      % (score, r))
+        top, scores = ranked(scores, db.r_author_id, db.r_name_id)
 
-                else:
-                    if r in r_info:
-                        output.append("++ %6.3f %8d: %-20s %-50s %s %s"
-                                      % (score, r,
-                                         r_info[r][0],
-                                         r_info[r][1],
-                                         r_info[r][2],
-                                         date(1, 1, 1).fromordinal(r_info[r][2])))
-                    else:
-                        output.append("++ %4.2f %8d"
-                                      % (score, r))
-            output.append("")
-            fh.write("\n".join(output))
-            fh.close()
-
-        scores.sort(reverse=True, key=lambda x:x[1])
-        top_scores = [repos[0] for repos in scores[:10]]
+        if tracer.wants(user):
+            tracer.emit(user, u_watching[user], scores, r_info)
+
+        top_scores = [r1 for r1, _ in top]
         num_scores = len(top_scores)
 
         if not num_scores:
-            msg("  no scores! so, making local top_repos")
-            top_repos = sorted(db.watching_r.items(),
-                               key=lambda x:sum([1 for y in x[1]
-                                                 if abs(user - y) < 250]),
-                               reverse=True)
-            return [x[0] for x in top_repos][:10]
+            msg("  no scores! so, making cluster top_repos")
+            top_scores = db.fallback_repos(user)
+            if prof:
+                prof.lap('fallback')
+            return top_scores
         else:
-            avg_score = (float(sum([repos[1]
-                                    for repos in scores[:num_scores]]))
+            avg_score = (float(sum([score for _, score in top]))
                          / num_scores)
             msg("  avg: %6.2f - 1st: %6.2f - last: %6.2f"
-                % (avg_score, scores[0][1], scores[num_scores - 1][1]))
+                % (avg_score, top[0][1], top[-1][1]))
+            if prof:
+                prof.lap('rank', 0, len(scores))
 
         if num_scores < 10:
-            msg("making local top_repos since num_scores < 10")
-            top_repos = sorted(db.watching_r.items(),
-                               key=lambda x:sum([1 for y in x[1]
-                                                 if abs(user - y) < 250]),
-                               reverse=True)
-            top_repos = [x[0] for x in top_repos][:10]
+            msg("making cluster top_repos since num_scores < 10")
+            top_repos = db.fallback_repos(user)
             for r in top_repos:
                 if r not in top_scores:
                     top_scores.append(r)
                 if len(top_scores) >= 10:
                     break
+            if prof:
+                prof.lap('fallback')
 
         return top_scores
 
-    def results(self):
-        lines = []
+    def result_lines(self):
+        """Yields the lines of results.txt, by user
+        """
+        if self.checkpoint:
+            for text in self.checkpoint.lines():
+                yield text
+            return
         for u in sorted(self.recommended.keys()):
-            r_list = self.recommended[u]
-            lines.append(':'.join((str(u),
-                                   ','.join([str(v) for v in r_list]))))
-        return "\n".join(lines)
+            yield line(u, self.recommended[u])
+
+    def results(self):
+        return "\n".join(self.result_lines())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Streaming ingestion of the contest files
+
+Lines are streamed through generators instead of reading whole files
+into memory.  Large files are split into line-aligned byte ranges which
+are parsed on several cores; the partial results are merged back in
+file order, so relations fill exactly as a serial parse would.
+"""
+
+from array import array
+from datetime import date
+from itertools import izip
+import multiprocessing
+import os
+
+# files smaller than this are parsed in-process
+CHUNK_MIN = 4 * 1024 * 1024
+
+def lines(path, start=0, end=None):
+    """Yields non-empty lines of path whose first byte is in start:end
+    """
+    fh = open(path, 'rb')
+    fh.seek(start)
+    pos = start
+    for line in fh:
+        if end is not None and pos >= end:
+            break
+        pos += len(line)
+        line = line.rstrip("\r\n")
+        if line:
+            yield line
+    fh.close()
+
+def chunks(path, n):
+    """Splits path into at most n line-aligned (start, end) byte ranges
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    fh = open(path, 'rb')
+    for i in xrange(1, n):
+        fh.seek(max(size * i / n, bounds[-1]))
+        fh.readline()
+        pos = min(fh.tell(), size)
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    fh.close()
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in xrange(len(bounds) - 1)
+            if bounds[i + 1] > bounds[i]]
+
+def watch_record(line):
+    """data.txt line => (user, repos)
+    """
+    user, repos = line.split(":")
+    return int(user), int(repos)
+
+def repos_record(line):
+    """repos.txt line => (repos, parent, author, name, creation ordinal)
+    """
+    fields = line.replace(":", ",").split(",")
+    author, name = fields[1].split("/")
+    words = [int(x) for x in fields[2].split("-")]
+    creation = date(words[0], words[1], words[2]).toordinal()
+    parent = int(fields[3]) if fields[3:4] else 0
+    return int(fields[0]), parent, author, name, creation
+
+def lang_record(line):
+    """lang.txt line => (repos, ((kloc, lang), ...))
+    """
+    repos, langs = line.split(":")
+    langs = [x.split(";") for x in langs.split(",")]
+    return int(repos), tuple([(int(kloc), lang.lower())
+                              for lang, kloc in langs])
+
+RECORDS = {'watch': watch_record,
+           'repos': repos_record,
+           'lang': lang_record}
+
+def _parse_chunk(args):
+    """Pool worker: parses one byte range, watches packed as raw ints
+    """
+    kind, path, start, end = args
+    record = RECORDS[kind]
+    if kind == 'watch':
+        pairs = array('i')
+        for line in lines(path, start, end):
+            pairs.extend(record(line))
+        return pairs.tostring()
+    return [record(line) for line in lines(path, start, end)]
+
+def records(kind, path, workers=1):
+    """Yields records of path in file order, parsed on workers processes
+    if the file is large enough to be worth it
+    """
+    record = RECORDS[kind]
+    if workers <= 1 or os.path.getsize(path) < CHUNK_MIN:
+        for line in lines(path):
+            yield record(line)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(kind, path, start, end)
+                 for start, end in chunks(path, workers * 4)]
+        for part in pool.imap(_parse_chunk, tasks):
+            if kind == 'watch':
+                pairs = array('i', part)
+                for pair in izip(pairs[0::2], pairs[1::2]):
+                    yield pair
+            else:
+                for rec in part:
+                    yield rec
+    finally:
+        pool.close()
+        pool.join()
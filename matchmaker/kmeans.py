@@ -1,12 +1,195 @@
 #!/usr/bin/env python
 """K-Means
 
-Thanks to G-Do [ http://www.daniweb.com/forums/member37720.html ]
+Vectorized with numpy: points are the rows of a float array, and each
+assignment step is one distance computation against all centroids, a
+chunk of rows at a time.  KMeans is the array API:
+
+  km = KMeans(k, seed=0).fit(data)
+  km.centroids, km.labels, km.inertia, km.predict(other)
+
+Centroids are seeded by k-means++.  Inputs larger than batch_size are
+clustered by mini-batch k-means (Sculley, 2010), with one full pass at
+the end to label every point.  A cluster left empty is reseeded with the
+point farthest from its centroid rather than raising.  Everything random
+comes from one RandomState seeded by seed, and progress is only reported
+to a callback, never printed.
+
+kmeans(points, k, cutoff) keeps the original Point/Cluster interface on
+top of it.  Originally thanks to G-Do
+[ http://www.daniweb.com/forums/member37720.html ]
 http://www.daniweb.com/forums/thread31449.html
 """
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import sys, math, random
 
+class KMeans:
+    def __init__(self, k, cutoff=1e-4, max_iter=100, batch_size=10000,
+                 seed=None, progress=None, chunk=4096):
+        """Constructor
+
+        k: number of clusters
+        cutoff: stop once no centroid moves farther than this
+        max_iter: most iterations (mini-batches in mini-batch mode)
+        batch_size: mini-batch size, used for inputs larger than it;
+                    None for plain Lloyd iterations whatever the size
+        seed: seed of the RandomState, None for a random one
+        progress: called as progress(iteration, shift) after each
+                  iteration
+        chunk: rows compared against the centroids at once
+        """
+        self.k = k
+        self.cutoff = cutoff
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.seed = seed
+        self.progress = progress
+        self.chunk = chunk
+        self.centroids = None
+        self.labels = None
+        self.inertia = None
+        self.iterations = 0
+
+    def fit(self, data):
+        """Clusters the rows of data, returns self
+        """
+        if numpy is None:
+            raise ImportError("k-means needs numpy")
+        data = numpy.asarray(data, numpy.float64)
+        if data.ndim != 2 or not len(data):
+            raise ValueError("data must be a non-empty 2-d array")
+        rng = numpy.random.RandomState(self.seed)
+        k = min(self.k, len(data))
+
+        self.centroids = seeds(data, k, rng)
+        if self.batch_size and len(data) > self.batch_size:
+            self.fit_batches(data, rng)
+        else:
+            self.fit_full(data)
+        self.labels, distances = self.assign(data)
+        self.inertia = float(distances.sum())
+        return self
+
+    def fit_full(self, data):
+        """Lloyd iterations over all of data
+        """
+        k = len(self.centroids)
+        for i in xrange(self.max_iter):
+            labels, distances = self.assign(data)
+            counts, sums = totals(labels, data, k)
+            centroids = self.centroids.copy()
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            reseed(centroids, ~filled, data, distances)
+            shift = self.moved(centroids)
+            self.iterations = i + 1
+            if self.progress:
+                self.progress(self.iterations, shift)
+            if shift < self.cutoff:
+                break
+
+    def fit_batches(self, data, rng):
+        """Mini-batch iterations: each centroid moves towards the points of
+        a random batch assigned to it, by a step shrinking with the
+        number of points it has had
+        """
+        k = len(self.centroids)
+        seen = numpy.zeros(k)
+        for i in xrange(self.max_iter):
+            batch = data[rng.randint(0, len(data), self.batch_size)]
+            labels, distances = self.assign(batch)
+            counts, sums = totals(labels, batch, k)
+            seen += counts
+
+            centroids = self.centroids.copy()
+            filled = counts > 0
+            rate = (counts[filled] / seen[filled])[:, None]
+            centroids[filled] += rate * (sums[filled] / counts[filled, None]
+                                         - centroids[filled])
+            # never assigned so far: restart from a badly served point
+            starved = seen == 0
+            reseed(centroids, starved, batch, distances)
+            shift = self.moved(centroids)
+            self.iterations = i + 1
+            if self.progress:
+                self.progress(self.iterations, shift)
+            if shift < self.cutoff and not starved.any():
+                break
+
+    def moved(self, centroids):
+        """Adopts centroids, returns the farthest any centroid moved
+        """
+        shift = numpy.sqrt(((centroids - self.centroids) ** 2).sum(1)).max()
+        self.centroids = centroids
+        return float(shift)
+
+    def assign(self, data):
+        """Returns (labels, squared distances) of the nearest centroid of
+        each row of data
+        """
+        centroids = self.centroids
+        norms = (centroids ** 2).sum(1)
+        labels = numpy.empty(len(data), numpy.intp)
+        distances = numpy.empty(len(data))
+        for start in xrange(0, len(data), self.chunk):
+            rows = data[start:start + self.chunk]
+            d = norms - 2.0 * numpy.dot(rows, centroids.T)
+            nearest = d.argmin(1)
+            labels[start:start + len(rows)] = nearest
+            d = d[numpy.arange(len(rows)), nearest] + (rows ** 2).sum(1)
+            distances[start:start + len(rows)] = numpy.maximum(d, 0.0)
+        return labels, distances
+
+    def predict(self, data):
+        """Returns the label of the nearest centroid of each row of data
+        """
+        return self.assign(numpy.asarray(data, numpy.float64))[0]
+
+def seeds(data, k, rng):
+    """Returns k rows of data picked by k-means++: each after the first
+    drawn with probability proportional to its squared distance to the
+    nearest one picked so far
+    """
+    centroids = numpy.empty((k, data.shape[1]))
+    centroids[0] = data[rng.randint(len(data))]
+    distances = ((data - centroids[0]) ** 2).sum(1)
+    for i in xrange(1, k):
+        total = distances.sum()
+        if total > 0:
+            j = numpy.searchsorted(distances.cumsum(),
+                                   rng.random_sample() * total)
+            j = min(j, len(data) - 1)
+        else:
+            # fewer distinct points than clusters
+            j = rng.randint(len(data))
+        centroids[i] = data[j]
+        distances = numpy.minimum(distances,
+                                  ((data - centroids[i]) ** 2).sum(1))
+    return centroids
+
+def totals(labels, data, k):
+    """Returns (counts, sums) of the rows of data by label
+    """
+    counts = numpy.bincount(labels, minlength=k)
+    sums = numpy.empty((k, data.shape[1]))
+    for j in xrange(data.shape[1]):
+        sums[:, j] = numpy.bincount(labels, data[:, j], k)
+    return counts, sums
+
+def reseed(centroids, empty, data, distances):
+    """Moves the empty centroids onto the points of data farthest from
+    their own centroid, one point each
+    """
+    n = int(empty.sum())
+    if not n:
+        return
+    farthest = numpy.argsort(-distances, kind='mergesort')[:n]
+    centroids[numpy.flatnonzero(empty)[:len(farthest)]] = data[farthest]
+
 class Point:
     """The Point class represents points in n-dimensional space
 
@@ -28,42 +211,40 @@ class Cluster:
     """The Cluster class represents clusters of points
     in n-dimensional space"""
 
-    def __init__(self, points):
+    def __init__(self, points, centroid=None):
         """Constructor
 
-        points: list of Points associated with this Cluster
+        points: list of Points associated with this Cluster, possibly
+                empty if centroid is given
         n: number of dimensions this Cluster's Points live in
         centroid: sample mean Point of this Cluster
         """
-        # We forbid empty Clusters (they don't make mathematical sense!)
-        if len(points) == 0:
-            raise Exception("ILLEGAL: EMPTY CLUSTER")
+        if not points and centroid is None:
+            raise ValueError("empty cluster without a centroid")
 
         self.points = points
-        self.n = points[0].n
+        self.n = centroid.n if centroid is not None else points[0].n
 
         # We also forbid Clusters containing Points in different spaces
         # Ie, no Clusters with 2D Points and 3D Points
         for p in points:
             if p.n != self.n:
-                raise Exception("ILLEGAL: MULTISPACE CLUSTER")
+                raise ValueError("points of different dimensions")
 
-        # Figure out what the centroid of this Cluster should be
-        self.centroid = self.calculateCentroid()
+        if centroid is None:
+            centroid = self.calculateCentroid()
+        self.centroid = centroid
 
     def __repr__(self):
         """Return a string representation of this Cluster"""
         return str(self.points)
 
     def update(self, points):
-        """Update function for the K-means algorithm
-
-        Assigns a new list of Points to this Cluster
-        Returns centroid difference
+        """Assigns a new list of Points to this Cluster, returns how far
+        the centroid moved
         """
         if not points:
-            raise Exception("ILLEGAL: NO POINTS")
-
+            return 0.0
         old_centroid = self.centroid
         self.points = points
         self.centroid = self.calculateCentroid()
@@ -73,92 +254,34 @@ class Cluster:
         """Calculates the centroid Point - the centroid is the sample mean
         Point (in plain English, the average of all the Points in the Cluster)
         """
-        centroid_coords = []
-        # For each coordinate:
-        for i in range(self.n):
-            # Take the average across all Points
-            centroid_coords.append(0.0)
-            for p in self.points:
-                centroid_coords[i] = centroid_coords[i]+p.coords[i]
-            centroid_coords[i] = centroid_coords[i]/len(self.points)
-        # Return a Point object using the average coordinates
-        return Point(centroid_coords)
-
-def kmeans(points, k, cutoff):
+        coords = [sum(c) / float(len(self.points))
+                  for c in zip(*[p.coords for p in self.points])]
+        return Point(coords)
+
+def kmeans(points, k, cutoff, seed=None, progress=None):
     """Return Clusters of Points formed by K-means clustering
 
-    Randomly sample k Points from the points list,
-    build Clusters around them
+    seed, progress: as for KMeans
     """
-    initial = random.sample(points, k)
-    clusters = []
-    for p in initial:
-        clusters.append(Cluster([p]))
-
-    jter = 0
-    while True:
-        print >>sys.stderr, "j =", jter
-        jter += 1
-        
-        # Make a list for each Cluster
-        lists = []
-        for c in clusters:
-            lists.append([])
-
-        iter = 0
-        # For each Point:
-        for p in points:
-
-            if iter % 1000 == 0:
-                print >>sys.stderr, "  j =", jter, ", i =", iter
-            iter += 1
-
-            # Figure out which Cluster's centroid is the nearest
-            smallest_distance = getDistance(p, clusters[0].centroid)
-            index = 0
-            for i in range(len(clusters[1:])):
-                distance = getDistance(p, clusters[i+1].centroid)
-                if distance < smallest_distance:
-                    smallest_distance = distance
-                    index = i+1
-            # Add this Point to that Cluster's corresponding list
-            lists[index].append(p)
-        # Update each Cluster with the corresponding list
-        # Record the biggest centroid shift for any Cluster
-        biggest_shift = 0.0
-        for i in range(len(clusters)):
-            if not lists[i]:
-                continue
-            shift = clusters[i].update(lists[i])
-            biggest_shift = max(biggest_shift, shift)
-        # If the biggest centroid shift is less than the cutoff, stop
-        print >>sys.stderr, "  biggest shift =", biggest_shift
-        if biggest_shift < cutoff:
-            break
-
-    # Return the list of Clusters
-    return clusters
+    km = KMeans(k, cutoff, seed=seed, progress=progress)
+    km.fit([p.coords for p in points])
+    lists = [[] for c in km.centroids]
+    for p, label in zip(points, km.labels):
+        lists[label].append(p)
+    return [Cluster(members, Point(list(centroid)))
+            for members, centroid in zip(lists, km.centroids)]
 
 def getDistance(a, b):
     """Get the Euclidean distance between two Points
     Forbid measurements between Points in different spaces
     """
     if a.n != b.n:
-        raise Exception("ILLEGAL: NON-COMPARABLE POINTS")
-
-    # Euclidean distance between a and b
-    # is sqrt(sum((a[i]-b[i])^2) for all i)
-    ret = 0.0
-    for i in range(a.n):
-        ret = ret+pow((a.coords[i]-b.coords[i]), 2)
-    return math.sqrt(ret)
+        raise ValueError("points of different dimensions")
+    return math.sqrt(sum([(x - y) ** 2 for x, y in zip(a.coords, b.coords)]))
 
 def makeRandomPoint(n, lower, upper):
     """Create a random Point in n-dimensional space"""
-    coords = []
-    for i in range(n):
-        coords.append(random.uniform(lower, upper))
-    return Point(coords)
+    return Point([random.uniform(lower, upper) for i in range(n)])
 
 def main(args):
     num_points = 100
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+"""Batch scoring of all test users with sparse matrix operations
+
+An alternative to Engine for full runs.  Test users are scored a block at
+a time, every signal of the block at once:
+
+  lang       the most watched repos of the users' languages and sizes
+  neighbors  counts of unwatched repos over the 5 nearest users' watch
+             rows, the 10 most counted of each user
+  cooccur    the first 5 unwatched co-occurrence entries per watched repos
+  parts      a (user x part key) matrix of multiplicities, times the
+             (part key x repos) matrix of the stored contribution vectors
+  date       when date_window is set, each user's candidates by their
+             creation date against the mean and std dev of its watched
+             repos' dates
+
+Sparse matrices are the CSR columns the snapshot already holds (offsets
+and values), read as numpy arrays without copying; a product expands the
+rows of the right-hand side and sums duplicate (user, repos) entries.
+The caps, the crowd cutoff, the exclusions and the fallbacks are those of
+Engine, applied to the whole block by sorting.  Terms are summed by
+matchmaker.rank.sums() as Engine's are, and logarithms are taken with
+math.log10 like Engine's, so the scores are the same bit for bit and so
+are the recommendations.
+
+Needs numpy; without it MatrixEngine scores each user with Engine.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+import math
+import multiprocessing
+import time
+
+from matchmaker import msg
+from matchmaker.contrib import PARTS, compile_part
+from matchmaker.engine import Engine, lang_keys
+from matchmaker.neighbors import nearest_users
+from matchmaker.rank import sums
+from matchmaker.relation import Column, IntMap, Relation
+
+# engine shared with pool workers through fork copy-on-write
+_engine = None
+
+def _block_process(users):
+    """Pool worker entry point, also handing back the block's trace
+    """
+    return _engine.block_process(users), _engine.tracer.take()
+
+def ndarray(column):
+    """Returns the items of a Column as a numpy array sharing its buffer
+    """
+    if not len(column):
+        return numpy.zeros(0, column.typecode)
+    return numpy.frombuffer(column.buf, column.typecode, len(column))
+
+def csr(rel):
+    """Returns (offsets, values) of a Relation as numpy arrays, with one
+    offset per key
+    """
+    if not isinstance(rel, Relation):
+        rel = Relation.from_dict(rel)
+    offsets = rel.offsets if rel.ids is None \
+              else Column('i', rel.dense_offsets())
+    return ndarray(offsets).astype(numpy.int64), ndarray(rel.values)
+
+def expand(offsets, rows):
+    """Returns (owners, positions) of the items of CSR rows: for each item
+    the index into rows of its row and its position in the values
+
+    rows past the end of offsets are empty
+    """
+    rows = numpy.asarray(rows, numpy.int64)
+    if len(offsets) < 2 or not len(rows):
+        empty = numpy.zeros(0, numpy.int64)
+        return empty, empty
+    valid = (rows >= 0) & (rows < len(offsets) - 1)
+    safe = numpy.where(valid, rows, 0)
+    starts = offsets[safe]
+    lengths = numpy.where(valid, offsets[safe + 1] - starts, 0)
+    ends = numpy.cumsum(lengths)
+    owners = numpy.repeat(numpy.arange(len(rows)), lengths)
+    positions = numpy.arange(ends[-1] if len(ends) else 0) \
+                - numpy.repeat(ends - lengths - starts, lengths)
+    return owners, positions
+
+def padded(values, size):
+    """Returns values as an int64 numpy array of length size
+    """
+    result = numpy.zeros(size, numpy.int64)
+    n = min(len(values), size)
+    result[:n] = values[:n]
+    return result
+
+def ranking(owners, values):
+    """Returns the order of items by owner, then by descending value, ties
+    in their current order
+
+    Stable sorts on one key each, much faster than numpy.lexsort.
+    """
+    order = numpy.argsort(-values, kind='mergesort')
+    return order[numpy.argsort(owners[order], kind='mergesort')]
+
+def group_ranks(groups):
+    """Returns the rank of each item within its run of equal groups, for
+    groups in runs
+    """
+    if not len(groups):
+        return numpy.zeros(0, numpy.int64)
+    starts = numpy.ones(len(groups), bool)
+    starts[1:] = groups[1:] != groups[:-1]
+    positions = numpy.arange(len(groups))
+    first = numpy.maximum.accumulate(numpy.where(starts, positions, 0))
+    return positions - first
+
+class MatrixEngine:
+    def __init__(self, database, workers=1, batch=True, tracer=None,
+                 profiler=None, lang_weight=2.5, date_window=0.0,
+                 shard=None, checkpoint=None, block=256):
+        """Constructor
+
+        workers: number of processes to spread blocks of users across
+        batch: score all test users now (otherwise call user_process)
+        tracer: Tracer of the scoring of selected users, off by default
+        profiler: Profiler, only used by the per-user fallback
+        lang_weight: score of each repos of the language signal, 0 to
+                     switch it off
+        date_window: std devs of the date signal's window, 0 to switch it
+                     off
+        shard: (index, shards) to score only that shard of the test users
+        checkpoint: Checkpoint of scored users, as for Engine
+        block: users scored together
+        """
+        self.database = database
+        self.workers = workers
+        self.block = block
+        self.lang_weight = lang_weight
+        self.date_window = date_window
+        self.shard = shard
+        self.engine = Engine(database, workers, False, tracer, profiler,
+                             lang_weight, date_window, shard, checkpoint)
+        self.tracer = self.engine.tracer
+        self.profiler = self.engine.profiler
+        self.recommended = self.engine.recommended
+        self.checkpoint = checkpoint
+        self.matrices = None
+        if batch:
+            self.process()
+
+    def process(self):
+        if numpy is None:
+            msg("numpy is not available, scoring users one by one")
+            self.engine.process()
+            return
+
+        msg("Beginning matrix recommendations")
+        start = time.time()
+        self.prepare()
+        users = sorted(self.engine.remaining_users())
+        blocks = [users[i:i + self.block]
+                  for i in xrange(0, len(users), self.block)]
+        if self.workers > 1:
+            results = self.pool_process(blocks)
+        else:
+            results = ((self.block_process(b), self.tracer.take())
+                       for b in blocks)
+
+        i = 0
+        for tops, records in results:
+            for u in sorted(tops):
+                self.engine.record(u, tops[u])
+            if records:
+                self.tracer.write(records)
+            i += len(tops)
+            msg("[%3.2f%%] %d/%d processed"
+                % (float(i)/float(max(len(users), 1))*100.0, i, len(users)))
+        if self.checkpoint:
+            self.checkpoint.close()
+        self.tracer.close()
+        msg("scored %d users in %.2fs" % (len(users), time.time() - start))
+
+    def pool_process(self, blocks):
+        """Yields (recommendations, trace records) of each block from a
+        pool of forked workers
+        """
+        global _engine
+        msg("Forking %d workers" % self.workers)
+        self.database.preload()
+        _engine = self
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for result in pool.imap_unordered(_block_process, blocks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+            _engine = None
+
+    def prepare(self):
+        """Reads the Database relations and arrays as numpy arrays
+        """
+        if self.matrices is not None:
+            return
+        db = self.database
+        size = len(db.r_watchers)
+        u_off, u_val = csr(db.u_watching)
+        parent_of_r = db.parent_of_r
+        if not isinstance(parent_of_r, IntMap):
+            parent_of_r = IntMap.from_dict(parent_of_r)
+        watch_counts = numpy.zeros(size, numpy.int64)
+        n = min(len(u_off) - 1, size)
+        if n > 0:
+            watch_counts[:n] = u_off[1:n + 1] - u_off[:n]
+
+        m = {'size': size,
+             'u_off': u_off,
+             'u_val': u_val,
+             'watchers': ndarray(Column(db.r_watchers.typecode,
+                                        db.r_watchers)),
+             # sic, the watch count of the user whose id is the repos id
+             'neighbor_w': 0.5 * log10(1 + watch_counts),
+             'parent': padded(ndarray(Column('i', parent_of_r.dense())),
+                              size),
+             'author': padded(ndarray(Column(db.r_author_id.typecode,
+                                             db.r_author_id)), size),
+             'name': padded(ndarray(Column(db.r_name_id.typecode,
+                                           db.r_name_id)), size),
+             'created': padded(ndarray(Column(db.r_created.typecode,
+                                              db.r_created)), size)}
+        cooccur = db.r_cooccur
+        m['co_off'] = ndarray(cooccur.offsets).astype(numpy.int64)
+        m['co_repos'] = ndarray(cooccur.repos)
+        m['co_counts'] = ndarray(cooccur.counts)
+        contrib = db.r_contrib
+        for part in PARTS:
+            offsets = ndarray(contrib.offsets[part]).astype(numpy.int64)
+            m['contrib', part] = (offsets, ndarray(contrib.repos[part]),
+                                  ndarray(contrib.weights[part]))
+        self.matrices = m
+
+    def user_process(self, user):
+        """Returns ten recommendations
+        """
+        if numpy is None:
+            return self.engine.user_process(user)
+        self.prepare()
+        return self.block_process([user])[user]
+
+    def block_process(self, users):
+        """Returns dict of user = ten recommendations
+        """
+        m = self.matrices
+        size = m['size']
+        users = numpy.asarray(users, numpy.int64)
+
+        # watch matrix of the block, as (owner, repos) sorted by owner
+        owners, positions = expand(m['u_off'], users)
+        watched = m['u_val'][positions].astype(numpy.int64)
+        watch_keys = numpy.sort(owners * size + watched)
+        watch_counts = numpy.bincount(owners, minlength=len(users))
+
+        entries = [self.lang_entries(users),
+                   self.neighbor_entries(users, watch_keys),
+                   self.cooccur_entries(owners, watched, watch_keys)]
+        entries.extend([self.part_entries(part, owners, watched)
+                        for part in PARTS])
+
+        keys, scores = sums(numpy.concatenate([e[0] for e in entries]),
+                            numpy.concatenate([e[1] for e in entries]))
+
+        # cleanup: watched repos and repos 0
+        keep = ~member(keys, watch_keys) & (keys % size != 0)
+        keys, scores = keys[keep], scores[keep]
+        owners, repos = keys // size, keys % size
+        if self.date_window:
+            scores = self.date_scores(len(users), owners, repos, scores,
+                                      watch_counts, watch_keys)
+        return self.rank(users, owners, repos, scores)
+
+    def lang_entries(self, users):
+        """Returns (keys, weights) of the language signal
+        """
+        db = self.database
+        size = self.matrices['size']
+        keys = []
+        if self.lang_weight:
+            for i, user in enumerate(users.tolist()):
+                for key in lang_keys(db.u_watching.get(user, ()),
+                                     db.r_langs):
+                    keys.extend([i * size + r1
+                                 for r1 in db.lang_index.get(key, ())])
+        keys = numpy.array(keys, numpy.int64)
+        return keys, numpy.repeat(float(self.lang_weight), len(keys))
+
+    def neighbor_entries(self, users, watch_keys):
+        """Returns (keys, weights) of the neighbours signal
+        """
+        db = self.database
+        m = self.matrices
+        size = m['size']
+        nb_owner = []
+        nb_user = []
+        for i, user in enumerate(users):
+            # neighbours are precomputed for test_u only
+            neighbors = db.u_neighbors.get(user)
+            if neighbors is None:
+                neighbors = nearest_users(user, db.u_watching, db.watching_r)
+            for u1, u_val in neighbors[:5]:
+                nb_owner.append(i)
+                nb_user.append(u1)
+        nb_owner = numpy.asarray(nb_owner, numpy.int64)
+        rows, positions = expand(m['u_off'], nb_user)
+        keys = nb_owner[rows] * size + m['u_val'][positions]
+        keys = keys[~member(keys, watch_keys)]
+
+        # 10 most counted per user, ties by lowest repos id
+        keys, counts = numpy.unique(keys, return_counts=True)
+        keys = keys[ranking(keys // size, counts)]
+        keys = keys[group_ranks(keys // size) < 10]
+        return keys, m['neighbor_w'][keys % size]
+
+    def cooccur_entries(self, owners, watched, watch_keys):
+        """Returns (keys, weights) of the co-occurrence signal
+        """
+        m = self.matrices
+        size = m['size']
+        pairs, positions = expand(m['co_off'], watched)
+        repos = m['co_repos'][positions].astype(numpy.int64)
+        keys = owners[pairs] * size + repos
+        keep = ~member(keys, watch_keys)
+        pairs, repos, keys = pairs[keep], repos[keep], keys[keep]
+        counts = m['co_counts'][positions[keep]]
+
+        # first 5 unwatched per watched repos
+        first = group_ranks(pairs) < 5
+        repos = repos[first]
+        weights = log10(counts[first] + m['watchers'][repos])
+        return keys[first], weights
+
+    def part_entries(self, part, owners, watched):
+        """Returns (keys, weights) of one part: multiplicities of each
+        user's part keys times the contribution vectors
+        """
+        db = self.database
+        m = self.matrices
+        size = m['size']
+        if part == 'fork':
+            keys = watched
+            wanted = numpy.ones(len(watched), bool)
+        elif part in ('parent', 'gparent'):
+            keys = m['parent'][watched]
+            wanted = keys > 0
+        elif part == 'author':
+            keys = m['author'][watched]
+            wanted = keys > 0
+        else:
+            keys = m['name'][watched]
+            wanted = keys > 0
+        owners, keys, reps = owners[wanted], keys[wanted], watched[wanted]
+
+        # (user x part key) matrix of multiplicities
+        pair_keys, first, times = numpy.unique(owners * size + keys,
+                                               return_index=True,
+                                               return_counts=True)
+        owners, keys, reps = pair_keys // size, pair_keys % size, reps[first]
+
+        offsets, repos, weights = m['contrib', part]
+        rows, positions = expand(offsets, keys)
+        result_keys = [owners[rows] * size + repos[positions]]
+        result_weights = [times[rows] * weights[positions]]
+
+        # keys not stored are compiled from the Database
+        stored = numpy.zeros(len(keys), bool)
+        stored[rows] = True
+        for i in numpy.flatnonzero(~stored):
+            vector = compile_part(part, int(reps[i]), db)
+            if vector:
+                vector = numpy.asarray(vector)
+                result_keys.append(owners[i] * size
+                                   + vector[:, 0].astype(numpy.int64))
+                result_weights.append(times[i] * vector[:, 1])
+        return (numpy.concatenate(result_keys),
+                numpy.concatenate(result_weights))
+
+    def date_scores(self, n, owners, repos, scores, counts, watch_keys):
+        """Returns scores with the date signal: for users watching more
+        than 7 repos, up to 1 for candidates created within the window
+        around the mean date of their watched repos, -10 outside it
+        """
+        size = self.matrices['size']
+        created = self.matrices['created']
+        watch_owners = watch_keys // size
+        days = created[watch_keys % size].astype(numpy.float64)
+        dated = days > 0
+        totals = numpy.bincount(watch_owners[dated], minlength=n)
+        divisors = numpy.maximum(totals, 1)
+        means = numpy.bincount(watch_owners[dated], days[dated], n) / divisors
+        deviations = days[dated] - means[watch_owners[dated]]
+        squares = numpy.bincount(watch_owners[dated],
+                                 deviations * deviations, n)
+        widths = self.date_window * numpy.sqrt(squares / divisors)
+        active = (counts > 7) & (widths > 0)
+
+        days = created[repos].astype(numpy.float64)
+        mine = active[owners] & (days > 0)
+        x = (days[mine] - means[owners[mine]]) / widths[owners[mine]]
+        scores = scores.astype(numpy.float64)
+        scores[mine] += numpy.where(numpy.abs(x) <= 1.0, 1.0 - x * x, -10.0)
+        return scores
+
+    def rank(self, users, owners, repos, scores):
+        """Returns dict of user = ten recommendations, ranked under
+        Engine's caps and cutoff, falling back to cluster top repos
+        """
+        db = self.database
+        m = self.matrices
+        order = ranking(owners, scores)
+        owners, repos, scores = owners[order], repos[order], scores[order]
+
+        # at most 2 per author and 5 per name, counted down the ranking
+        purged = numpy.zeros(len(repos), bool)
+        for labels, cap in ((m['author'], 2), (m['name'], 5)):
+            groups = labels[repos]
+            grouped = numpy.argsort(owners * (len(labels) + 1) + groups,
+                                    kind='mergesort')
+            ranks = group_ranks(owners[grouped] * (len(labels) + 1)
+                                + groups[grouped])
+            over = grouped[(ranks >= cap) & (groups[grouped] != 0)]
+            purged[over] = True
+        owners, repos, scores = owners[~purged], repos[~purged], \
+                                scores[~purged]
+
+        # crowds of more than 3000 cut down to mean + 2.5 std devs
+        n = len(users)
+        counts = numpy.bincount(owners, minlength=n)
+        crowded = counts > 3000
+        if crowded.any():
+            divisors = numpy.maximum(counts, 1)
+            means = numpy.bincount(owners, scores, n) / divisors
+            deviations = scores - means[owners]
+            squares = numpy.bincount(owners, deviations * deviations, n)
+            cutoffs = means + numpy.sqrt(squares / divisors) * 2.5
+            above = scores > cutoffs[owners]
+            any_above = numpy.bincount(owners, above, n) > 0
+            keep = ~(crowded & any_above)[owners] | above
+            owners, repos, scores = owners[keep], repos[keep], scores[keep]
+
+        ranks = group_ranks(owners)
+        top = ranks < 10
+        recommended = dict((int(u), []) for u in users)
+        for i, r in zip(owners[top].tolist(), repos[top].tolist()):
+            recommended[int(users[i])].append(r)
+
+        for i, user in enumerate(users.tolist()):
+            if self.tracer.wants(user):
+                mine = owners == i
+                self.tracer.emit(user, db.u_watching[user],
+                                 zip(repos[mine].tolist(),
+                                     scores[mine].tolist()), db.r_info)
+
+            top_scores = recommended[user]
+            if not top_scores:
+                recommended[user] = db.fallback_repos(user)
+            elif len(top_scores) < 10:
+                for r in db.fallback_repos(user):
+                    if r not in top_scores:
+                        top_scores.append(r)
+                    if len(top_scores) >= 10:
+                        break
+        return recommended
+
+    def result_lines(self):
+        return self.engine.result_lines()
+
+    def results(self):
+        return self.engine.results()
+
+def log10(values):
+    """Returns math.log10 of integer values, as Engine takes it: numpy's
+    own log10 may differ in the last bit
+    """
+    unique, inverse = numpy.unique(values, return_inverse=True)
+    return numpy.array(map(math.log10, unique.tolist()),
+                       numpy.float64)[inverse]
+
+def member(keys, sorted_keys):
+    """Returns a mask of the keys found in sorted_keys
+    """
+    if not len(sorted_keys):
+        return numpy.zeros(len(keys), bool)
+    i = numpy.minimum(numpy.searchsorted(sorted_keys, keys),
+                      len(sorted_keys) - 1)
+    return sorted_keys[i] == keys
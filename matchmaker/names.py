@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Repository name tokens and prefixes by id
+
+A repos name is tokenized once at load time: lowercased, split on "_",
+"-" and ".", and words of up to 2 letters dropped.  Its prefixes are the
+first 1, 2, ... tokens joined by "-", all but the last two tokens'
+worth.  Names are numbered as in Database.r_name_id and prefixes from 1
+in sorted order, so the name and prefix signals need only integer
+lookups.
+"""
+
+from matchmaker import msg
+from matchmaker.relation import Relation, prefixed, unprefixed
+
+# too common to file repos under
+SKIPPED = ('the', 'test', 'php', 'acts')
+
+def tokens(name):
+    """Returns the words of a repos name that count for prefixes
+    """
+    words = name.lower().replace("-", "_").replace(".", "_")
+    return [w for w in words.split("_") if len(w) > 2]
+
+def prefix_levels(name):
+    """Returns the prefixes of a repos name of 1, 2, ... tokens, None for
+    the skipped ones
+    """
+    words = tokens(name)
+    result = []
+    for i in xrange(1, len(words) - 1):
+        prefix = "-".join(words[0:i])
+        result.append(None if prefix in SKIPPED else prefix)
+    return result
+
+def name_prefixes(name):
+    """Returns the prefixes a repos name is filed under in r_prefixes
+    """
+    return [prefix for prefix in prefix_levels(name) if prefix]
+
+class NameIndex:
+    """Names and prefixes as relations of ids
+
+    repos: name id = repos of that name, in r_name order
+    prefixes: name id = prefix id of each level, 0 if skipped
+    prefix_repos: prefix id = repos filed under the prefix
+    """
+    kind = 'names'
+
+    def __init__(self, repos=None, prefixes=None, prefix_repos=None):
+        """Constructor
+        """
+        self.repos = repos if repos is not None else Relation()
+        self.prefixes = prefixes if prefixes is not None else Relation()
+        self.prefix_repos = prefix_repos if prefix_repos is not None \
+                            else Relation()
+
+    def columns(self):
+        columns = {}
+        for part, rel in (('name', self.repos),
+                          ('levels', self.prefixes),
+                          ('prefix', self.prefix_repos)):
+            columns.update(prefixed(part, rel.columns()))
+        return columns
+
+    def meta(self):
+        return {'name': self.repos.meta(),
+                'levels': self.prefixes.meta(),
+                'prefix': self.prefix_repos.meta()}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        rels = []
+        for part in ('name', 'levels', 'prefix'):
+            rels.append(Relation.from_columns(unprefixed(part, columns),
+                                              meta[part]))
+        return cls(*rels)
+
+    def nbytes(self):
+        return (self.repos.nbytes() + self.prefixes.nbytes()
+                + self.prefix_repos.nbytes())
+
+    def build(self, r_name, r_prefixes, r_name_id):
+        """Numbers the names and prefixes of r_name and r_prefixes
+
+        r_name_id: array of name ids by repos
+        """
+        msg("indexing %d names, %d prefixes" % (len(r_name), len(r_prefixes)))
+        prefix_ids = dict((prefix, i + 1)
+                          for i, prefix in enumerate(sorted(r_prefixes)))
+        repos = {}
+        prefixes = {}
+        for name, name_r in r_name.iteritems():
+            if not name_r:
+                continue
+            i = r_name_id[name_r[0]]
+            repos[i] = name_r
+            prefixes[i] = [prefix_ids[prefix] if prefix else 0
+                           for prefix in prefix_levels(name)]
+        self.repos = Relation.from_dict(repos)
+        self.prefixes = Relation.from_dict(prefixes)
+        self.prefix_repos = Relation.from_dict(dict(
+            (prefix_ids[prefix], r_prefixes[prefix])
+            for prefix in prefix_ids))
+        return self
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Nearest-neighbour users
+
+Replaces the u_matrix_fwd/u_matrix_bkwd MySQL tables.  Candidates for a
+user are gathered through watching_r, so only users sharing at least one
+repository are ever compared and the cost scales with co-watch pairs
+rather than with the square of the number of users.
+
+Neighbours are the top k by symmetric difference among those overlapping
+users only.  A user sharing nothing is never a neighbour, even when its
+list is short enough to give a smaller difference than a sharing user
+with a long one: it would contribute nothing but its own watches.
+"""
+
+from collections import defaultdict
+from heapq import nsmallest
+from matchmaker import msg
+
+def nearest_users(user, u_watching, watching_r, k=5):
+    """Returns the k most similar users to user as a list of (user, diff),
+    among the users sharing at least one repos with user
+
+    diff is the size of the symmetric difference of both watch lists, so
+    lower is more similar; ties are broken by lowest user id.
+    """
+    if user not in u_watching:
+        return []
+
+    user_s = set(u_watching[user])
+    overlap = defaultdict(int)
+    for r in user_s:
+        for u1 in watching_r[r]:
+            overlap[u1] += 1
+    overlap.pop(user, None)
+
+    size = len(user_s)
+    return nsmallest(k,
+                     [(u1, size + len(u_watching[u1]) - 2 * common)
+                      for u1, common in overlap.iteritems()],
+                     key=lambda x:(x[1], x[0]))
+
+def build_neighbors(users, u_watching, watching_r, k=5):
+    """Returns dict of user = [(user, diff), ...] for each of users
+    """
+    msg("building nearest neighbours (top %d)" % k)
+    neighbors = {}
+    iter = 0
+    for user in users:
+        neighbors[user] = nearest_users(user, u_watching, watching_r, k)
+
+        iter += 1
+        if iter % 1000 == 0:
+            msg("neighbours iter %d" % iter)
+    return neighbors
+
+def updated_neighbors(neighbors, users, changed, u_watching, watching_r, k=5):
+    """Updates neighbors (dict of user = [(user, diff), ...] for each of
+    users) in place after the users in changed watched new repos, and
+    returns the users whose entries were recomputed or merged
+
+    Only diffs involving a changed user move.  A changed user, or one
+    with a changed user among its neighbours (whose diff may have grown),
+    is recomputed; any other user sharing repos with a changed user keeps
+    its neighbours and merges in the changed users' new diffs.
+    """
+    users = set(users)
+    changed = set(changed)
+    # diffs of the changed users to the users they share repos with
+    diffs = defaultdict(list)
+    for u1 in changed:
+        watching = set(u_watching[u1])
+        overlap = defaultdict(int)
+        for r in watching:
+            for user in watching_r[r]:
+                overlap[user] += 1
+        for user, common in overlap.iteritems():
+            if user in users and user != u1:
+                diffs[user].append((u1, len(u_watching[user])
+                                    + len(watching) - 2 * common))
+
+    touched = set()
+    for user in users:
+        old = neighbors.get(user, [])
+        if user in changed or [u1 for u1, diff in old if u1 in changed]:
+            neighbors[user] = nearest_users(user, u_watching, watching_r, k)
+            touched.add(user)
+        elif user in diffs:
+            neighbors[user] = nsmallest(k, old + diffs[user],
+                                        key=lambda x:(x[1], x[0]))
+            touched.add(user)
+    return touched
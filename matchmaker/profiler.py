@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Per-signal profile of Engine.user_process
+
+For each user: wall time, and per signal the wall time, candidates it
+added to the scores and score updates it made.  Signals are timed as
+laps, each lap running from the end of the previous one, so the laps of
+a user add up to its wall time.  Like the Tracer, profiles are kept in
+the process that scored the user and handed to the parent, which
+aggregates them into one report at the end of Engine.process.
+"""
+
+from collections import defaultdict
+import time
+
+from matchmaker import msg
+from matchmaker.utils import option, percentile
+
+SIGNALS = ('lang', 'neighbors', 'cooccur', 'fork', 'parent', 'gparent',
+           'author', 'name', 'prefix', 'date', 'rank', 'fallback')
+
+class UserProfile:
+    """Laps of one user
+    """
+    def __init__(self, user, watching):
+        """Constructor
+        """
+        self.user = user
+        self.watching = watching
+        self.signals = {}
+        self.size = 0
+        self.elapsed = 0.0
+        self.start = self.last = time.time()
+
+    def lap(self, signal, updates=0, size=None):
+        """Charges the time since the last lap to signal
+
+        updates: score updates made by the signal
+        size: number of candidates after the signal, when it changed them
+        """
+        now = time.time()
+        if signal not in self.signals:
+            self.signals[signal] = [0.0, 0, 0]
+        stat = self.signals[signal]
+        stat[0] += now - self.last
+        stat[2] += updates
+        if size is not None:
+            stat[1] += size - self.size
+            self.size = size
+        self.last = now
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+
+class Profiler:
+    """Collects UserProfiles and reports on them
+    """
+    def __init__(self, enabled=False, slowest=10):
+        """Constructor
+
+        enabled: profile user_process, otherwise it is left untimed
+        slowest: users listed in the report
+        """
+        self.enabled = enabled
+        self.slowest = slowest
+        self.pending = []
+        self.profiles = []
+
+    def begin(self, user, watching):
+        return UserProfile(user, watching)
+
+    def end(self, profile):
+        profile.finish()
+        self.pending.append(profile)
+
+    def take(self):
+        """Returns and forgets the profiles finished in this process
+        """
+        profiles, self.pending = self.pending, []
+        return profiles
+
+    def add(self, profiles):
+        self.profiles.extend(profiles)
+
+    def report(self):
+        """Prints latency percentiles, the slowest users and the time
+        share of each signal
+        """
+        self.add(self.take())
+        if not self.enabled or not self.profiles:
+            return
+        profiles = self.profiles
+        latencies = sorted([p.elapsed for p in profiles])
+        total = sum(latencies)
+
+        msg("profile of %d users, %.2fs in user_process"
+            % (len(profiles), total))
+        msg("latency ms: p50 %.2f - p95 %.2f - p99 %.2f - max %.2f"
+            % tuple([1000.0 * percentile(latencies, p)
+                     for p in (50, 95, 99, 100)]))
+
+        signals = defaultdict(lambda:[0.0, 0, 0])
+        for p in profiles:
+            for signal, stat in p.signals.items():
+                for i in xrange(3):
+                    signals[signal][i] += stat[i]
+        msg("%-10s %9s %6s %12s %12s"
+            % ("signal", "ms", "share", "candidates", "updates"))
+        names = [s for s in SIGNALS if s in signals]
+        names.extend(sorted([s for s in signals if s not in SIGNALS]))
+        rows = [(s,) + tuple(signals[s]) for s in names]
+        # time between the last lap and the end of user_process
+        rows.append(("other", total - sum([signals[s][0] for s in names]),
+                     0, 0))
+        for signal, elapsed, candidates, updates in rows:
+            msg("%-10s %9.1f %5.1f%% %12d %12d"
+                % (signal, 1000.0 * elapsed, 100.0 * elapsed / max(total, 1e-9),
+                   candidates, updates))
+
+        msg("slowest users:")
+        msg("%8s %9s %9s" % ("user", "ms", "watching"))
+        slowest = sorted(profiles, reverse=True,
+                         key=lambda p:p.elapsed)[:self.slowest]
+        for p in slowest:
+            msg("%8d %9.2f %9d" % (p.user, 1000.0 * p.elapsed, p.watching))
+
+def from_argv(argv):
+    """Returns a Profiler enabled by --profile, or --profile=N to list the
+    N slowest users
+    """
+    slowest = option(argv, 'profile')
+    if slowest is None and '--profile' not in argv:
+        return Profiler()
+    return Profiler(True, int(slowest or 10))
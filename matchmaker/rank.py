@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Final ranking of a user's candidates
+
+Picks the top k of a user's scores under the diversity caps: at most 2
+repos per author and 5 per name, counted down the ranking whether or not
+the earlier ones were dropped themselves.  Rather than walking the
+ranking in Python, the candidates are ranked once and regrouped by author
+and by name with stable sorts keyed on the id arrays (Database
+r_author_id, r_name_id), so a candidate is past its cap exactly when the
+one cap places before it in its group belongs to the same group.  Each
+pass is a sort, map or compress run in C; only the survivors' scores
+and the k best are handled one by one.
+
+Matches the old sort-and-purge, with ties going to the lowest repos id:
+candidates are ordered by descending score, and a crowd of more than 3000
+survivors is cut down to those above mean + 2.5 standard deviations.
+
+Engine and MatrixEngine gather a candidate's terms in different orders,
+and floating point sums depend on the order.  So both hand their terms to
+sums(), which adds each candidate's terms in ascending order, and both
+take the crowd's mean and deviation down the ranking with the same
+operations, so their scores agree bit for bit.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from collections import defaultdict
+from itertools import compress, ifilterfalse, imap, izip
+from math import sqrt
+from operator import eq
+
+def sums(keys, weights):
+    """Returns (keys, sums) numpy arrays: the distinct keys, ascending, and
+    the sum of the weights of each, added smallest first
+
+    keys, weights: numpy arrays with one term per item
+    """
+    # bincount adds in array order
+    order = numpy.lexsort((weights, keys))
+    keys, inverse = numpy.unique(keys[order], return_inverse=True)
+    return keys, numpy.bincount(inverse, weights[order], len(keys))
+
+def summed(repos, weights):
+    """Returns dict of repos = score, the sum of its weights as sums()
+    adds them
+
+    repos, weights: arrays ('i' and 'd') with one term per item
+    """
+    if numpy is not None:
+        keys, scores = sums(numpy.frombuffer(repos, numpy.intc),
+                            numpy.frombuffer(weights, numpy.float64))
+        return dict(izip(keys.tolist(), scores.tolist()))
+
+    terms = defaultdict(list)
+    for r, weight in izip(repos, weights):
+        terms[r].append(weight)
+    return dict((r, sum(sorted(t), 0.0)) for r, t in terms.iteritems())
+
+def ranked(scores, r_author_id, r_name_id, k=10, author_cap=2, name_cap=5,
+           crowd=3000, sigmas=2.5):
+    """Returns (top, kept): the best k candidates and all candidates left
+    after the caps and cutoff, both as lists of (repos, score) best first
+
+    scores: dict of repos = score
+    r_author_id, r_name_id: arrays of ids by repos, 0 for no info
+    """
+    keys = scores.keys()
+    values = scores.values()
+    # ranking positions, ties by lowest repos id as the sort is stable
+    order = sorted(xrange(len(keys)), key=keys.__getitem__)
+    order.sort(key=values.__getitem__, reverse=True)
+
+    purged = set()
+    for labels, cap in ((r_author_id, author_cap), (r_name_id, name_cap)):
+        groups = map(labels.__getitem__, keys)
+        # repos without info (id 0) are in no group; they sort first
+        grouped = sorted(order, key=groups.__getitem__)[groups.count(0):]
+        ids = map(groups.__getitem__, grouped)
+        purged.update(compress(grouped[cap:], imap(eq, ids[cap:], ids)))
+
+    kept = list(ifilterfalse(purged.__contains__, order)) if purged \
+           else order
+    kept_values = map(values.__getitem__, kept)
+
+    if len(kept) > crowd:
+        mean = float(sum(kept_values)) / len(kept)
+        std_dev = sqrt(sum([(x - mean) * (x - mean) for x in kept_values])
+                       / len(kept))
+        cutoff = mean + std_dev * sigmas
+        above = [i for i, x in izip(kept, kept_values) if x > cutoff]
+        if above:
+            kept = sorted(above, reverse=True,
+                          key=lambda i:(values[i], -keys[i]))
+            kept_values = map(values.__getitem__, kept)
+
+    kept = zip(map(keys.__getitem__, kept), kept_values)
+    return kept[:k], kept
@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+"""Compact integer relations
+
+Relations keyed by small dense integers (users, repos) or by strings
+(authors, names, prefixes) stored as flat typed columns instead of dicts
+of lists of boxed ints.  A column is either an array in memory or a
+memory-mapped file written from one, so a snapshot can be opened without
+reading it and is shared between processes through the page cache.
+
+Integer-keyed relations take one slot per key up to the largest, unless
+fewer than half the slots would be used: then the keys are stored
+sorted in an 'ids' column alongside one slot per key, and looked up by
+bisection.  The relations of forks and parents, keyed by the few repos
+that are forked or forks, are sparse.
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import izip
+import mmap
+import os
+import struct
+import sys
+
+class Column:
+    """Flat column of numbers, in memory (array) or memory-mapped
+    """
+    def __init__(self, typecode, buf=None):
+        """Constructor
+
+        typecode: array typecode of the items
+        buf: array or mmap holding the items
+        """
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self.buf = buf if buf is not None else array(typecode)
+        self.mapped = not isinstance(self.buf, array)
+        self.item = struct.Struct('@' + typecode)
+        self.path = None # file mapped, if any
+
+    def __getitem__(self, i):
+        if self.mapped:
+            return self.item.unpack_from(self.buf, i * self.itemsize)[0]
+        return self.buf[i]
+
+    def __len__(self):
+        if self.mapped:
+            return len(self.buf) / self.itemsize
+        return len(self.buf)
+
+    def slice(self, start, end):
+        """Returns items start:end as a list
+        """
+        if self.mapped:
+            size = self.itemsize
+            return array(self.typecode, self.buf[start * size:end * size]).tolist()
+        return self.buf[start:end].tolist()
+
+    def subarray(self, start, end):
+        """Returns items start:end as an array
+        """
+        if self.mapped:
+            size = self.itemsize
+            return array(self.typecode, self.buf[start * size:end * size])
+        return self.buf[start:end]
+
+    def nbytes(self):
+        return len(self) * self.itemsize
+
+    def tostring(self):
+        if self.mapped:
+            return self.buf[:]
+        return self.buf.tostring()
+
+    def save(self, path):
+        if self.mapped and self.path == path:
+            # still the file at path
+            return
+        # written aside and renamed, so maps of the old file stay valid
+        fh = open(path + ".tmp", 'wb')
+        if self.mapped:
+            fh.write(self.buf[:])
+        else:
+            self.buf.tofile(fh)
+        fh.close()
+        os.rename(path + ".tmp", path)
+
+    @classmethod
+    def open(cls, typecode, path):
+        """Memory-maps the column stored at path
+        """
+        if not os.path.getsize(path):
+            return cls(typecode)
+        fh = open(path, 'rb')
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        fh.close()
+        column = cls(typecode, buf)
+        column.path = path
+        return column
+
+def is_sparse(nkeys, max_key):
+    """Returns whether nkeys keys up to max_key take less room as sorted
+    ids plus one slot each than as one slot per key
+    """
+    return 2 * nkeys < max_key + 1
+
+def find(ids, k):
+    """Returns the position of k in the sorted Column ids, None if absent
+    """
+    i = bisect_left(ids, k)
+    if i < len(ids) and ids[i] == k:
+        return i
+    return None
+
+def spread(ids, offsets):
+    """Returns the offsets of the slots of the sorted keys ids as offsets
+    with one slot per key up to the largest
+    """
+    dense = array(offsets.typecode, [0]) * ((ids[-1] + 2) if ids else 1)
+    for i, k in enumerate(ids):
+        dense[k + 1] = offsets[i + 1]
+    for k in xrange(1, len(dense)):
+        if not dense[k]:
+            dense[k] = dense[k - 1]
+    return dense
+
+class Relation:
+    """Read-only mapping of int keys to lists of ints
+
+    offsets[i]:offsets[i + 1] slices values for the key in slot i: key i
+    itself, or ids[i] when the relation is sparse.  Keys with an empty
+    slice are treated as missing, like an untouched defaultdict(list).
+    """
+    kind = 'relation'
+
+    def __init__(self, offsets=None, values=None, nkeys=0, ids=None):
+        """Constructor
+
+        ids: sorted keys of the slots, None for one slot per key
+        """
+        self.offsets = offsets if offsets is not None else Column('i')
+        self.values = values if values is not None else Column('i')
+        self.nkeys = nkeys
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, d, typecode='i'):
+        """Builds a Relation from a dict of lists keyed by ints >= 0
+        """
+        return cls.from_items(sorted([(k, v) for k, v in d.iteritems() if v]),
+                              typecode)
+
+    @classmethod
+    def from_items(cls, items, typecode='i'):
+        """Builds a Relation from (key, list) pairs sorted by key, with
+        nonempty lists
+        """
+        ids = array('i')
+        offsets = array('i', [0])
+        values = array(typecode)
+        for k, v in items:
+            ids.append(k)
+            values.extend(v)
+            offsets.append(len(values))
+        max_key = ids[-1] if ids else -1
+        if is_sparse(len(ids), max_key):
+            return cls(Column('i', offsets), Column(typecode, values),
+                       len(ids), Column('i', ids))
+
+        return cls(Column('i', spread(ids, offsets)),
+                   Column(typecode, values), len(ids))
+
+    def columns(self):
+        columns = {'off': self.offsets, 'val': self.values}
+        if self.ids is not None:
+            columns['ids'] = self.ids
+        return columns
+
+    def meta(self):
+        return {'nkeys': self.nkeys}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(columns['off'], columns['val'], meta['nkeys'],
+                   columns.get('ids'))
+
+    def slot(self, k):
+        """Returns the slot of key k, None if it has none
+        """
+        if self.ids is not None:
+            return find(self.ids, k)
+        if 0 <= k < len(self.offsets) - 1:
+            return k
+        return None
+
+    def __getitem__(self, k):
+        i = self.slot(k)
+        if i is None:
+            return []
+        return self.values.slice(self.offsets[i], self.offsets[i + 1])
+
+    def __contains__(self, k):
+        i = self.slot(k)
+        return i is not None and self.offsets[i + 1] > self.offsets[i]
+
+    def __len__(self):
+        return self.nkeys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, k, default=None):
+        if k in self:
+            return self[k]
+        return default
+
+    def keys(self):
+        if self.ids is not None:
+            return self.ids.slice(0, len(self.ids))
+        offsets = self.offsets.slice(0, len(self.offsets))
+        return [k for k in xrange(len(offsets) - 1)
+                if offsets[k + 1] > offsets[k]]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        if self.ids is not None:
+            offsets = self.offsets.slice(0, len(self.offsets))
+            for i, k in enumerate(self.ids.slice(0, len(self.ids))):
+                yield k, self.values.slice(offsets[i], offsets[i + 1])
+            return
+        for k in self.keys():
+            yield k, self[k]
+
+    def itervalues(self):
+        for k, v in self.iteritems():
+            yield v
+
+    def dense_offsets(self):
+        """Returns an array of offsets with one slot per key, as a dense
+        relation has them
+        """
+        offsets = self.offsets.subarray(0, len(self.offsets))
+        if self.ids is None:
+            return offsets
+        return spread(self.ids.subarray(0, len(self.ids)), offsets)
+
+    def nbytes(self):
+        size = self.offsets.nbytes() + self.values.nbytes()
+        if self.ids is not None:
+            size += self.ids.nbytes()
+        return size
+
+    def extended(self, additions):
+        """Returns a new in-memory Relation with the lists in additions
+        (dict of key = list) appended to those keys
+        """
+        d = dict(self.iteritems())
+        for k, values in additions.iteritems():
+            if values:
+                d[k] = d.get(k, []) + list(values)
+        return Relation.from_dict(d, self.values.typecode)
+
+class KeyedRelation:
+    """Read-only mapping of string keys to lists of ints
+
+    keys holds the sorted keys joined by newlines; a key's position in it
+    is its key in the underlying Relation.  The key index is built on
+    first lookup.
+    """
+    kind = 'keyed'
+
+    def __init__(self, keys=None, relation=None):
+        """Constructor
+        """
+        self.keys_ = keys if keys is not None else Column('c')
+        self.relation = relation if relation is not None else Relation()
+        self.index = None
+
+    @classmethod
+    def from_dict(cls, d, typecode='i'):
+        """Builds a KeyedRelation from a dict of lists keyed by strings
+        """
+        keys = sorted([k for k in d if d[k]])
+        relation = Relation.from_dict(
+            dict((i, d[k]) for i, k in enumerate(keys)), typecode)
+        return cls(Column('c', array('c', "\n".join(keys))), relation)
+
+    def columns(self):
+        columns = self.relation.columns()
+        columns['keys'] = self.keys_
+        return columns
+
+    def meta(self):
+        return self.relation.meta()
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(columns['keys'], Relation.from_columns(columns, meta))
+
+    def key_index(self):
+        if self.index is None:
+            keys = self.keys_.tostring()
+            keys = keys.split("\n") if keys else []
+            self.index = dict((k, i) for i, k in enumerate(keys))
+        return self.index
+
+    def __getitem__(self, k):
+        i = self.key_index().get(k)
+        if i is None:
+            return []
+        return self.relation[i]
+
+    def __contains__(self, k):
+        return k in self.key_index()
+
+    def __len__(self):
+        return len(self.relation)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, k, default=None):
+        if k in self:
+            return self[k]
+        return default
+
+    def keys(self):
+        keys = self.keys_.tostring()
+        return keys.split("\n") if keys else []
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        for k in self.keys():
+            yield k, self[k]
+
+    def itervalues(self):
+        for k in self.keys():
+            yield self[k]
+
+    def nbytes(self):
+        return self.keys_.nbytes() + self.relation.nbytes()
+
+    def extended(self, additions):
+        """Returns a new in-memory KeyedRelation with the lists in
+        additions (dict of key = list) appended to those keys
+        """
+        d = dict(self.iteritems())
+        for k, values in additions.iteritems():
+            d[k] = d.get(k, []) + list(values)
+        return KeyedRelation.from_dict(d, self.relation.values.typecode)
+
+class IntMap:
+    """Read-only mapping of int keys to ints, 0 meaning missing, like an
+    untouched defaultdict(int)
+
+    values[i] is the value of the key in slot i: key i itself, or ids[i]
+    when the map is sparse.
+    """
+    kind = 'intmap'
+
+    def __init__(self, values=None, nkeys=0, ids=None):
+        """Constructor
+
+        ids: sorted keys of the slots, None for one slot per key
+        """
+        self.values = values if values is not None else Column('i')
+        self.nkeys = nkeys
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, d, typecode='i'):
+        """Builds an IntMap from a dict of ints keyed by ints >= 0
+        """
+        items = sorted([(k, v) for k, v in d.iteritems() if v])
+        max_key = items[-1][0] if items else -1
+        if is_sparse(len(items), max_key):
+            return cls(Column(typecode, array(typecode,
+                                              [v for k, v in items])),
+                       len(items), Column('i', array('i',
+                                                     [k for k, v in items])))
+        values = array(typecode, [0]) * (max_key + 1)
+        for k, v in items:
+            values[k] = v
+        return cls(Column(typecode, values), len(items))
+
+    def columns(self):
+        columns = {'val': self.values}
+        if self.ids is not None:
+            columns['ids'] = self.ids
+        return columns
+
+    def meta(self):
+        return {'nkeys': self.nkeys}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(columns['val'], meta['nkeys'], columns.get('ids'))
+
+    def __getitem__(self, k):
+        if self.ids is not None:
+            i = find(self.ids, k)
+            return 0 if i is None else self.values[i]
+        if not 0 <= k < len(self.values):
+            return 0
+        return self.values[k]
+
+    def __contains__(self, k):
+        return self[k] != 0
+
+    def __len__(self):
+        return self.nkeys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, k, default=None):
+        if k in self:
+            return self[k]
+        return default
+
+    def keys(self):
+        return [k for k, v in self.items()]
+
+    def items(self):
+        values = self.values.slice(0, len(self.values))
+        if self.ids is not None:
+            return zip(self.ids.slice(0, len(self.ids)), values)
+        return [(k, values[k]) for k in xrange(len(values)) if values[k]]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def dense(self):
+        """Returns an array of the values with one slot per key, as a
+        dense map has them
+        """
+        values = self.values.subarray(0, len(self.values))
+        if self.ids is None:
+            return values
+        ids = self.ids.slice(0, len(self.ids))
+        dense = array(values.typecode, [0]) * ((ids[-1] + 1) if ids else 0)
+        for k, v in izip(ids, values):
+            dense[k] = v
+        return dense
+
+    def nbytes(self):
+        size = self.values.nbytes()
+        if self.ids is not None:
+            size += self.ids.nbytes()
+        return size
+
+    def updated(self, changes):
+        """Returns a new in-memory IntMap with changes (dict of key = int)
+        applied
+        """
+        d = dict(self.items())
+        d.update(changes)
+        return IntMap.from_dict(d, self.values.typecode)
+
+class RecordTable:
+    """Read-only mapping of dense int keys to byte strings, for lookups
+    of a few records without unpickling a whole dict
+
+    offsets[k]:offsets[k + 1] slices the record of key k out of data.
+    """
+    kind = 'records'
+
+    def __init__(self, offsets=None, data=None, nkeys=0):
+        """Constructor
+        """
+        self.offsets = offsets if offsets is not None else Column('i')
+        self.data = data if data is not None else Column('c')
+        self.nkeys = nkeys
+
+    @classmethod
+    def from_dict(cls, d):
+        """Builds a RecordTable from a dict of strings keyed by ints >= 0
+        """
+        max_key = max([k for k, v in d.iteritems() if v] or [-1])
+        offsets = array('i', [0])
+        data = []
+        size = 0
+        for k in xrange(max_key + 1):
+            record = d.get(k, "")
+            data.append(record)
+            size += len(record)
+            offsets.append(size)
+        nkeys = len([k for k in d if d[k]])
+        return cls(Column('i', offsets), Column('c', array('c', "".join(data))),
+                   nkeys)
+
+    def columns(self):
+        return {'off': self.offsets, 'data': self.data}
+
+    def meta(self):
+        return {'nkeys': self.nkeys}
+
+    @classmethod
+    def from_columns(cls, columns, meta):
+        return cls(columns['off'], columns['data'], meta['nkeys'])
+
+    def __getitem__(self, k):
+        if not 0 <= k < len(self.offsets) - 1:
+            return ""
+        start, end = self.offsets[k], self.offsets[k + 1]
+        if self.data.mapped:
+            return self.data.buf[start:end]
+        return self.data.buf[start:end].tostring()
+
+    def __contains__(self, k):
+        return (0 <= k < len(self.offsets) - 1
+                and self.offsets[k + 1] > self.offsets[k])
+
+    def __len__(self):
+        return self.nkeys
+
+    def get(self, k, default=None):
+        if k in self:
+            return self[k]
+        return default
+
+    def nbytes(self):
+        return self.offsets.nbytes() + self.data.nbytes()
+
+def prefixed(prefix, columns):
+    """Returns the columns of a relation named prefix.<column>, to store
+    it as part of another
+    """
+    return dict(('.'.join((prefix, name)), column)
+                for name, column in columns.items())
+
+def unprefixed(prefix, columns):
+    """Returns the columns named prefix.<column> by their <column> name
+    """
+    start = len(prefix) + 1
+    return dict((name[start:], column) for name, column in columns.items()
+                if name.startswith(prefix + "."))
+
+def boxed_size(rel):
+    """Returns the bytes rel would take as a dict of lists of boxed ints
+    (or of ints, for an IntMap), measured with sys.getsizeof
+    """
+    keys = rel.keys()
+    size = sys.getsizeof(dict.fromkeys(keys))
+    for k, values in rel.iteritems():
+        size += sys.getsizeof(k) + sys.getsizeof(values)
+        if isinstance(values, list):
+            size += sum([sys.getsizeof(v) for v in values])
+    return size
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Recommendation server
+
+Keeps a Database loaded and answers Engine.user_process for any user
+over HTTP on localhost:
+
+  GET /recommend?user=N  => {"user": N, "repos": [...], "cached": bool}
+  GET /stats             => request count, cache hits, latency percentiles
+  GET /reload            => reopens the snapshot and empties the cache
+
+The snapshot is also reopened automatically when its manifest changes
+on disk, e.g. after 'recommend.py update'.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import deque, OrderedDict
+from urlparse import parse_qs, urlparse
+import json
+import os
+import time
+
+from matchmaker import msg
+from matchmaker.database import Database
+from matchmaker.engine import Engine
+from matchmaker.utils import percentile
+
+class LRUCache:
+    """Least recently used cache of at most size entries
+    """
+    def __init__(self, size):
+        """Constructor
+        """
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class Recommender:
+    """Warm Database and Engine with a per-user result cache
+    """
+    def __init__(self, datadir, cache_size=10000, samples=10000):
+        """Constructor
+
+        cache_size: users whose recommendations are kept
+        samples: most recent request latencies kept for percentiles
+        """
+        self.datadir = datadir
+        self.cache = LRUCache(cache_size)
+        self.latencies = deque(maxlen=samples)
+        self.requests = 0
+        self.hits = 0
+        self.reload()
+
+    def manifest_stamp(self):
+        path = '/'.join((self.datadir, "snapshot", "manifest"))
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime)
+
+    def reload(self):
+        msg("Loading database '%s'" % self.datadir)
+        self.database = Database(self.datadir)
+        self.database.preload()
+        self.engine = Engine(self.database, batch=False)
+        self.stamp = self.manifest_stamp()
+        self.cache.clear()
+
+    def recommend(self, user):
+        """Returns (recommendations, cached)
+        """
+        start = time.time()
+        stamp = self.manifest_stamp()
+        if stamp is not None and stamp != self.stamp:
+            self.reload()
+
+        self.requests += 1
+        repos = self.cache.get(user)
+        cached = repos is not None
+        if cached:
+            self.hits += 1
+        else:
+            repos = self.engine.user_process(user)
+            self.cache.put(user, repos)
+
+        self.latencies.append(time.time() - start)
+        return repos, cached
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {'requests': self.requests,
+                'cache_hits': self.hits,
+                'cache_size': len(self.cache),
+                'latency_ms': dict(('p%d' % p,
+                                    1000.0 * percentile(latencies, p))
+                                   for p in (50, 95, 99))}
+
+class Handler(BaseHTTPRequestHandler):
+    """HTTP front end of the Recommender bound to the server
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        recommender = self.server.recommender
+
+        if url.path == '/recommend':
+            try:
+                user = int(query['user'][0])
+            except (KeyError, ValueError):
+                return self.reply(400, {'error': "expected ?user=<id>"})
+            repos, cached = recommender.recommend(user)
+            return self.reply(200, {'user': user,
+                                    'repos': repos,
+                                    'cached': cached})
+        elif url.path == '/stats':
+            return self.reply(200, recommender.stats())
+        elif url.path == '/reload':
+            recommender.reload()
+            return self.reply(200, {'reloaded': True})
+        return self.reply(404, {'error': "unknown path %s" % url.path})
+
+    def reply(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        msg(format % args)
+
+def make_server(datadir, port=8000, host='127.0.0.1', cache_size=10000):
+    """Returns the HTTPServer of a Recommender of datadir, not yet serving
+
+    port: 0 for any free port, then found in server_address
+    """
+    httpd = HTTPServer((host, port), Handler)
+    httpd.recommender = Recommender(datadir, cache_size)
+    return httpd
+
+def serve(datadir, port=8000, host='127.0.0.1', cache_size=10000):
+    """Serves recommendations until interrupted
+    """
+    httpd = make_server(datadir, port, host, cache_size)
+    msg("Serving on http://%s:%d/" % httpd.server_address)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
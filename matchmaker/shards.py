@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Sharded production runs
+
+One production run can be spread across machines sharing a read-only
+snapshot: `recommend.py production --shard=i --shards=n` scores the test
+users of shard i (0 to n-1) and writes them to results.<i>-of-<n>.txt,
+and `recommend.py merge --shards=n` checks that the partial files cover
+the test users exactly once and writes results.txt.
+
+Users are split by cost rather than by count, a user costing 1 plus the
+repos it watches: heaviest first, each goes to the shard with the least
+cost so far, ties to the lowest shard.  The split depends only on the
+test users and the watch lists, so every machine computes the same one
+without talking to the others.
+
+A partial file is results.txt lines under a "# shard i/n" header, written
+to a temporary file and renamed, so a file that exists is complete.
+"""
+
+import heapq
+import os
+
+from matchmaker.utils import option
+
+def cost(user, u_watching):
+    """Returns the cost of scoring user
+    """
+    return 1 + len(u_watching.get(user, ()))
+
+def split(users, u_watching, shards):
+    """Returns the users of each of shards shards, each list sorted
+    """
+    loads = [(0, i) for i in xrange(shards)]
+    members = [[] for i in xrange(shards)]
+    for weight, user in sorted([(cost(u, u_watching), u) for u in users],
+                               key=lambda x:(-x[0], x[1])):
+        load, i = heapq.heappop(loads)
+        members[i].append(user)
+        heapq.heappush(loads, (load + weight, i))
+    return [sorted(m) for m in members]
+
+def shard_users(users, u_watching, index, shards):
+    """Returns the users of shard index out of shards
+    """
+    return split(users, u_watching, shards)[index]
+
+def from_argv(argv):
+    """Returns (index, shards) from --shard=i --shards=n, None without
+    --shards
+    """
+    shards = int(option(argv, 'shards', 0))
+    if not shards:
+        return None
+    index = int(option(argv, 'shard', 0))
+    if not 0 <= index < shards:
+        raise ValueError("--shard=%d is not in 0..%d" % (index, shards - 1))
+    return index, shards
+
+def partial_path(index, shards, prefix="results"):
+    """Returns the path of the partial results of shard index
+    """
+    return "%s.%d-of-%d.txt" % (prefix, index, shards)
+
+def write_partial(path, shard, lines):
+    """Writes the results lines (Engine.result_lines()) of shard (index,
+    shards) to path
+    """
+    tmp = path + ".tmp"
+    fh = open(tmp, 'w')
+    fh.write("# shard %d/%d\n" % shard)
+    for text in lines:
+        fh.write(text)
+        fh.write("\n")
+    fh.close()
+    os.rename(tmp, path)
+
+def read_partial(path):
+    """Returns (shard, [(user, line), ...]) of a partial results file
+    """
+    fh = open(path)
+    header = fh.readline().split()
+    if header[:2] != ['#', 'shard']:
+        raise ValueError("%s: not a partial results file" % path)
+    index, shards = [int(x) for x in header[2].split("/")]
+    entries = []
+    for line in fh:
+        line = line.rstrip("\n")
+        if line:
+            entries.append((int(line.split(":", 1)[0]), line))
+    fh.close()
+    return (index, shards), entries
+
+def merge(paths, test_u):
+    """Returns the lines of results.txt merged from the partial files at
+    paths, sorted by user
+
+    Raises ValueError unless the files are the shards of one split and
+    cover test_u exactly once.
+    """
+    seen = {}
+    found = set()
+    lines = {}
+    for path in paths:
+        shard, entries = read_partial(path)
+        if shard in found:
+            raise ValueError("%s: shard %d/%d read twice" % ((path,) + shard))
+        found.add(shard)
+        for user, line in entries:
+            if user in seen:
+                raise ValueError("user %d in both %s and %s"
+                                 % (user, seen[user], path))
+            seen[user] = path
+            lines[user] = line
+
+    counts = set([shards for index, shards in found])
+    if len(counts) != 1:
+        raise ValueError("partial files of different splits: %s"
+                         % sorted(found))
+    shards = counts.pop()
+    missing = set([(i, shards) for i in xrange(shards)]) - found
+    if missing:
+        raise ValueError("missing shards %s of %d"
+                         % (sorted([i for i, n in missing]), shards))
+    expected = set(test_u)
+    absent = sorted(expected - set(lines))
+    if absent:
+        raise ValueError("%d test users missing, first %s"
+                         % (len(absent), absent[:5]))
+    extra = sorted(set(lines) - expected)
+    if extra:
+        raise ValueError("%d users not in test_u, first %s"
+                         % (len(extra), extra[:5]))
+    return [lines[u] for u in sorted(lines)]
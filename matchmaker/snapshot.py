@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Versioned on-disk snapshot of a Database
+
+A snapshot is a directory next to the source files holding:
+
+  manifest          pickled dict: version, source file stats, fields
+  <field>.<column>  raw column of a compact relation, memory-mapped
+  <field>.arr       raw per-key array, read whole into memory
+  <field>.pkl       any other field, unpickled on first access
+
+The manifest is written last and removed first, so an interrupted write
+leaves no valid snapshot behind.  Rewriting a snapshot only writes what
+changed: columns still mapped from their own file and fields listed as
+unchanged keep their files.  A snapshot is stale when the format
+version, the column item sizes or the size/mtime of any source file
+differ from what the manifest recorded.
+"""
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+from array import array
+import os
+
+from matchmaker import msg
+from matchmaker.clusters import UserClusters
+from matchmaker.contrib import Contributions
+from matchmaker.cooccur import Cooccurrence
+from matchmaker.names import NameIndex
+from matchmaker.relation import Column, IntMap, KeyedRelation, RecordTable, \
+     Relation
+
+VERSION = 14
+SOURCES = ('data.txt', 'repos.txt', 'lang.txt', 'test.txt')
+KINDS = dict((cls.kind, cls)
+             for cls in (Relation, KeyedRelation, IntMap, RecordTable,
+                         Cooccurrence, Contributions, NameIndex,
+                         UserClusters))
+
+def sources(datadir):
+    """Returns dict of source file = (size, mtime), None if missing
+    """
+    stats = {}
+    for name in SOURCES:
+        path = '/'.join((datadir, name))
+        if os.path.exists(path):
+            st = os.stat(path)
+            stats[name] = (st.st_size, st.st_mtime)
+        else:
+            stats[name] = None
+    return stats
+
+def itemsizes():
+    return dict((tc, array(tc).itemsize) for tc in 'cild')
+
+def read_manifest(path):
+    """Returns the manifest of the snapshot at path, None if missing,
+    unreadable or stale
+    """
+    manifest = '/'.join((path, "manifest"))
+    if not os.path.exists(manifest):
+        return None
+    try:
+        fh = open(manifest, 'rb')
+        d = pickle.load(fh)
+        fh.close()
+    except:
+        return None
+
+    if d.get('version') != VERSION or d.get('itemsizes') != itemsizes():
+        return None
+    if d.get('sources') != sources(os.path.dirname(path) or '.'):
+        msg("snapshot '%s' is stale" % path)
+        return None
+    return d
+
+def write(path, compact, pickled, arrays, unchanged=()):
+    """Writes a snapshot
+
+    compact: dict of field = compact relation, one of KINDS
+    pickled: dict of field = any picklable object
+    arrays: dict of field = array
+    unchanged: pickled and array fields already written at path, whose
+               values are not needed
+    """
+    msg("Writing snapshot '%s'" % path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    manifest = '/'.join((path, "manifest"))
+    if os.path.exists(manifest):
+        os.remove(manifest)
+
+    d = {'version': VERSION,
+         'itemsizes': itemsizes(),
+         'sources': sources(os.path.dirname(path) or '.'),
+         'compact': {},
+         'arrays': {},
+         'pickled': sorted(pickled.keys())}
+
+    for field, rel in compact.items():
+        columns = {}
+        for name, column in rel.columns().items():
+            column.save('/'.join((path, "%s.%s" % (field, name))))
+            columns[name] = column.typecode
+        d['compact'][field] = (rel.kind, columns, rel.meta())
+
+    for field, value in arrays.items():
+        if field not in unchanged:
+            Column(value.typecode, value).save(
+                '/'.join((path, "%s.arr" % field)))
+        d['arrays'][field] = value.typecode
+
+    for field, value in pickled.items():
+        if field in unchanged:
+            continue
+        fh = open('/'.join((path, "%s.pkl" % field)), 'wb')
+        pickle.dump(value, fh, pickle.HIGHEST_PROTOCOL)
+        fh.close()
+
+    fh = open(manifest + ".tmp", 'wb')
+    pickle.dump(d, fh, pickle.HIGHEST_PROTOCOL)
+    fh.close()
+    os.rename(manifest + ".tmp", manifest)
+
+def open_compact(path, manifest, only=None):
+    """Returns dict of field = memory-mapped compact relation, for all
+    compact fields or only those listed
+    """
+    fields = {}
+    for field, (kind, columns, meta) in manifest['compact'].items():
+        if only is not None and field not in only:
+            continue
+        mapped = {}
+        for name, typecode in columns.items():
+            mapped[name] = Column.open(
+                typecode, '/'.join((path, "%s.%s" % (field, name))))
+        fields[field] = KINDS[kind].from_columns(mapped, meta)
+    return fields
+
+def read_arrays(path, manifest):
+    """Returns dict of field = array
+    """
+    fields = {}
+    for field, typecode in manifest['arrays'].items():
+        name = '/'.join((path, "%s.arr" % field))
+        values = array(typecode)
+        fh = open(name, 'rb')
+        values.fromfile(fh, os.path.getsize(name) / values.itemsize)
+        fh.close()
+        fields[field] = values
+    return fields
+
+def load_field(path, field):
+    """Unpickles one field of the snapshot at path
+    """
+    fh = open('/'.join((path, "%s.pkl" % field)), 'rb')
+    value = pickle.load(fh)
+    fh.close()
+    return value
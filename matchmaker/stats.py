@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Per-repository statistics
+
+Computed in bulk over the watch edges and stored as flat arrays indexed
+by repos id, so the engine indexes them instead of calling len() and
+log() in its inner loops.  Uses NumPy for the edge passes when it is
+installed.
+"""
+
+from array import array
+from heapq import nlargest
+from itertools import izip
+from math import log, log10
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def edges(u_watching):
+    """Returns (repos, tf) arrays with one entry per watch: the repos
+    watched, and the watching user's term frequency, 1 / (number of repos
+    they watch)
+    """
+    rs = array('i')
+    tf = array('d')
+    for repos in u_watching.itervalues():
+        rs.extend(repos)
+        tf.extend([1.0 / len(repos)] * len(repos))
+    return rs, tf
+
+def watchers(rs, size):
+    """Returns array of the number of watchers of each repos, given the
+    repos of each watch edge
+    """
+    if numpy is not None:
+        counts = numpy.bincount(numpy.frombuffer(rs, numpy.intc),
+                                minlength=size)
+        return array('i', counts.astype(numpy.intc).tostring())
+
+    counts = array('i', [0]) * size
+    for r in rs:
+        counts[r] += 1
+    return counts
+
+def popularity(counts, offset):
+    """Returns array of log10(offset + watchers) for each repos
+
+    Taken with math.log10, as the engines take their own logarithms, so
+    equal popularities score equal.
+    """
+    return array('d', [log10(offset + n) for n in counts])
+
+def tf_idf(rs, tf, counts, total_users):
+    """Returns (idf, tf-idf average) arrays over all repos, given the watch
+    edges (see edges()) and the number of users
+    """
+    size = len(counts)
+    total_users = float(total_users)
+
+    if numpy is not None:
+        n = numpy.frombuffer(counts, numpy.intc).astype(numpy.float64)
+        idf = numpy.log(total_users / (1.0 + n))
+        tf_sum = numpy.bincount(numpy.frombuffer(rs, numpy.intc),
+                                weights=numpy.frombuffer(tf, numpy.float64),
+                                minlength=size)
+        avg = numpy.zeros(size)
+        watched = n > 0
+        avg[watched] = idf[watched] * tf_sum[watched] / n[watched]
+        return array('d', idf.tostring()), array('d', avg.tostring())
+
+    idf = array('d', [log(total_users / (1.0 + c)) for c in counts])
+    tf_sum = array('d', [0.0]) * size
+    for r, tf_user in izip(rs, tf):
+        tf_sum[r] += tf_user
+    avg = array('d', [idf[r] * tf_sum[r] / counts[r] if counts[r] else 0.0
+                      for r in xrange(size)])
+    return idf, avg
+
+def labels(r_info, column, size):
+    """Returns array of an id for each repos' value in r_info column (0
+    author, 1 name), numbered from 1 in sorted order of the values; repos
+    without info get 0
+    """
+    values = sorted(set([info[column] for info in r_info.itervalues()]))
+    ids = dict((value, i + 1) for i, value in enumerate(values))
+    labels = array('i', [0]) * size
+    for r, info in r_info.iteritems():
+        labels[r] = ids[info[column]]
+    return labels
+
+def renumbering(old, new):
+    """Returns array of the new id of each old id, given the old and new
+    labels arrays of the same repos
+    """
+    ids = array('i', [0]) * (max(old or [0]) + 1)
+    for old_id, new_id in izip(old, new):
+        if old_id:
+            ids[old_id] = new_id
+    return ids
+
+def creation(r_info, size):
+    """Returns (created, days, repos): the creation ordinal of each repos,
+    0 without info, and the dated repos sorted by creation then id
+    alongside their ordinals
+    """
+    created = array('i', [0]) * size
+    for r, info in r_info.iteritems():
+        created[r] = info[2]
+    dated = sorted([(day, r) for r, day in enumerate(created) if day])
+    return (created, array('i', [day for day, r in dated]),
+            array('i', [r for day, r in dated]))
+
+def lang_key(lang, lnloc):
+    """Returns the lang_index key of a language and lnloc bucket
+    """
+    return "%s:%d" % (lang, lnloc)
+
+def lang_buckets(lang_by_r, watchers, depth):
+    """Returns dict of lang_key = the depth most watched repos of that
+    language and lnloc, ties broken by lowest repos id
+
+    watchers: function of repos returning its number of watchers
+    """
+    buckets = {}
+    for lang, entries in lang_by_r.iteritems():
+        for lnloc, r in entries:
+            buckets.setdefault(lang_key(lang, lnloc), []).append(r)
+    return dict((key, nlargest(depth, repos, key=lambda r:(watchers(r), -r)))
+                for key, repos in buckets.iteritems())
+
+def top(counts, n):
+    """Returns the n most watched repos, ties broken by lowest repos id
+    """
+    return nlargest(n, [r for r in xrange(len(counts)) if counts[r]],
+                    key=lambda r:(counts[r], -r))
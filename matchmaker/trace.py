@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Scoring trace
+
+Records how Engine.user_process scored selected users as JSON lines,
+one object per user:
+
+  level 1  {"user", "watching", "candidates", "top": [[repos, score], ...]}
+  level 2  adds "watch": the watched repos with author, name, creation
+  level 3  adds "scores": every candidate left after the purge, best first
+
+Tracing is off (level 0) unless asked for.  Users are picked by an
+allowlist, else by a sampling rate hashed from the user id, so serial and
+pool runs trace the same users.  Records are buffered in the process
+that scored the user and written out by a single writer: pool workers
+hand theirs back to the parent with their results.
+"""
+
+from datetime import date
+import json
+
+from matchmaker.utils import option
+
+OFF, SUMMARY, WATCH, SCORES = range(4)
+
+class Tracer:
+    """Buffered JSON lines trace of selected users
+    """
+    def __init__(self, level=OFF, sample=1.0, users=None, path="trace.jsonl",
+                 buffer_size=1000):
+        """Constructor
+
+        level: OFF, SUMMARY, WATCH or SCORES
+        sample: fraction of users traced when there is no allowlist
+        users: allowlist of user ids traced regardless of sample
+        path: file the JSON lines are appended to
+        buffer_size: records held before they are written out
+        """
+        self.level = level
+        self.sample = sample
+        self.users = set(users) if users else None
+        self.path = path
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.buffer = []
+        self.fh = None
+
+    def wants(self, user):
+        """Returns whether user is traced
+        """
+        if not self.level:
+            return False
+        if self.users is not None:
+            return user in self.users
+        # Knuth multiplicative hash, stable across processes and runs
+        return (user * 2654435761 % 2 ** 32) < self.sample * 2 ** 32
+
+    def emit(self, user, watching, scores, r_info):
+        """Records the scores (list of (repos, score)) of a traced user
+        """
+        ranked = sorted(scores, reverse=True, key=lambda x:(x[1], -x[0]))
+        record = {'user': user,
+                  'watching': len(watching),
+                  'candidates': len(scores),
+                  'top': ranked[:10]}
+        if self.level >= WATCH:
+            record['watch'] = [describe(r, r_info) for r in watching]
+        if self.level >= SCORES:
+            record['scores'] = [describe(r, r_info, score)
+                                for r, score in ranked]
+        self.pending.append(json.dumps(record))
+
+    def take(self):
+        """Returns and forgets the records emitted in this process
+        """
+        records, self.pending = self.pending, []
+        return records
+
+    def write(self, records):
+        """Buffers records for the trace file, writing them out when the
+        buffer fills
+        """
+        self.buffer.extend(records)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.fh is None:
+            self.fh = open(self.path, 'a')
+        self.fh.write("\n".join(self.buffer) + "\n")
+        self.buffer = []
+
+    def close(self):
+        self.write(self.take())
+        self.flush()
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+def describe(r, r_info, score=None):
+    """Returns [repos, (score,) author, name, creation date] for a record
+    """
+    row = [r] if score is None else [r, score]
+    if r in r_info:
+        author, name, created = r_info[r]
+        row.extend((author, name, date.fromordinal(created).isoformat()))
+    return row
+
+def from_argv(argv):
+    """Returns a Tracer configured by --trace=level, --trace-sample=,
+    --trace-users=1,2,3 and --trace-file=; an allowlist alone traces
+    those users at the SCORES level
+    """
+    level = OFF
+    users = option(argv, 'trace-users')
+    if users:
+        users = [int(u) for u in users.split(",") if u]
+        level = SCORES
+    return Tracer(level=int(option(argv, 'trace', level)),
+                  sample=float(option(argv, 'trace-sample', 1.0)),
+                  users=users,
+                  path=option(argv, 'trace-file', "trace.jsonl"))
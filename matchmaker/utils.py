@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from math import ceil
+
 def permutations(iterable, r=None):
     """Taken straight from http://docs.python.org/library/itertools.html
     """
@@ -26,3 +28,20 @@ def permutations(iterable, r=None):
                 break
         else:
             return
+
+def percentile(values, p):
+    """Returns the p-th percentile (0-100) of sorted values, nearest rank
+    """
+    if not values:
+        return 0.0
+    rank = int(ceil(p / 100.0 * len(values)))
+    return values[min(max(rank - 1, 0), len(values) - 1)]
+
+def option(argv, name, default=None):
+    """Returns value of --name=value from argv
+    """
+    prefix = "--%s=" % name
+    for arg in argv:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
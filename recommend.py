@@ -3,30 +3,119 @@
 import sys
 from matchmaker.database import *
 from matchmaker.engine import *
+from matchmaker import checkpoint, ingest, profiler, shards, trace
+from matchmaker.matrix import MatrixEngine
+from matchmaker.utils import option
 
 def main(argv):
-    if 'production' in argv:
+    if 'serve' in argv:
+        return serve(argv)
+    elif 'update' in argv:
+        return update(argv)
+    elif 'merge' in argv:
+        return merge(argv)
+    elif 'production' in argv:
         return production(argv)
     else:
         return testing(argv)
 
 def production(argv):
-    db = Database('data')
-    e = Engine(db)
-    results = e.results()
+    """production [--shard=i --shards=n]: scores the test users, or the
+    shard i of n of them into its partial results file, checkpointing to
+    <results file>.log and resuming from it if a run was cut short
+    """
+    workers = int(option(argv, 'workers', 0))
+    db = Database('data', workers=workers)
+    try:
+        shard = shards.from_argv(argv)
+        path = shards.partial_path(*shard) if shard else 'results.txt'
+        log = checkpoint.from_argv(argv, path + ".log")
+        e = engine(db, argv, log)
+    except ValueError, err:
+        # e.g. a checkpoint log left by another run
+        msg("production failed: %s" % err)
+        return 1
+
+    if shard:
+        shards.write_partial(path, shard, e.result_lines())
+    else:
+        resf = open(path, 'w')
+        for i, text in enumerate(e.result_lines()):
+            if i:
+                resf.write("\n")
+            resf.write(text)
+        resf.close()
+    if log:
+        log.remove()
+    return 0
+
+def merge(argv):
+    """merge --shards=n: merges the partial results of n shards into
+    results.txt, checking they cover test.txt
+    """
+    n = int(option(argv, 'shards', 0))
+    if not n:
+        msg("merge needs --shards=n")
+        return 1
+    datadir = option(argv, 'data', 'data')
+    test_u = [int(line) for line in
+              ingest.lines('/'.join((datadir, "test.txt")))]
+    try:
+        lines = shards.merge([shards.partial_path(i, n) for i in xrange(n)],
+                             test_u)
+    except (IOError, ValueError), e:
+        msg("merge failed: %s" % e)
+        return 1
 
     resf = open('results.txt', 'w')
-    resf.write(results)
+    resf.write("\n".join(lines))
     resf.close()
     return 0
 
+def update(argv):
+    """update <deltadir>: applies new rows to the production data
+    """
+    deltadir = argv[argv.index('update') + 1]
+    workers = int(option(argv, 'workers', 0))
+    db = Database(option(argv, 'data', 'data'), workers=workers)
+    db.apply_delta(deltadir)
+    return 0
+
+def serve(argv):
+    """serve: answers recommendations over HTTP on localhost
+    """
+    from matchmaker.server import serve
+    serve(option(argv, 'data', 'data'),
+          port=int(option(argv, 'port', 8000)),
+          cache_size=int(option(argv, 'cache', 10000)))
+    return 0
+
 def testing(argv):
-    db = Database('minidata')
+    workers = int(option(argv, 'workers', 0))
+    db = Database('minidata', workers=workers)
     if 'stats' in argv:
         db.summary()
-    e = Engine(db)
+    try:
+        e = engine(db, argv, checkpoint.from_argv(argv))
+    except ValueError, err:
+        msg("testing failed: %s" % err)
+        return 1
     print(e.results())
     return 0
 
+def engine(db, argv, checkpoint=None):
+    """Returns an Engine having scored the test users, or a MatrixEngine
+    with --matrix; --lang-weight=0 switches the language signal off and
+    --date-window=2.5 switches the date signal on, --shard=i --shards=n
+    scores shard i only; checkpoint: Checkpoint logging scored users
+    """
+    workers = int(option(argv, 'workers', 0))
+    cls = MatrixEngine if '--matrix' in argv else Engine
+    return cls(db, workers=workers or 1, tracer=trace.from_argv(argv),
+               profiler=profiler.from_argv(argv),
+               lang_weight=float(option(argv, 'lang-weight', 2.5)),
+               date_window=float(option(argv, 'date-window', 0)),
+               shard=shards.from_argv(argv), checkpoint=checkpoint)
+
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
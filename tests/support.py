@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Fixtures shared by the tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from matchmaker.database import Database
+
+MINIDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, "minidata")
+SOURCES = ('test.txt', 'data.txt', 'repos.txt', 'lang.txt')
+
+def copy_sources(src, datadir, held=None, deltadir=None):
+    """Copies the source files of src to datadir, except the last
+    held[name] lines of each, which go to deltadir
+    """
+    held = held or {}
+    for name in SOURCES:
+        lines = open(os.path.join(src, name)).readlines()
+        n = held.get(name, 0)
+        fh = open(os.path.join(datadir, name), 'w')
+        fh.writelines(lines[:len(lines) - n])
+        fh.close()
+        if n:
+            fh = open(os.path.join(deltadir, name), 'w')
+            fh.writelines(lines[len(lines) - n:])
+            fh.close()
+
+class TempDirTestCase(unittest.TestCase):
+    """Runs each test with a fresh temporary directory, self.tmp
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+class DataTestCase(TempDirTestCase):
+    """Runs each test with a copy of the source files of `source` in
+    self.datadir (tmp/minidata), less the lines `held` back for a delta
+    in self.deltadir (tmp/delta)
+    """
+    source = MINIDATA
+    held = None
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.datadir = os.path.join(self.tmp, "minidata")
+        self.deltadir = os.path.join(self.tmp, "delta")
+        os.mkdir(self.datadir)
+        os.mkdir(self.deltadir)
+        copy_sources(self.source, self.datadir, self.held, self.deltadir)
+
+    def database(self, datadir=None):
+        """Returns the Database of datadir (default self.datadir), built
+        with one worker
+        """
+        return Database(datadir or self.datadir, workers=1)
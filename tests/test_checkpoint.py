@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""A checkpoint log drops its torn tail and a run resumes from it
+"""
+
+import os
+import unittest
+
+import recommend
+from matchmaker.checkpoint import Checkpoint
+from matchmaker.engine import Engine
+from support import DataTestCase, TempDirTestCase
+
+class CheckpointTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.path = os.path.join(self.tmp, "results.txt.log")
+
+    def write_log(self, text):
+        fh = open(self.path, 'wb')
+        fh.write(text)
+        fh.close()
+
+    def test_torn_tail_truncated(self):
+        self.write_log("1:10,11\n2:\n3:12,1")
+        log = Checkpoint(self.path)
+        self.assertEqual(log.load(), set([1, 2]))
+        self.assertEqual(open(self.path, 'rb').read(), "1:10,11\n2:\n")
+
+        log.add(3, [12, 13])
+        self.assertEqual(list(log.lines()), ["1:10,11", "2:", "3:12,13"])
+
+    def test_malformed_line_ends_log(self):
+        self.write_log("1:10\nxx\n2:11\n")
+        self.assertEqual(Checkpoint(self.path).load(), set([1]))
+        self.assertEqual(open(self.path, 'rb').read(), "1:10\n")
+
+class ResumeTest(DataTestCase):
+    def setUp(self):
+        DataTestCase.setUp(self)
+        self.db = self.database()
+        self.path = os.path.join(self.tmp, "results.txt.log")
+
+    def test_resume_after_torn_write(self):
+        full = list(Engine(self.db).result_lines())
+
+        # a run cut short in the middle of a line
+        done = full[:200]
+        fh = open(self.path, 'wb')
+        fh.write("\n".join(done) + "\n" + full[200][:3])
+        fh.close()
+
+        scored = []
+        class Counting(Engine):
+            def user_process(self, user):
+                scored.append(user)
+                return Engine.user_process(self, user)
+        e = Counting(self.db, checkpoint=Checkpoint(self.path))
+        self.assertEqual(list(e.result_lines()), full)
+        self.assertEqual(len(scored), len(full) - len(done))
+
+    def test_foreign_log_reported(self):
+        fh = open(self.path, 'wb')
+        fh.write("999999:1,2\n")
+        fh.close()
+        self.assertRaises(ValueError, Engine, self.db,
+                          checkpoint=Checkpoint(self.path))
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            status = recommend.main(['recommend.py',
+                                     '--checkpoint=results.txt.log'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(status, 1)
+
+if __name__ == '__main__':
+    unittest.main()
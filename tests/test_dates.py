@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""Creation dates: the sorted index answers range queries and the date
+signal scores candidates alike with and without numpy
+"""
+
+import unittest
+
+from matchmaker import engine
+from support import DataTestCase
+
+class DatesTest(DataTestCase):
+    def setUp(self):
+        DataTestCase.setUp(self)
+        self.db = self.database()
+
+    def test_created_between(self):
+        db = self.db
+        days = sorted(set(db.created_days))
+        first, last = days[len(days) / 3], days[len(days) / 2]
+        expected = sorted((day, r) for r, day in enumerate(db.r_created)
+                          if first <= day <= last)
+        self.assertEqual(db.created_between(first, last),
+                         [r for day, r in expected])
+        self.assertEqual(db.created_between(last, first), [])
+
+    def test_date_bonuses_without_numpy(self):
+        db = self.db
+        candidates = range(0, len(db.r_created), 7)
+        days = [day for day in db.r_created if day]
+        mean = float(sum(days)) / len(days)
+        vectorized = list(engine.date_bonuses(candidates, db.r_created,
+                                              mean, 200.0))
+        saved, engine.numpy = engine.numpy, None
+        try:
+            plain = list(engine.date_bonuses(candidates, db.r_created,
+                                             mean, 200.0))
+        finally:
+            engine.numpy = saved
+        self.assertEqual(vectorized, plain)
+        self.assertTrue(-10.0 in dict(plain).values())
+        self.assertTrue(max(dict(plain).values()) > 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
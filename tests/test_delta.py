@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Applying a delta gives the snapshot a full rebuild would
+"""
+
+import os
+import shutil
+import unittest
+
+from matchmaker.engine import Engine
+from support import DataTestCase, SOURCES
+
+def contents(db, field):
+    """Returns a comparable form of field of db
+    """
+    value = getattr(db, field)
+    if hasattr(value, 'columns'):
+        return dict((name, column.tostring())
+                    for name, column in value.columns().items())
+    if hasattr(value, 'tostring'):
+        return value.tostring()
+    return value
+
+class DeltaTest(DataTestCase):
+    # lines of each source file held back for the delta
+    held = {'data.txt': 300, 'repos.txt': 40, 'lang.txt': 40}
+
+    def test_delta_matches_rebuild(self):
+        self.database().apply_delta(self.deltadir)
+        fulldir = os.path.join(self.tmp, "full")
+        os.mkdir(fulldir)
+        for name in SOURCES:
+            shutil.copy(os.path.join(self.datadir, name), fulldir)
+
+        inc = self.database()
+        self.assertEqual([phase for phase, seconds in inc.timings],
+                         ['open_snapshot'])
+        full = self.database(fulldir)
+        self.assertEqual(inc.fields, full.fields)
+        for field in inc.fields:
+            if field == 'clusters':
+                # labelled against the centroids of the base build
+                continue
+            self.assertEqual(contents(inc, field), contents(full, field),
+                             "%s differs" % field)
+
+        # both pad with the popular repos of the same clusters
+        full.clusters = inc.clusters
+        inc_engine = Engine(inc, batch=False)
+        full_engine = Engine(full, batch=False)
+        for user in full.test_u:
+            self.assertEqual(inc_engine.user_process(user),
+                             full_engine.user_process(user))
+
+if __name__ == '__main__':
+    unittest.main()
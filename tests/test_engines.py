@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Engine and MatrixEngine give the same recommendations, on minidata and
+on generated data
+"""
+
+import unittest
+
+from gendata import Generator
+from matchmaker.engine import Engine
+from matchmaker.matrix import MatrixEngine
+from support import DataTestCase, TempDirTestCase
+
+class EnginesTest(DataTestCase):
+    def setUp(self):
+        DataTestCase.setUp(self)
+        self.db = self.database()
+
+    def assertSameResults(self, **options):
+        self.assertEqual(MatrixEngine(self.db, **options).results(),
+                         Engine(self.db, **options).results())
+
+    def test_same_results(self):
+        self.assertSameResults()
+
+    def test_same_results_without_lang(self):
+        self.assertSameResults(lang_weight=0)
+
+    def test_same_results_with_date(self):
+        self.assertSameResults(date_window=2.5)
+
+class GeneratedEnginesTest(EnginesTest):
+    """The same on gendata.py output, where many users have crowds of
+    candidates to cut down
+    """
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.datadir = self.tmp
+        Generator(scale=0.1, seed=1).generate(self.datadir)
+        self.db = self.database()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Nearest users: top k by symmetric difference among overlapping users
+"""
+
+import unittest
+from collections import defaultdict
+
+from matchmaker.neighbors import build_neighbors, nearest_users, \
+     updated_neighbors
+
+def watches(u_watching):
+    """Returns (u_watching, watching_r) as defaultdicts
+    """
+    watching_r = defaultdict(list)
+    for user, repos in sorted(u_watching.items()):
+        for r in repos:
+            watching_r[r].append(user)
+    return defaultdict(list, u_watching), watching_r
+
+class NeighborsTest(unittest.TestCase):
+    def test_ranked_by_symmetric_difference(self):
+        u_watching, watching_r = watches({
+            1: [10, 11, 12],
+            2: [10, 11, 12],        # diff 0
+            3: [10, 11, 12, 13],    # diff 1
+            4: [10, 13, 14],        # diff 4
+            5: [11, 15, 16],        # diff 4, after 4
+        })
+        self.assertEqual(nearest_users(1, u_watching, watching_r, k=4),
+                         [(2, 0), (3, 1), (4, 4), (5, 4)])
+
+    def test_only_overlapping_users(self):
+        u_watching, watching_r = watches({
+            1: [10, 11, 12, 13],
+            2: [10] + range(100, 110),  # shares 10, diff 13
+            3: [20],                    # shares nothing, would be diff 5
+        })
+        self.assertEqual(nearest_users(1, u_watching, watching_r),
+                         [(2, 13)])
+
+    def test_unknown_user(self):
+        u_watching, watching_r = watches({1: [10]})
+        self.assertEqual(nearest_users(9, u_watching, watching_r), [])
+
+    def test_updated_matches_rebuild(self):
+        lists = dict((u, [10 + (u * 7 + i * 3) % 17
+                          for i in xrange(u % 5 + 1)])
+                     for u in xrange(1, 40))
+        u_watching, watching_r = watches(lists)
+        users = range(1, 40, 2)
+        neighbors = build_neighbors(users, u_watching, watching_r, k=3)
+
+        added = {3: [30], 8: [10, 31], 21: [12]}
+        for user, repos in added.items():
+            lists[user] = lists[user] + repos
+        u_watching, watching_r = watches(lists)
+        updated_neighbors(neighbors, users, added, u_watching, watching_r,
+                          k=3)
+        self.assertEqual(neighbors,
+                         build_neighbors(users, u_watching, watching_r, k=3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""Final ranking: caps per author and name, repos without info uncapped
+"""
+
+import unittest
+
+from array import array
+
+from matchmaker import rank
+from matchmaker.rank import ranked, summed
+
+class RankTest(unittest.TestCase):
+    def test_caps(self):
+        # repos 1-4 by author 7, repos 5-10 named 8
+        r_author_id = [0, 7, 7, 7, 7, 0, 0, 0, 0, 0, 0, 0]
+        r_name_id = [0, 1, 2, 3, 4, 8, 8, 8, 8, 8, 8, 0]
+        scores = dict((r, 20.0 - r) for r in xrange(1, 12))
+        top, kept = ranked(scores, r_author_id, r_name_id, k=20)
+        self.assertEqual([r for r, _ in top], [1, 2, 5, 6, 7, 8, 9, 11])
+        self.assertEqual(top, kept)
+
+    def test_without_info_uncapped(self):
+        r_author_id = [0] * 10
+        r_name_id = [0] * 10
+        scores = dict((r, 1.0) for r in xrange(10))
+        top, _ = ranked(scores, r_author_id, r_name_id, k=20)
+        self.assertEqual([r for r, score in top], range(10))
+
+class SummedTest(unittest.TestCase):
+    def test_ascending_order(self):
+        # added in any other order, 2 ** 53 absorbs one of the 1.0s
+        repos = array('i', [5, 3, 5, 5, 3])
+        weights = array('d', [1.0, 0.5, 2.0 ** 53, 1.0, 0.25])
+        expected = {3: 0.75, 5: 2.0 ** 53 + 2.0}
+        self.assertEqual(summed(repos, weights), expected)
+
+        saved, rank.numpy = rank.numpy, None
+        try:
+            self.assertEqual(summed(repos, weights), expected)
+        finally:
+            rank.numpy = saved
+
+if __name__ == '__main__':
+    unittest.main()
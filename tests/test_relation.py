@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Compact relations: dense and sparse layouts behave like their dicts
+"""
+
+import os
+import unittest
+
+from matchmaker.relation import Column, IntMap, RecordTable, Relation
+from support import TempDirTestCase
+
+SPARSE = {3: [1, 2], 90: [4], 1000: [5, 6, 7]}
+DENSE = {0: [1], 1: [2, 3], 3: [4], 4: [5]}
+
+class RelationTest(TempDirTestCase):
+    def check(self, d, rel):
+        self.assertEqual(len(rel), len(d))
+        self.assertEqual(rel.keys(), sorted(d))
+        self.assertEqual(dict(rel.iteritems()), d)
+        for k in range(-1, 1002):
+            self.assertEqual(rel[k], d.get(k, []))
+            self.assertEqual(k in rel, k in d)
+
+    def reopened(self, rel, cls):
+        """Returns rel saved as columns and memory-mapped back
+        """
+        columns = {}
+        for name, column in rel.columns().items():
+            path = os.path.join(self.tmp, name)
+            column.save(path)
+            columns[name] = Column.open(column.typecode, path)
+        return cls.from_columns(columns, rel.meta())
+
+    def test_layouts(self):
+        sparse = Relation.from_dict(SPARSE)
+        dense = Relation.from_dict(DENSE)
+        self.assertNotEqual(sparse.ids, None)
+        self.assertEqual(dense.ids, None)
+        self.assertEqual(sparse.offsets.typecode, 'i')
+        # ids, offsets and values, rather than 1002 offsets
+        self.assertEqual(sparse.nbytes(), 4 * (3 + 4 + 6))
+        for d, rel in ((SPARSE, sparse), (DENSE, dense)):
+            self.check(d, rel)
+            self.check(d, self.reopened(rel, Relation))
+
+    def test_dense_offsets(self):
+        sparse = Relation.from_dict(SPARSE)
+        offsets = sparse.dense_offsets()
+        self.assertEqual(len(offsets), 1002)
+        self.assertEqual(offsets[3:5].tolist(), [0, 2])
+        self.assertEqual(offsets[1000:].tolist(), [3, 6])
+
+    def test_extended_matches_from_dict(self):
+        for d in (SPARSE, DENSE):
+            additions = {3: [8], 2000: [9]}
+            merged = dict(d)
+            for k, v in additions.items():
+                merged[k] = merged.get(k, []) + v
+            rel = Relation.from_dict(d).extended(additions)
+            expected = Relation.from_dict(merged)
+            self.check(merged, rel)
+            self.assertEqual(
+                dict((k, c.tostring()) for k, c in rel.columns().items()),
+                dict((k, c.tostring())
+                     for k, c in expected.columns().items()))
+
+    def test_intmap(self):
+        d = {5: 1, 700: 3, 9000: 2}
+        for m in (IntMap.from_dict(d), self.reopened(IntMap.from_dict(d),
+                                                     IntMap)):
+            self.assertNotEqual(m.ids, None)
+            self.assertEqual(m.items(), sorted(d.items()))
+            self.assertEqual([m[k] for k in (4, 5, 700, 9000, 9001)],
+                             [0, 1, 3, 2, 0])
+            dense = m.dense()
+            self.assertEqual((len(dense), dense[700]), (9001, 3))
+
+        m = IntMap.from_dict(d).updated({5: 0, 6: 4})
+        self.assertEqual(m.items(), [(6, 4), (700, 3), (9000, 2)])
+        self.assertEqual(len(m), 3)
+
+        dense = IntMap.from_dict({0: 1, 1: 2, 3: 3})
+        self.assertEqual(dense.ids, None)
+        self.assertEqual(dense.items(), [(0, 1), (1, 2), (3, 3)])
+
+    def test_record_table(self):
+        table = RecordTable.from_dict({1: "a\tb", 3: "c"})
+        self.assertEqual(table.offsets.typecode, 'i')
+        self.assertEqual([table[k] for k in range(5)],
+                         ["", "a\tb", "", "c", ""])
+
+if __name__ == '__main__':
+    unittest.main()
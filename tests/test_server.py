@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""The recommendation server answers over HTTP on an ephemeral port
+"""
+
+import json
+import os
+import shutil
+import threading
+import unittest
+import urllib2
+
+from matchmaker.engine import Engine
+from matchmaker.server import LRUCache, make_server
+from support import DataTestCase
+
+# straight to localhost, whatever proxy the environment sets
+opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        self.assertEqual(cache.get(1), 'a')
+        cache.put(3, 'c')
+        self.assertEqual((cache.get(1), cache.get(2), cache.get(3)),
+                         ('a', None, 'c'))
+        self.assertEqual(len(cache), 2)
+
+class ServerTest(DataTestCase):
+    def setUp(self):
+        DataTestCase.setUp(self)
+        self.db = self.database()
+        self.httpd = make_server(self.datadir, port=0, cache_size=100)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        DataTestCase.tearDown(self)
+
+    def get(self, path):
+        """Returns (status, decoded JSON body) of a GET of path
+        """
+        url = "http://%s:%d%s" % (self.httpd.server_address + (path,))
+        try:
+            response = opener.open(url)
+        except urllib2.HTTPError, e:
+            response = e
+        try:
+            return response.getcode(), json.loads(response.read())
+        finally:
+            response.close()
+
+    def test_known_user(self):
+        user = self.db.test_u[0]
+        expected = Engine(self.db, batch=False).user_process(user)
+        self.assertEqual(self.get("/recommend?user=%d" % user),
+                         (200, {'user': user, 'repos': expected,
+                                'cached': False}))
+
+    def test_unknown_user(self):
+        user = max(self.db.u_watching) + 1000
+        status, body = self.get("/recommend?user=%d" % user)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['repos'], self.db.fallback_repos(user))
+
+    def test_malformed_user(self):
+        for path in ("/recommend?user=abc", "/recommend", "/recommend?u=1"):
+            status, body = self.get(path)
+            self.assertEqual(status, 400)
+            self.assertTrue('error' in body)
+        self.assertEqual(self.get("/nowhere")[0], 404)
+
+    def test_cache_hit(self):
+        user = self.db.test_u[1]
+        first = self.get("/recommend?user=%d" % user)[1]
+        second = self.get("/recommend?user=%d" % user)[1]
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(first['repos'], second['repos'])
+
+    def test_reload_after_manifest_change(self):
+        user = self.db.test_u[2]
+        path = "/recommend?user=%d" % user
+        self.get(path)
+        self.assertTrue(self.get(path)[1]['cached'])
+
+        # a new manifest file, as an update writes it
+        manifest = os.path.join(self.datadir, "snapshot", "manifest")
+        shutil.copy(manifest, manifest + ".new")
+        os.rename(manifest + ".new", manifest)
+        self.assertFalse(self.get(path)[1]['cached'])
+        self.assertTrue(self.get(path)[1]['cached'])
+
+        self.assertEqual(self.get("/reload"), (200, {'reloaded': True}))
+        self.assertFalse(self.get(path)[1]['cached'])
+
+    def test_stats(self):
+        user = self.db.test_u[0]
+        for i in xrange(3):
+            self.get("/recommend?user=%d" % user)
+        self.get("/recommend?user=abc")
+        status, body = self.get("/stats")
+        self.assertEqual(status, 200)
+        self.assertEqual((body['requests'], body['cache_hits'],
+                          body['cache_size']), (3, 2, 1))
+        self.assertEqual(sorted(body['latency_ms']), ['p50', 'p95', 'p99'])
+
+if __name__ == '__main__':
+    unittest.main()
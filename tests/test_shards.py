@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Merging the partial results of a sharded run gives the full run's
+"""
+
+import os
+import unittest
+
+from matchmaker import shards
+from matchmaker.engine import Engine
+from matchmaker.matrix import MatrixEngine
+from support import DataTestCase
+
+class ShardsTest(DataTestCase):
+    def setUp(self):
+        DataTestCase.setUp(self)
+        self.db = self.database()
+
+    def merged(self, cls, n):
+        """Returns the lines merged from a run of cls split in n shards
+        """
+        paths = []
+        for i in xrange(n):
+            path = shards.partial_path(i, n, os.path.join(self.tmp, "results"))
+            e = cls(self.db, shard=(i, n))
+            shards.write_partial(path, (i, n), e.result_lines())
+            paths.append(path)
+        return shards.merge(paths, self.db.test_u)
+
+    def test_split_covers_users(self):
+        users = shards.split(self.db.test_u, self.db.u_watching, 3)
+        self.assertEqual(sorted(sum(users, [])), sorted(self.db.test_u))
+
+    def test_engine_merge_matches_full_run(self):
+        full = list(Engine(self.db).result_lines())
+        self.assertEqual(self.merged(Engine, 3), full)
+
+    def test_matrix_merge_matches_full_run(self):
+        full = list(MatrixEngine(self.db).result_lines())
+        self.assertEqual(self.merged(MatrixEngine, 3), full)
+
+    def test_merge_rejects_missing_shard(self):
+        path = shards.partial_path(0, 2, os.path.join(self.tmp, "results"))
+        shards.write_partial(path, (0, 2),
+                             Engine(self.db, shard=(0, 2)).result_lines())
+        self.assertRaises(ValueError, shards.merge, [path], self.db.test_u)
+
+if __name__ == '__main__':
+    unittest.main()